@@ -0,0 +1,96 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measure the memory that forked processes stop sharing with their parent
+when they read a document loaded by the parent
+
+Run with ``python benchmarks/fork.py [records] [workers]`` (Linux only).
+Each worker reads every record through document fragments and reports the
+memory that is private to it (Private_Clean + Private_Dirty of
+/proc/self/smaps_rollup), that is the pages it copied.
+"""
+
+from __future__ import print_function
+
+import gc
+import os
+import sys
+
+from json_document.document import Document
+
+
+def private_memory():
+    total = 0
+    with open("/proc/self/smaps_rollup") as stream:
+        for line in stream:
+            if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                total += int(line.split()[1])
+    return total * 1024
+
+
+def make_document(size):
+    return Document({"records": [
+        {"id": index, "name": "record {0}".format(index), "tags": ["a", "b"]}
+        for index in range(size)]})
+
+
+def read_everything(doc):
+    total = 0
+    for record in doc["records"]:
+        total += record["id"].value + len(record["name"].value)
+    return total
+
+
+def measure(name, doc, num_workers):
+    pipes = []
+    for index in range(num_workers):
+        read_end, write_end = os.pipe()
+        if os.fork() == 0:
+            os.close(read_end)
+            before = private_memory()
+            read_everything(doc)
+            gc.collect()
+            os.write(write_end, str(private_memory() - before).encode())
+            os._exit(0)
+        os.close(write_end)
+        pipes.append(read_end)
+    copied = []
+    for read_end in pipes:
+        copied.append(int(os.read(read_end, 100)))
+        os.close(read_end)
+        os.wait()
+    print("{0:<24} {1:>10.1f}".format(
+        name, sum(copied) / len(copied) / 1024.0 / 1024.0))
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    print("{0} records, MiB copied per worker:".format(size))
+    measure("regular", make_document(size), num_workers)
+    doc = make_document(size)
+    doc.freeze()
+    measure("frozen", doc, num_workers)
+    del doc
+    doc = make_document(size)
+    doc.freeze(gc_freeze=True)
+    measure("frozen, gc.freeze()", doc, num_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compare loading many documents one after another with PersistenceGroup
+
+Run with ``python benchmarks/group.py [directory]``. Use a directory on the
+storage you care about, the page cache is not dropped between runs. The
+last case simulates storage with 5ms of latency per read (like a network
+file system or a cold disk).
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from json_document.document import Document, DocumentPersistence
+from json_document.parallel import PersistenceGroup
+from json_document.serializers import JSON
+from json_document.storage import FileStorage
+
+
+class SlowStorage(FileStorage):
+
+    def read_bytes(self):
+        time.sleep(0.005)
+        return super(SlowStorage, self).read_bytes()
+
+    def read(self):
+        time.sleep(0.005)
+        return super(SlowStorage, self).read()
+
+    def read_buffer(self):
+        time.sleep(0.005)
+        return super(SlowStorage, self).read_buffer()
+
+
+def make_persistences(dirname, count, size, storage_cls):
+    persistences = []
+    for index in range(count):
+        pathname = os.path.join(dirname, "{0}.json".format(index))
+        if not os.path.exists(pathname):
+            FileStorage(pathname).write(JSON.dumps({"records": [
+                {"id": item, "name": "record {0}".format(item)}
+                for item in range(size)]}))
+        persistences.append(
+            DocumentPersistence(Document({}), storage_cls(pathname), JSON))
+    return persistences
+
+
+def measure(name, dirname, count, size, storage_cls, load):
+    persistences = make_persistences(dirname, count, size, storage_cls)
+    start = time.time()
+    errors = load(persistences)
+    elapsed = time.time() - start
+    assert not errors
+    print("{0:<24} {1:>10.3f}".format(name, elapsed))
+
+
+def serial(persistences):
+    for persistence in persistences:
+        persistence.load()
+
+
+def main():
+    parent = sys.argv[1] if len(sys.argv) > 1 else os.curdir
+    for count, size, storage_cls in (
+            (3000, 10, FileStorage),
+            (20, 100000, FileStorage),
+            (300, 10, SlowStorage)):
+        dirname = tempfile.mkdtemp(dir=parent)
+        try:
+            print("{0} documents with {1} records ({2}), seconds:".format(
+                count, size, storage_cls.__name__))
+            measure("serial", dirname, count, size, storage_cls, serial)
+            measure("group", dirname, count, size, storage_cls,
+                    lambda persistences: PersistenceGroup(
+                        persistences).load())
+            measure("group with processes", dirname, count, size,
+                    storage_cls, lambda persistences: PersistenceGroup(
+                        persistences, processes=None).load())
+        finally:
+            shutil.rmtree(dirname)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compare the cost of saving a small edit with and without a journal (or an
+SQLite database that stores the document in rows)
+
+Run with ``python benchmarks/journal.py [directory]``. Each save changes a
+single value in a document with the given number of records.
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from json_document.document import (
+    Document,
+    DocumentPersistence,
+    JournalPersistence,
+    SQLitePersistence)
+from json_document.serializers import JSON
+from json_document.storage import FileStorage, JournalStorage, SQLiteStorage
+
+
+def make_document(size):
+    return Document({"records": [
+        {"id": index, "name": "record {0}".format(index), "tags": ["a", "b"]}
+        for index in range(size)]})
+
+
+def measure(name, doc, persistence, number):
+    counter = [0]
+
+    def edit_and_save():
+        counter[0] += 1
+        doc["records"][counter[0] % len(doc["records"])]["id"] = -counter[0]
+        persistence.save()
+    persistence.save()
+    elapsed = min(timeit.repeat(edit_and_save, number=number, repeat=3))
+    print("{0:<24} {1:>10.3f}".format(name, elapsed / number * 1000))
+
+
+def main():
+    parent = sys.argv[1] if len(sys.argv) > 1 else os.curdir
+    dirname = tempfile.mkdtemp(dir=parent)
+    try:
+        pathname = os.path.join(dirname, "document.json")
+        for size in (100, 10000, 100000):
+            number = max(10, 1000000 // size // 10)
+            print("{0} records, ms per save:".format(size))
+            doc = make_document(size)
+            measure("full rewrite", doc,
+                    DocumentPersistence(doc, FileStorage(pathname), JSON),
+                    number)
+            doc = make_document(size)
+            measure("atomic full rewrite", doc, DocumentPersistence(
+                doc, FileStorage(pathname, atomic=True), JSON), number)
+            doc = make_document(size)
+            measure("journal", doc, JournalPersistence(
+                doc, JournalStorage(pathname), JSON), number)
+            doc = make_document(size)
+            storage = SQLiteStorage(
+                os.path.join(dirname, "{0}.sqlite".format(size)), depth=2)
+            measure("sqlite", doc, SQLitePersistence(doc, storage), number)
+            storage.close()
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compare read throughput of a document shared by reader threads and one
+writer: a global mutex, the reader/writer lock of ConcurrentDocument and
+lock-free snapshots
+
+Run with ``python benchmarks/locking.py [readers]``. The writer changes one
+value every millisecond, each reader looks up one value in a loop.
+"""
+
+from __future__ import print_function
+
+import sys
+import threading
+import time
+
+from json_document.locking import ConcurrentDocument
+
+DURATION = 1.0
+
+
+def make_document(size):
+    return ConcurrentDocument({"records": [
+        {"id": index, "name": "record {0}".format(index)}
+        for index in range(size)]})
+
+
+def global_mutex(doc):
+    mutex = threading.Lock()
+
+    def read(index):
+        with mutex:
+            return doc["records"][index]["name"].value
+
+    def write(index):
+        with mutex:
+            doc["records"][index]["id"] = -index
+    return read, write
+
+
+def read_write_lock(doc):
+    def read(index):
+        with doc.reading():
+            return doc["records"][index]["name"].value
+
+    def write(index):
+        with doc.writing():
+            doc["records"][index]["id"] = -index
+    return read, write
+
+
+def snapshot(doc):
+    def read(index):
+        return doc.snapshot()["records"][index]["name"]
+
+    def write(index):
+        with doc.writing():
+            doc["records"][index]["id"] = -index
+    return read, write
+
+
+def measure(name, make_functions, num_readers, size=1000):
+    doc = make_document(size)
+    read, write = make_functions(doc)
+    stop = threading.Event()
+    counts = [0] * num_readers
+
+    def reader(slot):
+        index = 0
+        while not stop.is_set():
+            index = (index + 7) % size
+            read(index)
+            counts[slot] += 1
+
+    def writer():
+        index = 0
+        while not stop.is_set():
+            index = (index + 13) % size
+            write(index)
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=reader, args=(slot,))
+               for slot in range(num_readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    print("{0:<24} {1:>12.0f}".format(name, sum(counts) / DURATION))
+
+
+def main():
+    num_readers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    print("{0} readers, reads per second:".format(num_readers))
+    measure("global mutex", global_mutex, num_readers)
+    measure("read/write lock", read_write_lock, num_readers)
+    measure("snapshot", snapshot, num_readers)
+
+
+if __name__ == "__main__":
+    main()
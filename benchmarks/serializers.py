@@ -0,0 +1,101 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare size and load/dump throughput of the serializers
+
+Run with ``python benchmarks/serializers.py [number-of-test-results]``
+"""
+
+from __future__ import print_function
+
+import sys
+import timeit
+from decimal import Decimal
+
+from simplejson import OrderedDict
+
+from json_document import serializers
+from json_document.serializers import IndexedBinary, JSON, MessagePack
+
+
+def make_document(count):
+    return OrderedDict([
+        ("format", "Dashboard Bundle Format 1.0"),
+        ("test_runs", [OrderedDict([
+            ("test_id", "benchmark"),
+            ("analyzer_assigned_uuid", "1ab86b36-c23d-11df-a81b-002163936223"),
+            ("time_check_performed", False),
+            ("test_results", [OrderedDict([
+                ("test_case_id", "test-case-%d" % i),
+                ("result", "pass" if i % 3 else "fail"),
+                ("measurement", Decimal("%d.%03d" % (i, i % 1000))),
+                ("units", "ms"),
+                ("attributes", {"iteration": i, "note": None}),
+            ]) for i in range(count)]),
+        ])]),
+    ])
+
+
+def measure(name, dumps, loads, doc, repeat=3):
+    data = dumps(doc)
+    dump_time = min(timeit.repeat(lambda: dumps(doc), number=1, repeat=repeat))
+    load_time = min(timeit.repeat(lambda: loads(data), number=1, repeat=repeat))
+    print("{0:<28} {1:>10} {2:>10.1f} {3:>10.1f}".format(
+        name, len(data), dump_time * 1000, load_time * 1000))
+    return len(data), dump_time, load_time
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    doc = make_document(count)
+    print("{0:<28} {1:>10} {2:>10} {3:>10}".format(
+        "serializer", "bytes", "dump ms", "load ms"))
+    measure("JSON (human readable)", JSON.dumps, JSON.loads, doc)
+    measure("JSON (compact)",
+            lambda doc: JSON.dumps(doc, human_readable=False),
+            JSON.loads, doc)
+    msgpack = serializers.msgpack
+    if msgpack is not None:
+        measure("MessagePack (msgpack)",
+                MessagePack.dumps, MessagePack.loads, doc)
+    serializers.msgpack = None
+    try:
+        measure("MessagePack (pure Python)",
+                MessagePack.dumps, MessagePack.loads, doc)
+    finally:
+        serializers.msgpack = msgpack
+    measure("IndexedBinary", IndexedBinary.dumps, IndexedBinary.loads, doc)
+    # Reading one value does not need to decode the whole document
+    print()
+    index = count // 2
+    for name, data, get in (
+            ("JSON (compact)", JSON.dumps(doc, human_readable=False),
+             JSON.loads),
+            ("MessagePack", MessagePack.dumps(doc), MessagePack.loads),
+            ("IndexedBinary (view)", IndexedBinary.dumps(doc),
+             IndexedBinary.view)):
+        lookup_time = min(timeit.repeat(
+            lambda: get(data)["test_runs"][0]["test_results"][index][
+                "measurement"], number=1, repeat=3))
+        print("{0:<28} {1:>10.3f} ms to read one value".format(
+            name, lookup_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare reading a config value from a local copy of the document and from
+a DocumentServer
+
+Run with ``python benchmarks/server.py [number-of-records]``. Loading a
+local copy is what each worker process does without the server.
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from json_document.document import Document, DocumentPersistence
+from json_document.serializers import JSON
+from json_document.server import DocumentClient, DocumentServer
+from json_document.storage import FileStorage
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    dirname = tempfile.mkdtemp()
+    try:
+        pathname = os.path.join(dirname, "config.json")
+        FileStorage(pathname).write(JSON.dumps({"records": [
+            {"id": index, "name": "record {0}".format(index)}
+            for index in range(size)], "setting": 1}))
+        persistence = DocumentPersistence(
+            Document({}), FileStorage(pathname), JSON)
+        persistence.load()
+        address = os.path.join(dirname, "socket")
+        with DocumentServer(persistence, address):
+            cached = DocumentClient(address)
+            uncached = DocumentClient(address, subscribe=False, cache=False)
+
+            def load_copy():
+                copy = DocumentPersistence(
+                    Document({}), FileStorage(pathname), JSON)
+                copy.load()
+                return copy.document["setting"].value
+
+            for name, function, number in (
+                    ("load a local copy", load_copy, 5),
+                    ("get (round trip)",
+                     lambda: uncached.get("/setting"), 2000),
+                    ("get (cached)", lambda: cached.get("/setting"), 2000)):
+                best = min(timeit.repeat(function, number=number, repeat=3))
+                print("{0:<24} {1:>10.1f} us".format(
+                    name, best / number * 1e6))
+            cached.close()
+            uncached.close()
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == "__main__":
+    main()
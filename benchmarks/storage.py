@@ -0,0 +1,65 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the cost of plain and atomic FileStorage writes
+
+Run with ``python benchmarks/storage.py [directory]``. The directory (the
+current directory by default) should be on the file system you care about
+because the cost of fsync() depends on it very much.
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from json_document.storage import FileStorage
+
+
+def measure(name, storage, data, number):
+    elapsed = min(timeit.repeat(
+        lambda: storage.write(data), number=number, repeat=3))
+    print("{0:<24} {1:>10.3f}".format(name, elapsed / number * 1000))
+
+
+def main():
+    parent = sys.argv[1] if len(sys.argv) > 1 else os.curdir
+    dirname = tempfile.mkdtemp(dir=parent)
+    try:
+        pathname = os.path.join(dirname, "document.json")
+        for size in (1024, 1024 ** 2, 16 * 1024 ** 2):
+            data = b"x" * size
+            number = max(1, 2 ** 24 // size // 4)
+            print("{0} bytes, ms per write:".format(size))
+            measure("plain", FileStorage(pathname), data, number)
+            measure("plain + fsync",
+                    FileStorage(pathname, fsync=True), data, number)
+            measure("atomic", FileStorage(pathname, atomic=True), data, number)
+            measure("atomic + fsync",
+                    FileStorage(pathname, atomic=True, fsync=True),
+                    data, number)
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+json_document.aio
+-----------------
+
+Persistence and change notifications for asyncio applications (Python 3
+only)
+"""
+
+import asyncio
+import functools
+
+from json_document.document import Document, DocumentPersistence
+from json_document.storage import FileStorage
+
+
+class AsyncStorage(object):
+    """
+    Asynchronous interface to any (blocking) storage object
+
+    Each method runs the corresponding method of storage in executor (the
+    default executor of the event loop if None) so that slow disks do not
+    stall the event loop.
+    """
+
+    def __init__(self, storage, executor=None):
+        self.storage = storage
+        self.executor = executor
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in the executor and return the result
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def read(self):
+        return await self.run(self.storage.read)
+
+    async def read_bytes(self):
+        return await self.run(self.storage.read_bytes)
+
+    async def write(self, text):
+        await self.run(self.storage.write, text)
+
+    async def fingerprint(self, content=False):
+        return await self.run(self.storage.fingerprint, content)
+
+
+class AsyncFileStorage(AsyncStorage):
+    """
+    Asynchronous interface to :class:`~json_document.storage.FileStorage`
+    """
+
+    def __init__(self, pathname, ignore_missing=False, atomic=False,
+                 fsync=False, executor=None, use_mmap=None):
+        super().__init__(
+            FileStorage(pathname, ignore_missing, atomic, fsync, use_mmap),
+            executor)
+
+    @property
+    def pathname(self):
+        return self.storage.pathname
+
+
+class AsyncDocumentPersistence(DocumentPersistence):
+    """
+    DocumentPersistence with coroutines for loading and saving
+
+    The storage is an :class:`AsyncStorage` instance (plain storage objects
+    are wrapped automatically). :meth:`aload()` and :meth:`asave()` work
+    like load() and save() but read, parse, serialize and write the
+    document in the executor of the storage. Only the final update of the
+    document value happens in the event loop. The blocking load() and
+    save() methods are still available.
+
+    The document is copied in the event loop (see
+    :meth:`~json_document.document.DocumentPersistence._get_snapshot()`)
+    before it is handed over to the executor, other coroutines can modify
+    the document while the copy is serialized. Documents that are also
+    modified by other threads must not be saved with :meth:`asave()`.
+    """
+
+    def __init__(self, document, storage, serializer=None,
+                 check_content=False, preserve_fragments=False):
+        if not isinstance(storage, AsyncStorage):
+            storage = AsyncStorage(storage)
+        super().__init__(
+            document, storage.storage, serializer,
+            check_content=check_content,
+            preserve_fragments=preserve_fragments)
+        self.async_storage = storage
+        self._lock = None
+
+    def _get_lock(self):
+        # Created lazily so that it belongs to the running loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def aload(self, only=None, force=False):
+        """
+        Load the document from the storage layer, see load()
+
+        Other coroutines can modify the document while it is read. Their
+        changes are not overwritten: the loaded value is discarded and False
+        is returned in that case.
+        """
+        only, projection = self._get_projection(only)
+        async with self._get_lock():
+            revision = self.document.revision
+            if not force and await self.async_storage.run(
+                    self._is_up_to_date, projection):
+                return False
+            fingerprint, obj = await self.async_storage.run(
+                self._read, only)
+            if self.document.revision != revision:
+                return False
+            self._set_loaded_value(obj, projection, fingerprint)
+            return True
+
+    def _serialize(self, obj, projection):
+        """
+        Serialize a snapshot of the document
+
+        Partial documents (projection is not None) are merged into the
+        stored document first.
+        """
+        if projection is not None:
+            obj = self._merge_into_stored(obj, projection)
+            if self.serializer.needs_real_object:
+                obj = Document(obj)
+        return self.serializer.dumps(obj)
+
+    def _write(self, text):
+        self.storage.write(text)
+        return self.storage.fingerprint(self.check_content)
+
+    async def asave(self, merge=False):
+        """
+        Save the document to the storage layer, see save()
+        """
+        async with self._get_lock():
+            if not self.is_dirty:
+                return
+            revision = self.document.revision
+            if merge and self.document.is_partial:
+                obj = self._copy_document_value()
+                projection = self.document.projection
+            else:
+                obj = self._get_snapshot()
+                projection = None
+            text = await self.async_storage.run(
+                self._serialize, obj, projection)
+            self.fingerprint = await self.async_storage.run(
+                self._write, text)
+            self.last_revision = revision
+
+
+def subscribe_queue(document, pattern, loop=None):
+    """
+    Receive changes of document through an asyncio queue
+
+    Works like :meth:`Document.subscribe()
+    <json_document.document.Document.subscribe>` but the lists of JSON
+    Pointers of changed values are put into a queue instead of being passed
+    to a callback. They are handed over with call_soon_threadsafe() of loop
+    (the current event loop if None) so the document can also be modified
+    by other threads, for example reloaded by a
+    :class:`~json_document.watcher.Watcher`.
+
+    Returns a (queue, subscription) pair, cancel the subscription to stop
+    receiving changes.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    queue = asyncio.Queue()
+
+    def callback(changes):
+        loop.call_soon_threadsafe(queue.put_nowait, changes)
+    return queue, document.subscribe(pattern, callback)
@@ -0,0 +1,178 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+json_document.autosave
+----------------------
+
+Saving documents in the background
+"""
+
+import threading
+import time
+
+from json_document.document import DocumentPersistence
+
+
+class AutoSave(object):
+    """
+    Save a document in a background thread shortly after it changes.
+
+    AutoSave observes the document of a
+    :class:`~json_document.document.DocumentPersistence` instance. Changes
+    are coalesced: the document is saved delay seconds after the last
+    change, but no later than max_delay seconds after the first unsaved
+    one. The application thread only pays for recording the time of the
+    change, serialization and storage I/O happen in the background. The
+    document is written like save() of the persistence writes it, streamed
+    with open_write() of the storage if the persistence is streaming.
+
+    The background thread never serializes the document itself, other
+    threads could modify it in the middle. Instead it copies the value (see
+    :meth:`~json_document.document.DocumentPersistence._get_snapshot()`)
+    while the document is not being modified and serializes the copy. This
+    requires cooperation of the thread that modifies the document: the
+    document must be a :class:`~json_document.locking.ConcurrentDocument`
+    that is modified within its writing() context (the copy is made within
+    reading()) or lock must be a lock (any context manager) that is held
+    while the document is modified (the copy is made while holding it).
+    Other documents are rejected with TypeError.
+
+    Errors are passed to on_error, together with the persistence, or
+    ignored if it is None. The document is then saved again on the next
+    change (or flush).
+
+    Call :meth:`close()` (or use AutoSave as a context manager) to stop the
+    background thread and save any remaining changes. Do not call
+    save() of the persistence directly while AutoSave is active, use
+    :meth:`flush()` instead.
+
+    Only plain DocumentPersistence is supported, persistence classes that
+    track individual changes (such as
+    :class:`~json_document.document.JournalPersistence`) must be saved by
+    the thread that modifies the document.
+    """
+
+    def __init__(self, persistence, delay=0.5, max_delay=5.0, lock=None,
+                 on_error=None):
+        if type(persistence).save != DocumentPersistence.save:
+            raise TypeError(
+                "AutoSave does not support %s" % type(persistence).__name__)
+        if lock is not None:
+            self._reading = lambda: lock
+        elif hasattr(persistence.document, "reading"):
+            self._reading = persistence.document.reading
+        else:
+            raise TypeError(
+                "AutoSave needs a ConcurrentDocument or a lock that is held"
+                " while the document is modified")
+        self.persistence = persistence
+        self.delay = delay
+        self.max_delay = max_delay
+        self.on_error = on_error
+        self._condition = threading.Condition()
+        # Time of the first and last unsaved change (or None)
+        self._first_change = None
+        self._last_change = None
+        self._closing = False
+        # Held while writing to the storage
+        self._save_lock = threading.Lock()
+        persistence.document._observers.append(self._changed)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _changed(self, fragment, item):
+        now = time.time()
+        with self._condition:
+            if self._first_change is None:
+                self._first_change = now
+                self._condition.notify()
+            self._last_change = now
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._closing:
+                    return
+                if self._first_change is None:
+                    self._condition.wait()
+                    continue
+                deadline = min(self._last_change + self.delay,
+                               self._first_change + self.max_delay)
+                now = time.time()
+                if now < deadline:
+                    self._condition.wait(deadline - now)
+                    continue
+                self._first_change = self._last_change = None
+            try:
+                self._save()
+            except Exception as exc:
+                if self.on_error is not None:
+                    self.on_error(self.persistence, exc)
+
+    def _save(self):
+        """
+        Save the document if it was modified
+        """
+        persistence = self.persistence
+        with self._save_lock:
+            with self._reading():
+                revision = persistence.document.revision
+                if revision == persistence.last_revision:
+                    return
+                obj = persistence._get_snapshot()
+            if persistence.streaming:
+                with persistence.storage.open_write() as stream:
+                    persistence.serializer.dump(stream, obj)
+            else:
+                text = persistence.serializer.dumps(obj)
+                persistence.storage.write(text)
+            persistence.last_revision = revision
+            persistence._remember_fingerprint()
+
+    def flush(self):
+        """
+        Save all the changes now.
+
+        Errors are raised to the caller instead of being passed to
+        on_error. Do not call this while holding the lock (or within
+        writing() of the document).
+        """
+        with self._condition:
+            self._first_change = self._last_change = None
+        self._save()
+
+    def close(self):
+        """
+        Stop the background thread and save any remaining changes
+        """
+        with self._condition:
+            if self._closing:
+                return
+            self._closing = True
+            self._condition.notify()
+        self._thread.join()
+        self.persistence.document._observers.remove(self._changed)
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -27,6 +27,9 @@ high-level DocumentFragments (which would require you to access each value via
 the .value property) but want to offer a pythonic API instead.
 """
 
+from json_document import pointer
+from json_document.document import _ReadTracker
+
 
 def fragment(func):
     """
@@ -98,3 +101,88 @@ def readwrite(func):
         del self[func.__name__]
 
     return property(_get, _set, _del, func.__doc__)
+
+
+def _subtree_revision(fragment, path):
+    """
+    Get the subtree_revision of the value at path (list of items)
+
+    If the value does not exist the revision of the deepest existing
+    fragment on the way is used instead, adding the value changes it.
+    """
+    for item in path:
+        if isinstance(fragment._peek_value(), list) and not isinstance(
+                item, int):
+            if not item.isdigit():
+                break
+            item = int(item)
+        try:
+            fragment = fragment[item]
+        except (LookupError, TypeError):
+            break
+    return fragment.subtree_revision
+
+
+def computed(func=None, depends=None):
+    """
+    Cached value computed from other parts of the document.
+
+    The decorated function is called to compute the value, like with a
+    property, but the result is cached. It is computed again only when the
+    values it depends on change (see
+    :attr:`~json_document.document.DocumentFragment.subtree_revision`).
+    Changes made to other parts of the document keep the cached value.
+
+    Without arguments the dependencies are tracked automatically: they are
+    the fragments that the function read while computing the value::
+
+        @bridge.computed
+        def total(self):
+            return sum(item["price"].value for item in self["items"])
+
+    Iterating over ``self["items"]`` makes the total depend on the whole
+    list. Fragments read by other bridges (including other computed values)
+    called by the function are tracked as well. Alternatively the
+    dependencies can be listed as JSON Pointers relative to the fragment
+    the property is defined on, then nothing is tracked::
+
+        @bridge.computed(depends=["/items"])
+        def total(self):
+            ...
+
+    Checking whether the cached value is still valid looks up each
+    dependency, so the function should do more than a few lookups to
+    benefit from caching. The cache is kept in the instance __dict__,
+    classes that use __slots__ only compute the value each time.
+    """
+    if func is None:
+        return lambda func: computed(func, depends)
+    name = func.__name__
+    if depends is not None:
+        declared = [pointer.split(path) for path in depends]
+
+    def _get(self):
+        cache = getattr(self, "__dict__", None)
+        root = self._document if self._document is not None else self
+        cached = cache.get(name) if cache is not None else None
+        if cached is not None:
+            paths, revisions, value = cached
+            if revisions == [_subtree_revision(root, path)
+                             for path in paths]:
+                return value
+        if depends is not None:
+            prefix = self._path()
+            paths = [prefix + path for path in declared]
+            revisions = [_subtree_revision(root, path) for path in paths]
+            value = func(self)
+        else:
+            with _ReadTracker(root) as tracker:
+                value = func(self)
+            paths = tracker.paths()
+            # The paths are only known now, func must not modify the values
+            # it reads
+            revisions = [_subtree_revision(root, path) for path in paths]
+        if cache is not None:
+            cache[name] = (paths, revisions, value)
+        return value
+    return property(_get, None, None, func.__doc__)
@@ -23,12 +23,145 @@ json_document.document
 Document and fragment classes
 """
 
+import contextlib
 import copy
+import decimal
+import gc
+import threading
 from json_schema_validator.errors import SchemaError
 from json_schema_validator.schema  import Schema
 from json_schema_validator.validator import Validator
+import simplejson
 
-from json_document.errors import OrphanedFragmentError
+from json_document import pointer
+from json_document.errors import (
+    FrozenDocumentError,
+    OrphanedFragmentError,
+    PartialDocumentError)
+
+try:
+    from types import MappingProxyType
+except ImportError:
+    # Python 2 has no read-only dictionary views
+    MappingProxyType = dict
+
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
+
+try:
+    _string_types = (basestring, bytearray)
+except NameError:
+    _string_types = (str, bytes, bytearray)
+
+
+# Besides dictionaries and lists documents can hold read-only values: those
+# of frozen documents and views of IndexedBinary files.
+
+def _is_object(value):
+    return isinstance(value, dict) or isinstance(value, Mapping)
+
+
+def _is_array(value):
+    return isinstance(value, list) or (
+        isinstance(value, Sequence)
+        and not isinstance(value, _string_types))
+
+
+def _same_value(a, b):
+    """
+    Check if two values are equal and are serialized the same way
+
+    Unlike with == True differs from 1, 1.0 from 1 and Decimal("1.0") from
+    Decimal("1.00"). Members of objects must be in the same order.
+    """
+    if a != b:
+        return False
+    if _is_object(a):
+        return (_is_object(b) and list(a) == list(b)
+                and all(_same_value(a[key], b[key]) for key in a))
+    elif _is_array(a):
+        return _is_array(b) and all(
+            _same_value(item, other) for item, other in zip(a, b))
+    elif isinstance(a, bool) or isinstance(b, bool):
+        return type(a) is type(b)
+    elif isinstance(a, decimal.Decimal) or isinstance(b, decimal.Decimal):
+        return (isinstance(a, decimal.Decimal)
+                and isinstance(b, decimal.Decimal)
+                and a.as_tuple() == b.as_tuple())
+    elif isinstance(a, float) or isinstance(b, float):
+        return isinstance(a, float) and isinstance(b, float)
+    return True
+
+
+# Number of _ReadTracker instances in use (in any thread), checked before
+# looking at the thread-local state so that reading is not slowed down when
+# nothing is tracked
+_tracking = 0
+_tracking_lock = threading.Lock()
+_tracking_local = threading.local()
+
+
+class _ReadTracker(object):
+    """
+    Record of the fragments of a document read by the current thread
+
+    Accessed lists fragments obtained with __getitem__, read lists fragments
+    whose value (or length, or items) was inspected. Trackers can be nested,
+    the enclosing trackers see everything the inner ones see.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.accessed = []
+        self.read = []
+        self.outer = None
+
+    def __enter__(self):
+        global _tracking
+        with _tracking_lock:
+            _tracking += 1
+        self.outer = getattr(_tracking_local, "tracker", None)
+        _tracking_local.tracker = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _tracking
+        _tracking_local.tracker = self.outer
+        with _tracking_lock:
+            _tracking -= 1
+
+    def paths(self):
+        """
+        Get the paths of the values that the reads depend on
+
+        Those are the values that were read and the accessed fragments that
+        were not used to access other fragments. Paths inside other paths
+        are left out.
+        """
+        read = set(id(fragment) for fragment in self.read)
+        parents = set(id(fragment._parent) for fragment in self.accessed)
+        paths = set()
+        for fragment in self.read + self.accessed:
+            if id(fragment) in read or id(fragment) not in parents:
+                paths.add(tuple(fragment._path()))
+        return sorted(
+            (path for path in paths
+             if not any(path[:length] in paths
+                        for length in range(len(path)))),
+            key=len)
+
+
+def _record_read(fragment, read):
+    tracker = getattr(_tracking_local, "tracker", None)
+    while tracker is not None:
+        if fragment._document is tracker.document:
+            if read:
+                tracker.read.append(fragment)
+            else:
+                tracker.accessed.append(fragment)
+        tracker = tracker.outer
 
 
 class DefaultValue(object):
@@ -44,6 +177,87 @@ class DefaultValue(object):
 DefaultValue = DefaultValue()
 
 
+class LazyValue(object):
+    """
+    Placeholder for a value that is loaded on first access.
+
+    Placeholders can be put in the value of a document fragment (this is
+    what :class:`DirectoryPersistence` does). Accessing the item through
+    :meth:`DocumentFragment.__getitem__()` calls loader and replaces the
+    placeholder with the result, the document revision does not change.
+    Getting the :attr:`~DocumentFragment.value` of the fragment loads all
+    the remaining placeholders so they are never visible outside.
+    """
+
+    __slots__ = ('loader',)
+
+    def __init__(self, loader):
+        self.loader = loader
+
+
+# Maps Document subclasses to (document_schema, unwrapped document_schema)
+_unwrapped_schema_cache = {}
+
+
+def _freeze(value):
+    """
+    Make a read-only copy of a JSON value
+
+    Objects become read-only mappings, arrays become tuples
+    """
+    if isinstance(value, dict):
+        return MappingProxyType(dict(
+            (key, _freeze(item)) for key, item in value.items()))
+    elif isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    else:
+        return value
+
+
+def _thaw(value):
+    """
+    Make a regular (mutable) copy of a read-only value
+    """
+    if _is_object(value):
+        return dict((key, _thaw(item)) for key, item in value.items())
+    elif _is_array(value):
+        return [_thaw(item) for item in value]
+    else:
+        return value
+
+
+def _loaded_tokens(obj, tokens):
+    """
+    Get the tokens of the value that loading tokens from obj loads
+
+    Arrays are loaded as a whole (see loads_partial() of the serializers),
+    a pointer that leads through an array of obj loads the array.
+    """
+    for index, token in enumerate(tokens):
+        if _is_array(obj):
+            return tokens[:index]
+        if not _is_object(obj) or token not in obj:
+            break
+        obj = obj[token]
+    return tokens
+
+
+def _copy_value(value):
+    """
+    Copy all the objects and arrays of a JSON value
+
+    Other values are immutable and shared with the copy. Objects keep their
+    class (such as OrderedDict).
+    """
+    if isinstance(value, dict):
+        return value.__class__(
+            (key, _copy_value(item)) for key, item in value.items())
+    elif isinstance(value, list):
+        return [_copy_value(item) for item in value]
+    else:
+        return value
+
+
 def _unwrap(obj):
     if isinstance(obj, type) and issubclass(obj, Document):
         tmp = _unwrap(obj.document_schema)
@@ -89,7 +303,7 @@ class DocumentFragment(object):
     """
 
     __slots__ = ('_document', '_parent', '_value', '_item', '_schema',
-                 '_fragment_cache')
+                 '_fragment_cache', '_lazy_items', '_subtree_revision')
 
     def __init__(self, document, parent, value, item=None, schema=None):
         self._document = document
@@ -98,6 +312,11 @@ class DocumentFragment(object):
         self._item = item
         self._schema = schema
         self._fragment_cache = {}
+        # Number of LazyValue placeholders in _value
+        self._lazy_items = 0
+        # Any change inside this fragment also changed the parent, see
+        # subtree_revision (fragments may be used without a real parent)
+        self._subtree_revision = getattr(parent, '_subtree_revision', 0)
 
     @classmethod
     def _make_fragment(cls, document, parent, value, item=None, schema=None):
@@ -121,6 +340,35 @@ class DocumentFragment(object):
         if self._schema is not None:
             return Schema(self._schema)
 
+    @property
+    def subtree_revision(self):
+        """
+        Revision of the document when this value (or anything inside it)
+        was last changed.
+
+        Each modification of the document sets the subtree_revision of the
+        modified fragment and of all its parents to the new
+        :attr:`~Document.revision` of the document, so for the document
+        itself the two are equal. Changes made elsewhere do not affect it.
+        Caches of values computed from a part of a document can be keyed on
+        the path and subtree_revision of that part.
+
+        A fragment created after the last change of its value starts with
+        the subtree_revision of its parent, which can be higher than
+        needed. The subtree_revision of list items that are moved by
+        removing an earlier item is bumped as well, since their index
+        changes.
+        """
+        return self._subtree_revision
+
+    def _touch_subtree(self, revision):
+        """
+        Set subtree_revision of this fragment and its cached fragments
+        """
+        self._subtree_revision = revision
+        for fragment in self._fragment_cache.values():
+            fragment._touch_subtree(revision)
+
     @property
     def is_default(self):
         """
@@ -142,6 +390,7 @@ class DocumentFragment(object):
         Revert the value that this fragment points to to the default value.
         """
         self._ensure_not_orphaned()
+        self._ensure_not_frozen()
         if not self.default_value_exists:
             raise TypeError("Default value does not exist")
         if self._value is not DefaultValue:
@@ -153,7 +402,7 @@ class DocumentFragment(object):
             # Set the new value
             self._lowlevel_set_value(DefaultValue)
             # Bump the document revision
-            self._document._bump_revision()
+            self._notify_item_changed()
 
     @property
     def default_value(self):
@@ -188,17 +437,50 @@ class DocumentFragment(object):
         Validate the fragment value against the schema
         """
         if self._schema is not None:
-            Validator.validate(self.schema, self.value)
+            value = self.value
+            if getattr(self._document, '_frozen', False):
+                # The validator only knows about dictionaries and lists
+                value = _thaw(value)
+            Validator.validate(self.schema, value)
 
     def _get_value(self):
+        if _tracking:
+            _record_read(self, True)
+        if self._lazy_items:
+            self._load_lazy_items()
+        return self._peek_value()
+
+    def _peek_value(self):
+        """
+        Get the value without loading LazyValue placeholders
+        """
         if self.is_default:
             return self.default_value
         else:
             return self._value
 
+    def _load_lazy_item(self, item):
+        """
+        Get an item of the value, loading it if it is a LazyValue
+        """
+        value = self._value[item]
+        if isinstance(value, LazyValue):
+            value = self._value[item] = value.loader()
+            self._lazy_items -= 1
+        return value
+
+    def _load_lazy_items(self):
+        if isinstance(self._value, dict):
+            items = list(self._value.keys())
+        else:
+            items = range(len(self._value))
+        for item in items:
+            self._load_lazy_item(item)
+
     def _set_value(self, new_value):
         self._ensure_not_orphaned()
-        if self._value != new_value:
+        self._ensure_not_frozen()
+        if not _same_value(self._value, new_value):
             # Ensure there are no defaults around
             self._ensure_not_default()
             # Orphan all existing fragments in our fragment cache
@@ -209,7 +491,7 @@ class DocumentFragment(object):
             # Set the new value
             self._lowlevel_set_value(new_value)
             # Bump the document revision
-            self._document._bump_revision()
+            self._document._fragment_modified(self)
 
     value = property(_get_value, _set_value, None, """
         Value being wrapped by this document fragment.
@@ -232,6 +514,67 @@ class DocumentFragment(object):
         revision of the whole document.
         """)
 
+    def _merge_value(self, new_value):
+        """
+        Change the value to new_value in place.
+
+        Unlike setting :attr:`value` this does not orphan all the cached
+        fragments. Only the parts of the value that differ from new_value are
+        changed: dictionaries are updated key by key and lists item by item,
+        recursively. Fragments (and observer state) of the parts that did not
+        change are kept intact.
+        """
+        old_value = self.value
+        if _same_value(old_value, new_value):
+            return
+        if isinstance(old_value, dict) and isinstance(new_value, dict):
+            self._merge_dict(old_value, new_value)
+        elif isinstance(old_value, list) and isinstance(new_value, list):
+            self._merge_list(old_value, new_value)
+        else:
+            self.value = new_value
+
+    def _forget_orphan(self, item):
+        fragment = self._fragment_cache.get(item)
+        if fragment is not None and fragment.is_orphaned:
+            del self._fragment_cache[item]
+
+    def _merge_dict(self, old_value, new_value):
+        self._ensure_not_default()
+        for key in [key for key in old_value if key not in new_value]:
+            del self[key]
+            self._forget_orphan(key)
+        for key, item_value in new_value.items():
+            if key not in old_value:
+                self._forget_orphan(key)
+                self[key] = item_value
+            elif not _same_value(old_value[key], item_value):
+                self[key]._merge_value(item_value)
+        if list(self._value.keys()) != list(new_value.keys()):
+            self._reorder(new_value)
+
+    def _reorder(self, keys):
+        """
+        Move the members of the object value to the order of keys
+
+        The value is modified in place, cached fragments stay valid.
+        """
+        for key in keys:
+            self._value[key] = self._value.pop(key)
+        self._document._fragment_modified(self)
+
+    def _merge_list(self, old_value, new_value):
+        self._ensure_not_default()
+        for index in range(min(len(old_value), len(new_value))):
+            if not _same_value(old_value[index], new_value[index]):
+                self[index]._merge_value(new_value[index])
+        if len(old_value) != len(new_value):
+            while len(self._value) > len(new_value):
+                del self[len(self._value) - 1]
+            if len(self._value) < len(new_value):
+                self._value.extend(new_value[len(self._value):])
+                self._document._fragment_modified(self)
+
     def _lowlevel_set_value(self, new_value):
         """
         Low-level set value.
@@ -256,6 +599,7 @@ class DocumentFragment(object):
                 self._parent._value[self._item] = new_value
         # Set the new value directly
         self._value = new_value
+        self._lazy_items = 0
 
     def _ensure_not_default(self):
         """
@@ -267,6 +611,20 @@ class DocumentFragment(object):
             if self._parent is not None:
                 self._parent._ensure_not_default()
             self._lowlevel_set_value(copy.deepcopy(self.schema.default))
+            # The default value is now a part of the document
+            self._notify_item_changed()
+
+    def _notify_item_changed(self):
+        """
+        Tell the document that the item of this fragment was added to or
+        removed from the parent value.
+
+        This happens when a default value is instantiated or reverted to.
+        """
+        if self._parent is not None and self._item is not None:
+            self._document._fragment_modified(self._parent, self._item)
+        else:
+            self._document._fragment_modified(self)
 
     def _ensure_not_orphaned(self):
         """
@@ -275,6 +633,14 @@ class DocumentFragment(object):
         if self.is_orphaned:
             raise OrphanedFragmentError(self)
 
+    def _ensure_not_frozen(self):
+        """
+        Ensure that the document of this fragment is not frozen.
+        """
+        # Fragments may be used without a (real) document
+        if getattr(self._document, '_frozen', False):
+            raise FrozenDocumentError(self._document)
+
     def _orphan(self):
         """
         Orphan this document fragment by disassociating it from the parent and
@@ -341,12 +707,24 @@ class DocumentFragment(object):
         """
         return self._item
 
+    def _path(self):
+        """
+        Get the list of items that lead from the document to this fragment
+        """
+        path = []
+        fragment = self
+        while fragment._parent is not None:
+            path.append(fragment._item)
+            fragment = fragment._parent
+        path.reverse()
+        return path
+
     def _get_schema_for_item(self, item):
         if self._schema is None:
             return DocumentFragment, None
         item_schema = None
-        value = self.value
-        if isinstance(value, dict):
+        value = self._peek_value()
+        if _is_object(value):
             # For objects/dictionaries
             # Try accessing schema for specific property first.
             try:
@@ -358,7 +736,7 @@ class DocumentFragment(object):
                     item_schema = self.schema.additionalProperties
                 # If that fails then we have no schema, sorry
                 # TODO: Maybe support patternProperties later
-        elif isinstance(value, list):
+        elif _is_array(value):
             # For arrays with array schemas (one schema item per array item)
             # try to access the schema for a particular item first
             if isinstance(self.schema.items, list):
@@ -379,29 +757,42 @@ class DocumentFragment(object):
     def _add_sub_fragment_to_cache(self, item, allow_create, create_value):
         """
         Add a new fragment instance to the this fragment's cache.
+
+        Returns the cached fragment.
         """
         self._ensure_not_orphaned()
-        if not isinstance(self.value, (dict, list)):
+        value = self._peek_value()
+        if not (_is_object(value) or _is_array(value)):
             raise TypeError(
                 "DocumentFragment must point to a dictionary or list")
         fragment_cls, item_schema = self._get_schema_for_item(item)
         try:
-            # Since we are using self.value instead of self._value we are
-            # using defaults transparently.
-            item_value = self.value[item]
+            if self._lazy_items:
+                item_value = self._load_lazy_item(item)
+            else:
+                # Since we are using _peek_value() instead of self._value
+                # we are using defaults transparently.
+                item_value = self._peek_value()[item]
         except (KeyError, IndexError) as ex:
             if item_schema is not None and "default" in item_schema:
                 item_value = DefaultValue
             elif allow_create is True:
+                self._ensure_not_frozen()
                 self._ensure_not_default()
                 self._value[item] = create_value
                 # We need to manually bump the document revision
-                self._document._bump_revision()
+                self._document._fragment_modified(self, item)
                 item_value = create_value
             else:
                 raise ex
-        self._fragment_cache[item] = fragment_cls._make_fragment(
+        fragment = fragment_cls._make_fragment(
             self._document, self, item_value, item, item_schema)
+        if getattr(self._document, '_frozen', False):
+            # Fragments of frozen documents are not cached, see freeze()
+            return fragment
+        # Readers of a ConcurrentDocument can race to create the same
+        # fragment, all of them get the one that was stored first.
+        return self._fragment_cache.setdefault(item, fragment)
 
     def _get_sub_fragment(self, item, allow_create=False, create_value=None):
         """
@@ -412,9 +803,20 @@ class DocumentFragment(object):
         If the item is missing in this fragment and allow_create is True then
         an appropriate object is constructed.
         """
-        if item not in self._fragment_cache:
-            self._add_sub_fragment_to_cache(item, allow_create, create_value)
-        return self._fragment_cache[item]
+        try:
+            fragment = self._fragment_cache[item]
+        except KeyError:
+            try:
+                fragment = self._add_sub_fragment_to_cache(
+                    item, allow_create, create_value)
+            except (LookupError, TypeError):
+                if _tracking:
+                    # The outcome depends on which items there are
+                    _record_read(self, True)
+                raise
+        if _tracking:
+            _record_read(fragment, False)
+        return fragment
 
     def __getitem__(self, item):
         """
@@ -450,16 +852,40 @@ class DocumentFragment(object):
             this operation shares the same limitation as `del self[fragment].value`
         """
         self._ensure_not_orphaned()
+        self._ensure_not_frozen()
         # Ensure there are no defaults around
         self._ensure_not_default()
         # Kill the value of this item
+        if self._lazy_items and isinstance(self._value[item], LazyValue):
+            self._lazy_items -= 1
         del self._value[item]
         # Kill the fragment cache for this item
         if item in self._fragment_cache:
             fragment = self._fragment_cache[item]
             fragment._orphan()
         # Ensure the document has noticed the change
-        self._document._bump_revision()
+        self._document._fragment_modified(self, item)
+        if isinstance(self._value, list):
+            self._shift_list_fragments(item)
+
+    def _shift_list_fragments(self, removed_index):
+        """
+        Update cached fragments of list items after an item was removed.
+
+        Fragments of the items that followed the removed one are moved one
+        index down. Fragments referring to items with negative indices cannot
+        be kept consistent and are orphaned.
+        """
+        if removed_index < 0:
+            removed_index += len(self._value) + 1
+        for index in sorted(self._fragment_cache):
+            if index < 0 or index == removed_index:
+                self._fragment_cache.pop(index)._orphan()
+            elif index > removed_index:
+                fragment = self._fragment_cache.pop(index)
+                fragment._item = index - 1
+                fragment._touch_subtree(self._document.revision)
+                self._fragment_cache[index - 1] = fragment
 
     def __contains__(self, item):
         """
@@ -469,7 +895,9 @@ class DocumentFragment(object):
         strings. Raises TypeError for fragments pointing at any other value
         type.
         """
-        return item in self.value
+        if _tracking:
+            _record_read(self, True)
+        return item in self._peek_value()
 
     def __len__(self):
         """
@@ -479,14 +907,16 @@ class DocumentFragment(object):
         strings. Raises TypeError for fragments pointing at any other value
         type.
         """
-        return len(self.value)
+        if _tracking:
+            _record_read(self, True)
+        return len(self._peek_value())
 
     def _iter_list(self):
-        for item in range(len(self.value)):
+        for item in range(len(self._peek_value())):
             yield self[item]
 
     def _iter_dict(self):
-        for item in self.value.keys():
+        for item in self._peek_value().keys():
             yield self[item]
 
     def __iter__(self):
@@ -496,14 +926,156 @@ class DocumentFragment(object):
         Works as expected for fragments pointing at lists and dictionaries.
         Raises TypeError for fragments pointing at any other value type.
         """
-        if isinstance(self.value, dict):
+        if _tracking:
+            _record_read(self, True)
+        value = self._peek_value()
+        if _is_object(value):
             return self._iter_dict()
-        elif isinstance(self.value, list):
+        elif _is_array(value):
             return self._iter_list()
         else:
             raise TypeError("%r is not iterable" % self)
 
 
+class Subscription(object):
+    """
+    Subscription to changes of parts of a document
+
+    See :meth:`Document.subscribe()`. Pattern is the JSON Pointer pattern
+    the subscription was made with, callback is called with the list of
+    JSON Pointers of changed values.
+    """
+
+    def __init__(self, trie, pattern, callback):
+        self._trie = trie
+        self.pattern = pattern
+        self.callback = callback
+
+    def cancel(self):
+        """
+        Stop calling the callback
+        """
+        self._trie.remove(self)
+
+
+class _TrieNode(object):
+
+    __slots__ = ('children', 'subscriptions')
+
+    def __init__(self):
+        self.children = {}
+        self.subscriptions = []
+
+
+class _SubscriptionTrie(object):
+    """
+    Document observer that calls the subscriptions interested in a change.
+
+    Subscriptions are kept in a trie of the reference tokens of their
+    patterns, the token ``*`` matches any token. A change of the value at
+    some path is interesting to the subscriptions whose patterns match a
+    prefix of that path (a value inside the one they watch has changed) and
+    to those whose patterns have the path as a prefix (a value that holds
+    the one they watch was replaced). Finding them takes a walk down the
+    trie along the path, its cost does not depend on the number of
+    unrelated subscriptions.
+
+    The trie is called by the document after all the other observers have
+    seen the change. Changes are collected and delivered by :meth:`flush()`
+    once depth is zero (see :meth:`Document.batch()`), each subscription is
+    called once with all of its changes.
+    """
+
+    def __init__(self):
+        self.root = _TrieNode()
+        self.depth = 0
+        self.pending = simplejson.OrderedDict()
+
+    def add(self, subscription):
+        node = self.root
+        for token in pointer.split(subscription.pattern):
+            node = node.children.setdefault(token, _TrieNode())
+        node.subscriptions.append(subscription)
+
+    def remove(self, subscription):
+        nodes = [self.root]
+        tokens = pointer.split(subscription.pattern)
+        for token in tokens:
+            nodes.append(nodes[-1].children[token])
+        nodes[-1].subscriptions.remove(subscription)
+        self.pending.pop(subscription, None)
+        # Prune nodes that lead nowhere
+        for token, parent, node in reversed(
+                list(zip(tokens, nodes, nodes[1:]))):
+            if node.subscriptions or node.children:
+                break
+            del parent.children[token]
+
+    def match(self, tokens):
+        """
+        Find subscriptions interested in a change of the value at tokens
+        """
+        matched = list(self.root.subscriptions)
+        nodes = [self.root]
+        for token in tokens:
+            keys = (token,) if token == "*" else (token, "*")
+            nodes = [node.children[key] for node in nodes
+                     for key in keys if key in node.children]
+            if not nodes:
+                return matched
+            for node in nodes:
+                matched.extend(node.subscriptions)
+        stack = [child for node in nodes for child in node.children.values()]
+        while stack:
+            node = stack.pop()
+            matched.extend(node.subscriptions)
+            stack.extend(node.children.values())
+        return matched
+
+    def __call__(self, fragment, item):
+        if not (self.root.subscriptions or self.root.children):
+            return
+        path = fragment._path()
+        # Like in _ChangeTracker removing a list item modifies the list
+        if item is not None and not isinstance(fragment._value, list):
+            path.append(item)
+        tokens = [str(token) if isinstance(token, int) else token
+                  for token in path]
+        subscriptions = self.match(tokens)
+        if not subscriptions:
+            return
+        changed = pointer.join(tokens)
+        for subscription in subscriptions:
+            changes = self.pending.setdefault(subscription, [])
+            if changed not in changes:
+                changes.append(changed)
+        if not self.depth:
+            self.flush()
+
+    def flush(self):
+        """
+        Deliver the collected changes
+
+        Every subscription is called even if some of the callbacks raise an
+        exception, the first exception is raised afterwards. Changes made by
+        the callbacks are delivered by the same loop.
+        """
+        error = None
+        self.depth += 1
+        try:
+            while self.pending:
+                subscription, changes = self.pending.popitem(last=False)
+                try:
+                    subscription.callback(changes)
+                except Exception as exc:
+                    if error is None:
+                        error = exc
+        finally:
+            self.depth -= 1
+        if error is not None:
+            raise error
+
+
 class Document(DocumentFragment):
     """
     Class representing a smart JSON document
@@ -515,7 +1087,9 @@ class Document(DocumentFragment):
     """
     document_schema = {"type": "any"}
 
-    __slots__ = DocumentFragment.__slots__ + ('_revision',)
+    __slots__ = DocumentFragment.__slots__ + (
+        '_revision', '_projection', '_observers', '_frozen',
+        '_subscriptions')
 
     def __init__(self, value, schema=None):
         """
@@ -527,14 +1101,45 @@ class Document(DocumentFragment):
         """
         # Start with an empty object by default
         # Initialize DocumentFragment
+        if schema:
+            schema = _unwrap(schema)
+        else:
+            schema = self.__class__._get_unwrapped_document_schema()
         super(Document, self).__init__(
             document=self,
             parent=None,
             value=value,
             item=None,
-            schema=_unwrap(schema or self.__class__.document_schema))
+            schema=schema)
         # Initially set the revision to 0
         self._revision = 0
+        # Documents are complete unless loaded partially
+        self._projection = None
+        # Callables interested in modifications, see _fragment_modified()
+        self._observers = []
+        # Frozen documents cannot be modified, see freeze()
+        self._frozen = False
+        # Created on first subscribe()
+        self._subscriptions = None
+
+    @classmethod
+    def _get_unwrapped_document_schema(cls):
+        """
+        Get the unwrapped document_schema of this class.
+
+        Unwrapping copies the whole schema so the result is computed once and
+        shared by all instances that use the class schema. It is recomputed
+        if document_schema is replaced.
+        """
+        try:
+            schema, unwrapped = _unwrapped_schema_cache[cls]
+        except KeyError:
+            schema = unwrapped = None
+        if schema is not cls.document_schema:
+            schema = cls.document_schema
+            unwrapped = _unwrap(schema)
+            _unwrapped_schema_cache[cls] = schema, unwrapped
+        return unwrapped
 
     @classmethod
     def _make_fragment(cls, document, parent, value, item=None, schema=None):
@@ -542,6 +1147,7 @@ class Document(DocumentFragment):
         self._document = document
         self._parent = parent
         self._item = item
+        self._subtree_revision = getattr(parent, '_subtree_revision', 0)
         return self
 
     @property
@@ -564,6 +1170,146 @@ class Document(DocumentFragment):
         """
         self._revision += 1
 
+    def _fragment_modified(self, fragment, item=None):
+        """
+        Record a modification of a fragment of this document.
+
+        This is a private method, it is called by DocumentFragment each time
+        it changes its value (item is None) or adds or removes an item of its
+        value. It bumps the document revision, updates the subtree_revision
+        of the fragment (and the item) and its parents and calls each
+        observer with the fragment and item as arguments. Subscribers (see
+        :meth:`subscribe()`) are notified last so that an exception raised
+        by a callback cannot keep the observers from seeing the change.
+        """
+        self._bump_revision()
+        revision = self._revision
+        if item is not None and item in fragment._fragment_cache:
+            fragment._fragment_cache[item]._subtree_revision = revision
+        ancestor = fragment
+        while ancestor is not None:
+            ancestor._subtree_revision = revision
+            ancestor = ancestor._parent
+        for observer in self._observers:
+            observer(fragment, item)
+        if self._subscriptions is not None:
+            self._subscriptions(fragment, item)
+
+    def subscribe(self, pattern, callback):
+        """
+        Call callback when values that match pattern change.
+
+        Pattern is a JSON Pointer in which the token ``*`` matches any
+        object member or array item, for example ``"/services/*/port"``.
+        Callback is called right after each matching change with the list
+        of JSON Pointers of the changed values (one pointer, unless the
+        change is made inside :meth:`batch()`). A change matches when it
+        modifies a matching value, a value inside one or a value that holds
+        one, so replacing ``/services`` or the whole document notifies
+        subscribers of ``"/services/*/port"`` as well.
+
+        Exceptions raised by callbacks are passed on to the code that made
+        the change, after the change is complete and all the callbacks were
+        called.
+
+        Returns a :class:`Subscription`, call its cancel() method to
+        unsubscribe. See :func:`json_document.aio.subscribe_queue()` for
+        receiving changes through an asyncio queue.
+        """
+        if self._subscriptions is None:
+            self._subscriptions = _SubscriptionTrie()
+        subscription = Subscription(self._subscriptions, pattern, callback)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Coalesce change notifications of subscribers.
+
+        Inside ``with doc.batch():`` subscribers (see :meth:`subscribe()`)
+        are not called. When the outermost batch ends each subscriber that
+        is interested in some of the changes made inside is called once,
+        with the list of JSON Pointers of all of them. Subscriptions made
+        inside a batch are part of it as well.
+        """
+        if self._subscriptions is None:
+            self._subscriptions = _SubscriptionTrie()
+        trie = self._subscriptions
+        trie.depth += 1
+        try:
+            yield self
+        finally:
+            trie.depth -= 1
+            if not trie.depth:
+                trie.flush()
+
+    @property
+    def projection(self):
+        """
+        List of JSON Pointers that were loaded or None
+
+        This is None for regular documents. Documents that were loaded only
+        partially (see :meth:`DocumentPersistence.load()`) list the pointers
+        to the values that were actually loaded.
+        """
+        if self._projection is not None:
+            return list(self._projection)
+
+    @property
+    def is_partial(self):
+        """
+        Check if this document was loaded only partially.
+
+        Partial documents cannot be saved unless the changes are merged back
+        into the full document, see :meth:`DocumentPersistence.save()`.
+        """
+        return self._projection is not None
+
+    @property
+    def is_frozen(self):
+        """
+        Check if this document was frozen, see :meth:`freeze()`.
+        """
+        return self._frozen
+
+    def freeze(self, gc_freeze=False):
+        """
+        Make this document immutable.
+
+        The value is replaced by a read-only copy: objects become read-only
+        mappings (MappingProxyType, plain dictionaries on Python 2) and
+        arrays become tuples. Values that are read-only already (such as
+        views of :class:`~json_document.serializers.IndexedBinary` files)
+        are kept as they are. Any attempt to modify the document (or its
+        fragments) raises
+        :class:`~json_document.errors.FrozenDocumentError`, so the revision
+        never changes again. Fragments are no longer cached, each access
+        creates a new fragment. Fragments created so far are orphaned.
+
+        This is meant for documents loaded once and then only read by many
+        processes forked afterwards. Reading a regular document fills its
+        fragment cache, which writes to the memory shared with the parent
+        process so that each process ends up with its own copy.
+
+        If gc_freeze is True (and the interpreter supports it) all the
+        objects that exist at this point, including the document, are also
+        moved to the permanent generation of the garbage collector with
+        gc.freeze(). Collections in forked processes then do not touch (and
+        copy) them. Do this right before forking.
+        """
+        if not self._frozen:
+            value = _freeze(self.value)
+            for fragment in self._fragment_cache.values():
+                fragment._orphan()
+            self._fragment_cache = {}
+            self._value = value
+            self._lazy_items = 0
+            self._frozen = True
+        if gc_freeze and hasattr(gc, "freeze"):
+            gc.collect()
+            gc.freeze()
+
 
 class DocumentPersistence(object):
     """
@@ -573,24 +1319,161 @@ class DocumentPersistence(object):
 
     You can have any number of persistence instances associated with a
     single document.
+
+    If streaming is True the document is saved with the serializer's dump()
+    method directly to a stream obtained from the storage's open_write()
+    method. This way the serialized text is produced and written
+    incrementally instead of being built in memory first.
+
+    The fingerprint of the storage (see ``IStorage.fingerprint()``) is
+    remembered on each load and save. Loading is skipped if the storage has
+    not changed since then, see :meth:`load()`. If check_content is True
+    the fingerprint includes a hash of the data, this is slower but does not
+    depend on file modification times.
+
+    Loading normally replaces the whole value of the document which orphans
+    all the fragments. If preserve_fragments is True the loaded value is
+    compared with the current one and only the differences are applied, in
+    place. Fragments of the unchanged parts stay valid and observers only
+    see the parts that changed.
     """
 
-    def __init__(self, document, storage, serializer=None):
+    def __init__(self, document, storage, serializer=None, streaming=False,
+                 check_content=False, preserve_fragments=False):
         self.document = document
         self.storage = storage
         self.serializer = serializer
+        self.streaming = streaming
+        self.check_content = check_content
+        self.preserve_fragments = preserve_fragments
         self.last_revision = None
+        self.fingerprint = None
+
+    def _remember_fingerprint(self):
+        self.fingerprint = self.storage.fingerprint(self.check_content)
+
+    def _is_up_to_date(self, projection=None):
+        """
+        Check if loading again would not change anything
+        """
+        return (self.fingerprint is not None
+                and not self.is_dirty
+                and self.document._projection == projection
+                and self.storage.fingerprint(
+                    self.check_content) == self.fingerprint)
+
+    @contextlib.contextmanager
+    def _open_data(self, storage=None):
+        """
+        Read data for the serializer from the storage
+
+        Serializers that accept buffers get the storage buffer directly, this
+        avoids copying the data for storage classes that support it (such as
+        memory-mapped :class:`~json_document.storage.FileStorage`).
+        """
+        if storage is None:
+            storage = self.storage
+        # Binary serializers cannot use text-only storage, read_buffer()
+        # raises NotImplementedError then
+        if self.serializer.binary or (
+                storage.binary and self.serializer.accepts_buffer):
+            with storage.read_buffer() as data:
+                yield data
+        else:
+            yield storage.read()
 
-    def load(self):
+    def load(self, only=None, force=False):
         """
         Load the document from the storage layer
+
+        If only is a list of JSON Pointers then just the values they point
+        to are loaded (see the serializer's loads_partial() method) and the
+        document becomes partial (see :attr:`Document.is_partial`).
+
+        Nothing is done if the storage has the same fingerprint as when the
+        document was last loaded or saved, the document was not modified
+        since then and the same values were selected with only. This keeps
+        the value (and all the fragments) intact. Pass force=True to load
+        the document anyway.
+
+        Returns True if the document was loaded, False otherwise.
         """
-        text = self.storage.read()
-        obj = self.serializer.loads(text)
-        self.document.value = obj
+        only, projection = self._get_projection(only)
+        if not force and self._is_up_to_date(projection):
+            return False
+        fingerprint, obj = self._read(only)
+        self._set_loaded_value(obj, projection, fingerprint)
+        return True
+
+    @staticmethod
+    def _get_projection(only):
+        if only is not None and "" in only:
+            # The whole document was selected anyway
+            only = None
+        projection = None if only is None else tuple(only)
+        return only, projection
+
+    def _read(self, only=None):
+        """
+        Read and parse the stored document, return (fingerprint, value)
+        """
+        # Take the fingerprint first so that a concurrent modification is
+        # picked up by the next load.
+        fingerprint = self.storage.fingerprint(self.check_content)
+        with self._open_data() as data:
+            if only is None:
+                obj = self.serializer.loads(data)
+            else:
+                obj = self.serializer.loads_partial(data, only)
+        return fingerprint, obj
+
+    def _set_loaded_value(self, obj, projection, fingerprint):
+        """
+        Make a value returned by _read() the value of the document
+        """
+        if self.preserve_fragments:
+            # Subscribers see the merged value, not the steps of the merge
+            with self.document.batch():
+                self.document._merge_value(obj)
+        else:
+            self.document.value = obj
+        self.document._projection = projection
         self.last_revision = self.document.revision
+        self.fingerprint = fingerprint
 
-    def save(self):
+    def _merge_into_stored(self, value=None, projection=None):
+        """
+        Merge the loaded parts of a partial document into the stored one
+
+        The value and projection of the document are used unless given
+        (as a copy taken by :meth:`_copy_document_value()`, for example).
+        """
+        with self._open_data() as data:
+            obj = self.serializer.loads(data)
+        if projection is None:
+            value = self.document.value
+            projection = self.document.projection
+        merged = []
+        for item in projection:
+            tokens = _loaded_tokens(obj, pointer.split(item))
+            if not tokens:
+                # The whole document was loaded
+                return value
+            if tokens in merged:
+                continue
+            merged.append(tokens)
+            try:
+                sub_value = pointer.resolve(value, tokens)
+            except LookupError:
+                try:
+                    pointer.remove(obj, tokens)
+                except LookupError:
+                    pass
+            else:
+                pointer.assign(obj, tokens, sub_value, type(value))
+        return obj
+
+    def save(self, merge=False):
         """
         Save the document to the storage layer.
 
@@ -599,16 +1482,592 @@ class DocumentPersistence(object):
         property (so you cannot use it as a version control system) but
         as long as the document instance is alive you can optimize
         saving easily.
+
+        Partially loaded documents can only be saved with merge set to True.
+        In that case the full document is loaded from the storage, the
+        loaded parts are replaced with their current values and the result
+        is saved. Saving a partial document without merge raises
+        :class:`~json_document.errors.PartialDocumentError`.
         """
         if self.last_revision != self.document.revision:
-            if self.serializer.needs_real_object:
-                obj = self.document
+            obj = self._get_saved_object(merge)
+            if self.streaming:
+                with self.storage.open_write() as stream:
+                    self.serializer.dump(stream, obj)
             else:
-                obj = self.document.value
-            text = self.serializer.dumps(obj)
-            self.storage.write(text)
+                text = self.serializer.dumps(obj)
+                self.storage.write(text)
             self.last_revision = self.document.revision
+            self._remember_fingerprint()
+
+    def _get_saved_object(self, merge=False):
+        """
+        Get the object that save() passes to the serializer
+        """
+        if self.document.is_partial:
+            if not merge:
+                raise PartialDocumentError(self.document)
+            obj = self._merge_into_stored()
+            if self.serializer.needs_real_object:
+                obj = Document(obj)
+            return obj
+        elif self.document.is_frozen:
+            # Serializers only know about dictionaries and lists
+            obj = _thaw(self.document.value)
+            if self.serializer.needs_real_object:
+                obj = Document(obj)
+            return obj
+        elif self.serializer.needs_real_object:
+            return self.document
+        else:
+            return self.document.value
+
+    def _get_snapshot(self):
+        """
+        Get a copy of the object that save() passes to the serializer
+
+        The copy shares no objects or arrays with the document (and no
+        caches of serializers that need the real object), it can be
+        serialized by another thread while the document is modified. The
+        snapshot itself must be taken while the document is not modified.
+        """
+        if self.document.is_partial:
+            raise PartialDocumentError(self.document)
+        obj = self._copy_document_value()
+        if self.serializer.needs_real_object:
+            obj = Document(obj)
+        return obj
+
+    def _copy_document_value(self):
+        """
+        Get a copy of the document value made of dictionaries and lists
+        """
+        if self.document.is_frozen:
+            return _thaw(self.document.value)
+        return _copy_value(self.document.value)
 
     @property
     def is_dirty(self):
         return self.last_revision != self.document.revision
+
+
+class _ChangeTracker(object):
+    """
+    Document observer that remembers which values were modified.
+
+    Modified values are identified by their path (list of items) from the
+    document root. Paths are kept in a tree of ordered dictionaries, leaves
+    mark paths of modified values. Nothing is recorded below such path so
+    the set of modified paths never contains both a path and its prefix.
+
+    Dictionary items that were added or removed are marked with MOVED
+    instead of MODIFIED. Re-adding an item moves it to the end of the
+    dictionary, its path is moved to the end of the tree as well so that
+    paths() reports added items in the order in which they were added.
+    """
+
+    MODIFIED = 1
+    MOVED = 2
+
+    def __init__(self):
+        self.changes = simplejson.OrderedDict()
+
+    def __call__(self, fragment, item):
+        path = fragment._path()
+        if item is None:
+            self.add(path, self.MODIFIED)
+        elif isinstance(fragment._value, list):
+            # Removing a list item shifts the items that follow it so in
+            # that case the whole list is considered modified.
+            self.add(path, self.MODIFIED)
+        else:
+            path.append(item)
+            self.add(path, self.MOVED)
+
+    def add(self, path, change):
+        """
+        Record a change (MODIFIED or MOVED) of the value at path
+        """
+        if self.changes == self.MODIFIED:
+            return
+        if not path:
+            self.changes = self.MODIFIED
+            return
+        node = self.changes
+        for item in path[:-1]:
+            if item not in node:
+                node[item] = simplejson.OrderedDict()
+            node = node[item]
+            if not isinstance(node, dict):
+                return
+        item = path[-1]
+        if change == self.MOVED:
+            node.pop(item, None)
+            node[item] = change
+        elif node.get(item) != self.MOVED:
+            node[item] = change
+
+    def paths(self):
+        """
+        Iterate over (path, change) pairs of modified values
+        """
+        stack = [([], self.changes)]
+        while stack:
+            path, node = stack.pop()
+            if isinstance(node, dict):
+                stack.extend(reversed([
+                    (path + [item], child) for item, child in node.items()]))
+            else:
+                yield path, node
+
+    def clear(self):
+        self.changes = simplejson.OrderedDict()
+
+    def ops(self, value):
+        """
+        Make a list of operations that bring a copy of value from before the
+        recorded changes up to date.
+
+        Operations are dictionaries like ``{"op": "set", "path": "/foo",
+        "value": 1}`` or ``{"op": "remove", "path": "/bar"}`` where path is
+        a JSON Pointer. None is returned if the whole value was modified.
+        """
+        ops = []
+        for path, change in self.paths():
+            if not path:
+                return None
+            try:
+                sub_value = pointer.resolve(value, path)
+            except LookupError:
+                ops.append({"op": "remove", "path": pointer.join(path)})
+            else:
+                if change == self.MOVED:
+                    # Remove first so that the item is added at the end
+                    ops.append({"op": "remove", "path": pointer.join(path)})
+                ops.append({"op": "set", "path": pointer.join(path),
+                            "value": sub_value})
+        return ops
+
+
+class JournalPersistence(DocumentPersistence):
+    """
+    Glue layer that saves documents incrementally::
+
+        document <-> serializer <-> snapshot + journal
+
+    This works with :class:`~json_document.storage.JournalStorage`. Saving a
+    modified document does not rewrite it. Only the values that were
+    modified since the last save are appended to the journal, one line per
+    save. Loading reads the snapshot and replays the journal. This way the
+    cost of saving a small change does not depend on the size of the
+    document.
+
+    The journal is compacted (the snapshot is rewritten and the journal is
+    reset) when its size exceeds compact_ratio times the size of the
+    snapshot. The same happens when the whole document value was replaced
+    and when there is no journal for the current snapshot yet.
+
+    Each line of the journal is a JSON object with a list of operations::
+
+        {"ops": [{"op": "set", "path": "/foo/0", "value": 1},
+                 {"op": "remove", "path": "/bar"}]}
+
+    Paths are JSON Pointers. A torn last line, left by an interrupted save,
+    is ignored.
+
+    The persistence tracks all modifications of the document until
+    :meth:`close()` is called (or the persistence, used as a context
+    manager, exits).
+    """
+
+    def __init__(self, document, storage, serializer=None, compact_ratio=1.0):
+        super(JournalPersistence, self).__init__(document, storage, serializer)
+        self.compact_ratio = compact_ratio
+        self._changes = _ChangeTracker()
+        self._journal_ready = False
+        document._observers.append(self._changes)
+
+    def load(self, force=False):
+        """
+        Load the snapshot from the storage and replay the journal
+
+        Like with :meth:`DocumentPersistence.load()` nothing is done if
+        neither the snapshot nor the journal changed since the document was
+        last loaded or saved, unless force is True. Returns True if the
+        document was loaded, False otherwise.
+        """
+        # The serializers module imports this module
+        from json_document.serializers import JSON
+        if not force and self._is_up_to_date():
+            return False
+        fingerprint = self.storage.fingerprint(self.check_content)
+        with self._open_data() as data:
+            obj = self.serializer.loads(data)
+        lines = self.storage.read_journal()
+        for index, line in enumerate(lines or ()):
+            try:
+                record = JSON.loads(line)
+            except ValueError:
+                if index == len(lines) - 1:
+                    # Interrupted save, the journal is reset on next save
+                    lines = None
+                    break
+                raise
+            obj = self._replay(obj, record["ops"])
+        self.document.value = obj
+        self.document._projection = None
+        self.last_revision = self.document.revision
+        self._changes.clear()
+        self._journal_ready = bool(lines is not None
+                                   and (not lines or lines[-1].endswith("\n")))
+        self.fingerprint = fingerprint
+        return True
+
+    @staticmethod
+    def _replay(obj, ops):
+        """
+        Apply journal operations to obj
+        """
+        for op in ops:
+            tokens = pointer.split(op["path"])
+            if op["op"] == "set":
+                if tokens:
+                    pointer.assign(obj, tokens, op["value"])
+                else:
+                    obj = op["value"]
+            elif op["op"] == "remove":
+                try:
+                    pointer.remove(obj, tokens)
+                except LookupError:
+                    # The value was added and removed between saves
+                    pass
+            else:
+                raise ValueError(
+                    "Unknown journal operation: {0!r}".format(op["op"]))
+        return obj
+
+    def compact(self):
+        """
+        Save the whole document as the snapshot and reset the journal
+        """
+        if self.document.is_partial:
+            raise PartialDocumentError(self.document)
+        if self.serializer.needs_real_object:
+            obj = self.document
+        else:
+            obj = self.document.value
+        self.storage.write(self.serializer.dumps(obj))
+        self._journal_ready = True
+        self._changes.clear()
+        self.last_revision = self.document.revision
+        self._remember_fingerprint()
+
+    def save(self):
+        """
+        Save modifications of the document to the journal.
+
+        The document is only saved if it was modified since it was last
+        saved (or loaded). The journal is compacted if necessary.
+        """
+        from json_document.serializers import JSON
+        if self.last_revision == self.document.revision:
+            return
+        if self.document.is_partial:
+            raise PartialDocumentError(self.document)
+        ops = self._changes.ops(self.document._value)
+        if ops is None or not self._journal_ready:
+            self.compact()
+            return
+        if ops:
+            self.storage.append_journal(
+                JSON.dumps({"ops": ops}, human_readable=False) + "\n")
+        self._changes.clear()
+        self.last_revision = self.document.revision
+        if (self.storage.journal_size()
+                > self.compact_ratio * self.storage.snapshot_size()):
+            self.compact()
+        else:
+            self._remember_fingerprint()
+
+    def close(self):
+        """
+        Stop tracking modifications of the document
+
+        Changes that were not saved yet are not saved. The persistence
+        cannot be used any more.
+        """
+        if self._changes in self.document._observers:
+            self.document._observers.remove(self._changes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SQLitePersistence(DocumentPersistence):
+    """
+    Glue layer between a document and an SQLite database::
+
+        document <-> rows keyed by JSON Pointer
+
+    This works with :class:`~json_document.storage.SQLiteStorage` and needs
+    no serializer. Saving writes only the rows of the values that were
+    modified since the last save (or load), in one transaction. Loading can
+    fetch only selected parts of the document, see :meth:`load()`.
+
+    Unlike with :class:`DocumentPersistence` partially loaded documents can
+    be saved directly, the rows that were not loaded are left intact. The
+    whole value of a partial document cannot be replaced though.
+
+    The persistence tracks all modifications of the document until
+    :meth:`close()` is called (or the persistence, used as a context
+    manager, exits). This also closes the database connection.
+    """
+
+    def __init__(self, document, storage, check_content=False):
+        super(SQLitePersistence, self).__init__(
+            document, storage, check_content=check_content)
+        self._changes = _ChangeTracker()
+        document._observers.append(self._changes)
+
+    def load(self, only=None, force=False):
+        """
+        Load the document from the database
+
+        If only is a list of JSON Pointers then just the values they point
+        to are fetched and the document becomes partial (see
+        :attr:`Document.is_partial`).
+
+        Like with :meth:`DocumentPersistence.load()` nothing is done if the
+        database was not modified since the document was last loaded or
+        saved (see :meth:`~json_document.storage.SQLiteStorage.fingerprint()`),
+        the document was not modified and the same values were selected,
+        unless force is True. Returns True if the document was loaded, False
+        otherwise.
+        """
+        only, projection = self._get_projection(only)
+        if not force and self._is_up_to_date(projection):
+            return False
+        fingerprint = self.storage.fingerprint(self.check_content)
+        self._set_loaded_value(
+            self.storage.load(only), projection, fingerprint)
+        self._changes.clear()
+        return True
+
+    def save(self):
+        """
+        Save modified values of the document to the database.
+
+        The document is only saved if it was modified since it was last
+        saved (or loaded).
+        """
+        if self.last_revision == self.document.revision:
+            return
+        ops = self._changes.ops(self.document._value)
+        if ops is None or self.last_revision is None:
+            # The whole document is new
+            if self.document.is_partial:
+                raise PartialDocumentError(self.document)
+            self.storage.store(self.document.value)
+        elif ops:
+            self.storage.apply(ops)
+        self._changes.clear()
+        self.last_revision = self.document.revision
+        self._remember_fingerprint()
+
+    def close(self):
+        """
+        Stop tracking modifications of the document and close the database
+
+        Changes that were not saved yet are not saved. The persistence
+        cannot be used any more.
+        """
+        if self._changes in self.document._observers:
+            self.document._observers.remove(self._changes)
+        self.storage.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class DirectoryPersistence(DocumentPersistence):
+    """
+    Glue layer between a document and a directory of sections::
+
+        document <-> serializer <-> one file per top-level member
+
+    This works with :class:`~json_document.storage.DirectoryStorage`. The
+    document must be a dictionary. Saving rewrites only the sections that
+    were modified since the last save (or load).
+
+    If lazy is True (the default) load() reads just the index. Sections are
+    loaded when they are first accessed through
+    :meth:`DocumentFragment.__getitem__()` (or when the whole
+    :attr:`~DocumentFragment.value` of the document is needed), see
+    :class:`LazyValue`.
+
+    The persistence tracks all modifications of the document until
+    :meth:`close()` is called (or the persistence, used as a context
+    manager, exits).
+    """
+
+    def __init__(self, document, storage, serializer=None, lazy=True,
+                 check_content=False):
+        super(DirectoryPersistence, self).__init__(
+            document, storage, serializer, check_content=check_content)
+        self.lazy = lazy
+        self._keys = None
+        self._changes = _ChangeTracker()
+        document._observers.append(self._changes)
+
+    def _load_section(self, key):
+        with self._open_data(self.storage.section(key)) as data:
+            return self.serializer.loads(data)
+
+    def _make_loader(self, key):
+        return lambda: self._load_section(key)
+
+    def load(self, force=False):
+        """
+        Load the document from the storage layer
+
+        Like with :meth:`DocumentPersistence.load()` nothing is done if
+        neither the index nor any section changed since the document was
+        last loaded or saved and the document was not modified, unless force
+        is True. Returns True if the document was loaded, False otherwise.
+        """
+        if not force and self._is_up_to_date():
+            return False
+        fingerprint = self.storage.fingerprint(self.check_content)
+        keys = self.storage.keys()
+        obj = simplejson.OrderedDict()
+        for key in keys:
+            if self.lazy:
+                obj[key] = LazyValue(self._make_loader(key))
+            else:
+                obj[key] = self._load_section(key)
+        self.document.value = obj
+        if self.lazy:
+            self.document._lazy_items = len(keys)
+        self.document._projection = None
+        self.last_revision = self.document.revision
+        self.fingerprint = fingerprint
+        self._keys = list(keys)
+        self._changes.clear()
+        return True
+
+    def save(self):
+        """
+        Save the modified sections of the document to the storage layer.
+
+        The document is only saved if it was modified since it was last
+        saved (or loaded).
+        """
+        if self.last_revision == self.document.revision:
+            return
+        value = self.document._value
+        if not isinstance(value, dict):
+            raise TypeError("DirectoryPersistence can only save objects")
+        if self._keys is None:
+            # Nothing was loaded or saved yet
+            modified = list(value.keys())
+        else:
+            modified = set()
+            for path, change in self._changes.paths():
+                if not path:
+                    modified = list(value.keys())
+                    break
+                modified.add(path[0])
+        self.storage.create()
+        for key in modified:
+            if key in value:
+                sub_value = value[key]
+                if self.serializer.needs_real_object:
+                    sub_value = Document(sub_value)
+                self.storage.section(key).write(
+                    self.serializer.dumps(sub_value))
+        keys = list(value.keys())
+        if keys != self._keys:
+            self.storage.write_keys(keys)
+            for key in self._keys or ():
+                if key not in value:
+                    self.storage.remove_section(key)
+        self._keys = keys
+        self._changes.clear()
+        self.last_revision = self.document.revision
+        self._remember_fingerprint()
+
+    def close(self):
+        """
+        Stop tracking modifications of the document
+
+        Changes that were not saved yet are not saved. The persistence
+        cannot be used any more (sections of a lazily loaded document are
+        still loaded when accessed).
+        """
+        if self._changes in self.document._observers:
+            self.document._observers.remove(self._changes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CollectionPersistence(object):
+    """
+    Glue layer between a collection of documents and storage::
+
+        documents <-> serializer <-> storage
+
+    This is the counterpart of :class:`DocumentPersistence` for storage that
+    holds many small documents (records), typically with the
+    :class:`~json_document.serializers.JSONLines` serializer. Records are
+    read lazily and wrapped in instances of document_cls. All of them share
+    the schema of that class. New records are appended to the storage
+    without rewriting it.
+    """
+
+    def __init__(self, storage, serializer, document_cls=Document):
+        self.storage = storage
+        self.serializer = serializer
+        self.document_cls = document_cls
+
+    def __iter__(self):
+        """
+        Iterate over all documents in the storage
+        """
+        document_cls = self.document_cls
+        with self.storage.open_read() as stream:
+            for obj in self.serializer.iterload(stream):
+                yield document_cls(obj)
+
+    def load_many(self, batch_size=1000):
+        """
+        Iterate over lists of (at most batch_size) documents
+
+        This is faster than iterating over documents one by one because the
+        serializer can parse each batch at once (see the iterload_batches()
+        method of :class:`~json_document.serializers.JSONLines`).
+        """
+        document_cls = self.document_cls
+        with self.storage.open_read() as stream:
+            for batch in self.serializer.iterload_batches(stream, batch_size):
+                yield [document_cls(obj) for obj in batch]
+
+    def append(self, *documents):
+        """
+        Append documents to the storage
+
+        Documents may be :class:`Document` instances or plain values.
+        """
+        text = self.serializer.dumps([
+            document.value if isinstance(document, DocumentFragment)
+            else document for document in documents])
+        self.storage.append(text)
@@ -28,6 +28,12 @@ Exceptions
 
 .. autoexception:: OrphanedFragmentError 
 
+.. autoexception:: PartialDocumentError
+
+.. autoexception:: FrozenDocumentError
+
+.. autoexception:: RemoteError
+
 """
 
 import os
@@ -100,3 +106,61 @@ class OrphanedFragmentError(Exception):
 
     def __repr__(self):
         return "{0}({1!r})".format(self.__class__.__name__, self.fragment)
+
+
+class PartialDocumentError(Exception):
+    """
+    Exception raised when a partially loaded document is being saved.
+
+    A document becomes partial when it is loaded with only some of its parts
+    (see :meth:`~json_document.document.DocumentPersistence.load()`). Saving
+    such document as-is would discard everything that was not loaded.
+    """
+
+    def __init__(self, document):
+        self.document = document
+
+    def __str__(self):
+        return "Attempt to overwrite storage with partially loaded document"
+
+    def __repr__(self):
+        return "{0}({1!r})".format(self.__class__.__name__, self.document)
+
+
+class FrozenDocumentError(Exception):
+    """
+    Exception raised when a frozen document is being modified.
+
+    A document becomes frozen (immutable) when its
+    :meth:`~json_document.document.Document.freeze()` method is called.
+    """
+
+    def __init__(self, document):
+        self.document = document
+
+    def __str__(self):
+        return "Attempt to modify frozen document"
+
+    def __repr__(self):
+        return "{0}({1!r})".format(self.__class__.__name__, self.document)
+
+
+class RemoteError(Exception):
+    """
+    Exception raised when a document server fails to handle a request.
+
+    See :class:`~json_document.server.DocumentClient`. The error_type
+    attribute holds the name of the exception raised by the server (such as
+    "KeyError") and message holds its description.
+    """
+
+    def __init__(self, error_type, message):
+        self.error_type = error_type
+        self.message = message
+
+    def __str__(self):
+        return "{0}: {1}".format(self.error_type, self.message)
+
+    def __repr__(self):
+        return "{0}({1!r}, {2!r})".format(
+            self.__class__.__name__, self.error_type, self.message)
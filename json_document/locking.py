@@ -0,0 +1,144 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+json_document.locking
+---------------------
+
+Sharing documents between threads
+"""
+
+import contextlib
+import threading
+
+from json_document.document import Document, _freeze
+
+
+class ReadWriteLock(object):
+    """
+    Lock that can be held by many readers or by one writer
+
+    Writers are preferred: once a writer is waiting new readers wait as
+    well, so that a steady stream of readers cannot starve the writer. The
+    lock is not reentrant.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if self._readers == 0:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._condition:
+            self._writer = False
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class ConcurrentDocument(Document):
+    """
+    Document that can be shared by many reader threads and one writer
+
+    Plain documents are not thread-safe: even reading a document creates
+    and caches fragments. ConcurrentDocument has a :class:`ReadWriteLock`,
+    code that reads the document (through fragments) must do so within
+    :meth:`reading()` and code that modifies it within :meth:`writing()`.
+    Readers can run in parallel, each writer runs alone.
+
+    Readers that only need the values can use :meth:`snapshot()` instead.
+    Snapshots are read-only copies of the whole value, made once per
+    revision. Getting the snapshot of a revision that was already copied
+    does not take any lock.
+    """
+
+    __slots__ = ('lock', '_snapshot')
+
+    def __init__(self, value, schema=None):
+        super(ConcurrentDocument, self).__init__(value, schema)
+        self.lock = ReadWriteLock()
+        # Pair of revision and frozen value
+        self._snapshot = None
+
+    def reading(self):
+        """
+        Context manager for reading the document
+        """
+        return self.lock.read_locked()
+
+    def writing(self):
+        """
+        Context manager for modifying the document
+        """
+        return self.lock.write_locked()
+
+    def snapshot(self):
+        """
+        Get a read-only copy of the current value
+
+        Objects are represented by read-only mappings (plain dictionaries
+        on Python 2, which must not be modified) and arrays by tuples.
+        """
+        # The revision is bumped after each modification. Seeing the old
+        # revision during a write means the write has not finished, the
+        # cached snapshot is still a consistent (slightly older) state.
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == self._revision:
+            return snapshot[1]
+        with self.lock.read_locked():
+            revision = self._revision
+            value = _freeze(self.value)
+        self._snapshot = (revision, value)
+        return value
@@ -0,0 +1,493 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+json_document.parallel
+----------------------
+
+Using multiple processes for working with many (or large) documents
+"""
+
+import multiprocessing
+import multiprocessing.pool
+import threading
+
+from json_schema_validator.errors import ValidationError
+from json_schema_validator.schema import Schema
+from json_schema_validator.validator import Validator
+
+from json_document import pointer
+from json_document.document import Document, DocumentPersistence, _unwrap
+from json_document.serializers import JSON
+from json_document.storage import IStorage
+
+
+def _plain_schema(schema):
+    """
+    Convert a schema (or Document class) to plain JSON values
+
+    This removes the references to fragment classes so that the schema
+    can be sent to other processes.
+    """
+    if isinstance(schema, type) and issubclass(schema, Document):
+        schema = schema.document_schema
+    schema = _unwrap(schema)
+
+    def strip(obj):
+        if isinstance(obj, list):
+            return [strip(item) for item in obj]
+        elif isinstance(obj, dict):
+            return dict((key, strip(value)) for key, value in obj.items()
+                        if key != '__fragment_cls')
+        else:
+            return obj
+    return strip(schema)
+
+
+def _canonical(value):
+    """
+    Hashable representation of a JSON value
+
+    Equal representations mean equal JSON values (true is not 1, 1 is 1.0)
+    """
+    if isinstance(value, dict):
+        return ("object", frozenset(
+            (key, _canonical(item)) for key, item in value.items()))
+    elif isinstance(value, list):
+        return ("array", tuple(_canonical(item) for item in value))
+    elif isinstance(value, bool):
+        return ("boolean", value)
+    else:
+        return value
+
+
+class _PointerValidator(Validator):
+    """
+    Validator that adds the JSON Pointer of the invalid value to errors
+
+    ValidationError instances raised by validate() have a pointer
+    attribute, the pointer is prefixed with prefix (a list of tokens).
+
+    Unlike the base class it also checks uniqueItems of arrays that
+    contain arrays or objects.
+    """
+
+    def __init__(self, prefix=()):
+        super(_PointerValidator, self).__init__()
+        self._prefix = list(prefix)
+        # Reference tokens of the objects on the object stack
+        self._tokens = []
+
+    def _push_object(self, obj, path, token=None):
+        super(_PointerValidator, self)._push_object(obj, path)
+        self._tokens.append(token)
+
+    def _pop_object(self):
+        super(_PointerValidator, self)._pop_object()
+        self._tokens.pop()
+
+    def _push_array_item_object(self, index):
+        self._push_object(self._object[index], "[%d]" % index, index)
+
+    def _push_property_object(self, prop):
+        self._push_object(self._object[prop], "." + prop, prop)
+
+    def _get_tokens(self):
+        return self._prefix + self._tokens[1:]
+
+    def validate(self, schema, obj):
+        if not isinstance(schema, Schema):
+            schema = Schema(schema)
+        try:
+            self.validate_toplevel(schema, obj)
+        except ValidationError as exc:
+            # The stacks are not unwound when validation fails
+            exc.pointer = pointer.join(self._get_tokens())
+            raise
+
+    def _validate_unique_items(self):
+        seen = set()
+        for index, item in enumerate(self._object):
+            key = _canonical(item)
+            if key in seen:
+                self._push_array_item_object(index)
+                self._report_error(
+                    "Repeated items found in array",
+                    "Repeated items found in array",
+                    schema_suffix=".uniqueItems")
+            seen.add(key)
+
+    def _validate_items(self):
+        schema, path = self._schema_stack[-1]
+        if schema.uniqueItems is not True or schema.items == {}:
+            return super(_PointerValidator, self)._validate_items()
+        self._validate_unique_items()
+        # Already checked, the base class only supports hashable items
+        self._schema_stack[-1] = (
+            Schema(dict(schema._schema, uniqueItems=False)), path)
+        try:
+            super(_PointerValidator, self)._validate_items()
+        finally:
+            self._schema_stack[-1] = (schema, path)
+
+
+class _ChunkingValidator(_PointerValidator):
+    """
+    Validator that leaves large arrays and objects to other processes
+
+    Arrays with at least min_size items validated against one items schema
+    and objects with at least min_size properties validated against an
+    additionalProperties schema are checked as a whole (length and
+    uniqueness) but their items are not validated. Instead, (schema, pointer
+    tokens, [(token, value), ...]) tuples are added to chunks. Errors found
+    by the checks of the whole array are added to errors and do not stop
+    validation.
+    """
+
+    def __init__(self, min_size, chunksize):
+        super(_ChunkingValidator, self).__init__()
+        self._min_size = min_size
+        self._chunksize = chunksize
+        # Alternatives of type are tried one by one, errors are ignored
+        # until one of them matches so nothing is split there
+        self._no_split = 0
+        self.chunks = []
+        self.errors = []
+
+    def _can_split(self, size, item_schema):
+        return (not self._no_split
+                and size >= self._min_size
+                and isinstance(item_schema, dict)
+                and item_schema != {}
+                # Requirements check the enclosing (large) object
+                and "requires" not in item_schema)
+
+    def _add_chunks(self, item_schema, items):
+        tokens = self._get_tokens()
+        for start in range(0, len(items), self._chunksize):
+            self.chunks.append(
+                (item_schema, tokens, items[start:start + self._chunksize]))
+
+    def _collect_errors(self, check):
+        depth = len(self._object_stack)
+        try:
+            check()
+        except ValidationError as exc:
+            exc.pointer = pointer.join(self._get_tokens())
+            self.errors.append(exc)
+            while len(self._object_stack) > depth:
+                self._pop_object()
+
+    def _validate_array_size(self):
+        obj = self._object
+        schema = self._schema
+        if schema.minItems and len(obj) < schema.minItems:
+            self._report_error(
+                "Object has fewer than the minimum number of items",
+                "Object has fewer than the minimum number of items",
+                schema_suffix=".minItems")
+        if schema.maxItems is not None and len(obj) > schema.maxItems:
+            self._report_error(
+                "Object has more than the maximum number of items",
+                "Object has more than the maximum number of items",
+                schema_suffix=".maxItems")
+
+    def _validate_type(self):
+        if isinstance(self._schema.type, (list, dict)):
+            self._no_split += 1
+            try:
+                super(_ChunkingValidator, self)._validate_type()
+            finally:
+                self._no_split -= 1
+        else:
+            super(_ChunkingValidator, self)._validate_type()
+
+    def _validate_items(self):
+        obj = self._object
+        schema = self._schema
+        if not self._can_split(len(obj), schema.items):
+            return super(_ChunkingValidator, self)._validate_items()
+        if schema.uniqueItems is True:
+            self._collect_errors(self._validate_unique_items)
+        self._collect_errors(self._validate_array_size)
+        self._add_chunks(schema.items, list(enumerate(obj)))
+
+    def _validate_additional_properties(self):
+        obj = self._object
+        schema = self._schema
+        if not self._can_split(len(obj), schema.additionalProperties):
+            return super(
+                _ChunkingValidator, self)._validate_additional_properties()
+        # Like the regular validator, check all the properties
+        self._add_chunks(schema.additionalProperties, list(obj.items()))
+
+
+def _validate_chunk(chunk):
+    """
+    Validate items of a large array or object, return a list of errors
+    """
+    item_schema, tokens, items = chunk
+    item_schema = Schema(item_schema)
+    validator = _PointerValidator(tokens + [None])
+    errors = []
+    for token, value in items:
+        validator._prefix[-1] = token
+        try:
+            validator.validate(item_schema, value)
+        except ValidationError as exc:
+            errors.append(exc)
+    return errors
+
+
+# State of worker processes, see _init_worker()
+_worker_schema = None
+_worker_serializer = None
+
+
+def _init_worker(schema, serializer):
+    global _worker_schema, _worker_serializer
+    _worker_schema = schema
+    _worker_serializer = serializer
+
+
+def _validate_one(document):
+    """
+    Validate one document, return None or the exception that was raised
+    """
+    try:
+        if isinstance(document, IStorage):
+            if _worker_serializer.binary or (
+                    document.binary and _worker_serializer.accepts_buffer):
+                data = document.read_bytes()
+            else:
+                data = document.read()
+            value = _worker_serializer.loads(data)
+        else:
+            value = document
+        _PointerValidator().validate(_worker_schema, value)
+    except Exception as exc:
+        return exc
+
+
+def validate_corpus(documents, schema, workers=None, serializer=None,
+                    chunksize=None):
+    """
+    Validate many documents against one schema using multiple processes
+
+    :Discussion:
+        Each item of documents is either a document value or a storage
+        that holds the document (read with the serializer, JSON by
+        default), typically a :class:`~json_document.storage.FileStorage`.
+        Storage objects are sent to other processes, so they must be
+        picklable. Strings are document values, not pathnames.
+
+        Items are sent to a pool of workers processes (as many as there
+        are CPUs, if workers is None) in chunks of chunksize items, the
+        schema (a dictionary or a
+        :class:`~json_document.document.Document` subclass) is sent to each
+        worker once. documents can be any iterable, it is consumed
+        incrementally.
+
+        With workers equal to 0 everything is done in the current process.
+    :Return value:
+        List with one item for each document, in the same order: None for
+        valid documents, otherwise the exception that was raised
+        (``ValidationError`` for invalid documents, with a pointer
+        attribute that holds the JSON Pointer to the invalid value, but
+        also, for example, ``IOError`` for missing files or ``ValueError``
+        for malformed ones).
+    """
+    schema = _plain_schema(schema)
+    if serializer is None:
+        serializer = JSON
+    if workers == 0:
+        _init_worker(schema, serializer)
+        return [_validate_one(item) for item in documents]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if chunksize is None:
+        try:
+            chunksize = max(1, min(256, len(documents) // workers // 4))
+        except TypeError:
+            # Iterators do not have a length
+            chunksize = 64
+    pool = multiprocessing.Pool(
+        workers, initializer=_init_worker, initargs=(schema, serializer))
+    try:
+        return list(pool.imap(_validate_one, documents, chunksize))
+    finally:
+        # All the results were received (or something went wrong)
+        pool.terminate()
+        pool.join()
+
+
+def validate_chunked(value, schema, workers=None, min_size=10000,
+                     chunksize=10000):
+    """
+    Validate one large document using multiple processes
+
+    :Discussion:
+        Validation of arrays with at least min_size items that share one
+        items schema, and objects with at least min_size properties
+        validated against an additionalProperties schema, is split into
+        chunks of chunksize items. The chunks are validated by a pool of
+        workers processes (as many as there are CPUs, if workers is None).
+        Everything else, including the length and uniqueness of large
+        arrays, is validated in the current process.
+
+        Unlike the regular validator, which stops at the first error, each
+        item of a large array or object is validated separately, so one
+        error per invalid item is reported. Arrays with uniqueItems may
+        contain arrays and objects, they are compared by value.
+
+        With workers equal to 0 everything is done in the current process.
+    :Return value:
+        List of ``ValidationError`` instances, empty if the document is
+        valid. Each error has a pointer attribute with the JSON Pointer to
+        the invalid value.
+    """
+    validator = _ChunkingValidator(min_size, chunksize)
+    errors = validator.errors
+    try:
+        validator.validate(_plain_schema(schema), value)
+    except ValidationError as exc:
+        errors.append(exc)
+    if workers == 0 or not validator.chunks:
+        chunk_errors = [_validate_chunk(chunk) for chunk in validator.chunks]
+    else:
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(workers)
+        try:
+            chunk_errors = pool.map(_validate_chunk, validator.chunks, 1)
+        finally:
+            pool.terminate()
+            pool.join()
+    for some_errors in chunk_errors:
+        errors.extend(some_errors)
+    return errors
+
+
+def _parse(serializer, data):
+    return serializer.loads(data)
+
+
+class PersistenceGroup(object):
+    """
+    Load and save many documents at once
+
+    The persistences of the group are loaded and saved by a pool of threads
+    (threads at a time) so that the time spent waiting for storage
+    overlaps.
+
+    Parsing of documents with at least large_size bytes (or characters)
+    can be sent to a pool of processes (processes of them, as many as there
+    are CPUs if processes is None) so that large documents are parsed in
+    parallel. The process pool is only started when the first large
+    document is found. This is off by default: the parsed value still has
+    to be unpickled by this process, which takes about 80% of the time of
+    parsing JSON. It pays off for serializers that are slower than that.
+
+    Each persistence must have its own document. Loading and saving work
+    like the load() and save() methods of the persistence, but instead of
+    raising exceptions they return the list of (persistence, exception)
+    pairs for each persistence that failed. The other documents are loaded
+    or saved anyway. Every persistence class must accept force in load()
+    (all the classes of :mod:`json_document.document` do). Connections of
+    :class:`~json_document.storage.SQLiteStorage` must be opened with
+    check_same_thread=False since they are used by the threads of the pool.
+    """
+
+    def __init__(self, persistences=(), threads=16, processes=0,
+                 large_size=1024 * 1024):
+        self.persistences = list(persistences)
+        self.threads = threads
+        self.processes = processes
+        self.large_size = large_size
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+        self._parse_lock = threading.Lock()
+
+    def add(self, persistence):
+        self.persistences.append(persistence)
+
+    def _get_process_pool(self):
+        with self._process_pool_lock:
+            if self._process_pool is None:
+                self._process_pool = multiprocessing.Pool(self.processes)
+            return self._process_pool
+
+    def _load_one(self, persistence, force):
+        # Persistence classes that load documents differently and
+        # serializers that do not parse text are left alone
+        if (type(persistence).load != DocumentPersistence.load
+                or persistence.serializer.needs_real_object):
+            persistence.load(force=force)
+            return
+        if not force and persistence._is_up_to_date():
+            return
+        storage = persistence.storage
+        fingerprint = storage.fingerprint(persistence.check_content)
+        if persistence.serializer.binary or (
+                storage.binary and persistence.serializer.accepts_buffer):
+            data = storage.read_bytes()
+        else:
+            data = storage.read()
+        if self.processes != 0 and len(data) >= self.large_size:
+            obj = self._get_process_pool().apply(
+                _parse, (persistence.serializer, data))
+        else:
+            # Parsing needs the interpreter lock anyway, parsing one
+            # document at a time avoids contention between the threads
+            with self._parse_lock:
+                obj = persistence.serializer.loads(data)
+        persistence._set_loaded_value(obj, None, fingerprint)
+
+    def _run(self, func):
+        """
+        Call func(persistence) for each persistence, collect errors
+        """
+        def call(persistence):
+            try:
+                func(persistence)
+            except Exception as exc:
+                return persistence, exc
+        pool = multiprocessing.pool.ThreadPool(self.threads)
+        try:
+            results = pool.map(call, self.persistences, 1)
+        finally:
+            pool.terminate()
+            pool.join()
+            if self._process_pool is not None:
+                self._process_pool.terminate()
+                self._process_pool.join()
+                self._process_pool = None
+        return [result for result in results if result is not None]
+
+    def load(self, force=False):
+        """
+        Load all the documents, return (persistence, exception) pairs
+        """
+        return self._run(
+            lambda persistence: self._load_one(persistence, force))
+
+    def save(self):
+        """
+        Save all the documents, return (persistence, exception) pairs
+        """
+        return self._run(lambda persistence: persistence.save())
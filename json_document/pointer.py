@@ -0,0 +1,137 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+json_document.pointer
+---------------------
+
+JSON Pointer (RFC 6901) helpers
+
+A pointer such as ``"/test_runs/0/test_id"`` is handled as a list of
+reference tokens (``["test_runs", "0", "test_id"]``). Tokens are always
+strings, they are converted to list indices when they are used to look
+inside an array.
+"""
+
+
+def split(pointer):
+    """
+    Split a JSON Pointer into a list of unescaped reference tokens
+
+    The empty pointer refers to the whole document and yields an empty list.
+
+    :Exceptions:
+        ValueError
+            When the pointer is not empty and does not start with a slash
+    """
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise ValueError(
+            "JSON Pointer must start with '/': {0!r}".format(pointer))
+    return [token.replace("~1", "/").replace("~0", "~")
+            for token in pointer[1:].split("/")]
+
+
+def join(tokens):
+    """
+    Build a JSON Pointer out of a sequence of reference tokens
+
+    Tokens that are not strings (typically list indices) are converted to
+    strings first.
+    """
+    return "".join(
+        "/" + str(token).replace("~", "~0").replace("/", "~1")
+        for token in tokens)
+
+
+def _index(container, token):
+    """
+    Convert token to something that can be used to index container
+    """
+    if isinstance(container, list):
+        try:
+            return int(token)
+        except ValueError:
+            raise KeyError(token)
+    return token
+
+
+def resolve(obj, tokens):
+    """
+    Get the value that tokens point to inside obj
+
+    :Exceptions:
+        LookupError (KeyError or IndexError)
+            When the value does not exist
+    """
+    for token in tokens:
+        if not isinstance(obj, (dict, list)):
+            raise KeyError(token)
+        obj = obj[_index(obj, token)]
+    return obj
+
+
+def assign(obj, tokens, value, dict_cls=dict):
+    """
+    Set the value that tokens point to inside obj
+
+    Missing intermediate objects are created as instances of dict_cls. The
+    token ``-`` (or an index equal to the length of the list) appends to a
+    list.
+
+    :Exceptions:
+        ValueError
+            When tokens are empty (the whole document cannot be replaced
+            in-place)
+        LookupError (KeyError or IndexError)
+            When an intermediate value exists but is not a container or the
+            list index is out of range
+    """
+    if not tokens:
+        raise ValueError("Cannot assign to the whole document")
+    for token in tokens[:-1]:
+        if isinstance(obj, dict) and token not in obj:
+            obj[token] = dict_cls()
+        obj = resolve(obj, [token])
+    token = tokens[-1]
+    if isinstance(obj, list):
+        if token == "-" or _index(obj, token) == len(obj):
+            obj.append(value)
+        else:
+            obj[_index(obj, token)] = value
+    elif isinstance(obj, dict):
+        obj[token] = value
+    else:
+        raise KeyError(token)
+
+
+def remove(obj, tokens):
+    """
+    Remove the value that tokens point to inside obj
+
+    :Exceptions:
+        LookupError (KeyError or IndexError)
+            When the value does not exist
+    """
+    if not tokens:
+        raise ValueError("Cannot remove the whole document")
+    parent = resolve(obj, tokens[:-1])
+    if not isinstance(parent, (dict, list)):
+        raise KeyError(tokens[-1])
+    del parent[_index(parent, tokens[-1])]
@@ -22,14 +22,424 @@ json_document.serializers
 Document serializer classes
 """
 
+import codecs
 import decimal
+import mmap
+import re
+import struct
 
 import simplejson
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from json_document import pointer
+from json_document.document import Document, Mapping, Sequence
+
 
 JSONDecodeError = simplejson.decoder.JSONDecodeError
 
 
+try:
+    _string_types = basestring
+    _integer_types = (int, long)
+    _binary_type = bytearray
+except NameError:
+    _string_types = str
+    _integer_types = int
+    _binary_type = bytes
+
+
+def _as_text(data):
+    """
+    Decode data as UTF-8 unless it already is a string
+    """
+    if isinstance(data, _string_types):
+        return data
+    return codecs.utf_8_decode(data, 'strict', True)[0]
+
+
+class IndexedBinaryDecodeError(ValueError):
+    """
+    Exception raised when IndexedBinary data is malformed
+    """
+
+
+class MessagePackDecodeError(ValueError):
+    """
+    Exception raised when binary data is not a correct MessagePack document
+    """
+
+
+class _Projection(object):
+    """
+    Parser that decodes only selected parts of a JSON text.
+
+    Objects on the way to the selected values are scanned key by key, values
+    that are not selected are skipped by matching brackets and strings with
+    regular expressions, without building any Python objects for them.
+    Arrays (and other non-object values) on the way to a selected value are
+    decoded as a whole.
+    """
+
+    _WHITESPACE = re.compile(r'[ \t\n\r]*')
+    _STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+    _STRING_OR_BRACKET = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]', re.DOTALL)
+    _SCALAR = re.compile(r'[^\s,\]}]+')
+
+    def __init__(self, text, selection, decoder, dict_cls):
+        self._text = text
+        self._selection = selection
+        self._decoder = decoder
+        self._dict_cls = dict_cls
+
+    @classmethod
+    def make_selection(cls, pointers):
+        """
+        Turn a list of JSON Pointers into a tree of dictionaries
+
+        Leaves of the tree are True. If any pointer selects the whole
+        document then True is returned.
+        """
+        selection = {}
+        for tokens in sorted(pointer.split(item) for item in pointers):
+            if not tokens:
+                return True
+            node = selection
+            for token in tokens[:-1]:
+                node = node.setdefault(token, {})
+                if node is True:
+                    break
+            else:
+                node[tokens[-1]] = True
+        return selection
+
+    def _error(self, msg, idx):
+        return JSONDecodeError(msg, self._text, idx)
+
+    def _skip_whitespace(self, idx):
+        return self._WHITESPACE.match(self._text, idx).end()
+
+    def _peek(self, idx):
+        try:
+            return self._text[idx]
+        except IndexError:
+            raise self._error("Expecting value", idx)
+
+    def _skip_value(self, idx):
+        char = self._peek(idx)
+        if char == '"':
+            match = self._STRING.match(self._text, idx)
+            if match is None:
+                raise self._error("Unterminated string", idx)
+            return match.end()
+        elif char in '{[':
+            depth = 0
+            for match in self._STRING_OR_BRACKET.finditer(self._text, idx):
+                token = match.group()
+                if token in ('{', '['):
+                    depth += 1
+                elif token in ('}', ']'):
+                    depth -= 1
+                    if depth == 0:
+                        return match.end()
+            raise self._error("Unterminated container", idx)
+        else:
+            match = self._SCALAR.match(self._text, idx)
+            if match is None:
+                raise self._error("Expecting value", idx)
+            return match.end()
+
+    def _select(self, idx, selection, need_end):
+        idx = self._skip_whitespace(idx)
+        if self._peek(idx) != '{':
+            return self._decoder.raw_decode(self._text, idx)
+        result = self._dict_cls()
+        remaining = len(selection)
+        if remaining == 0 and not need_end:
+            return result, None
+        idx = self._skip_whitespace(idx + 1)
+        if self._peek(idx) == '}':
+            return result, idx + 1
+        while True:
+            if self._peek(idx) != '"':
+                raise self._error("Expecting property name", idx)
+            key, idx = simplejson.decoder.scanstring(self._text, idx + 1)
+            idx = self._skip_whitespace(idx)
+            if self._peek(idx) != ':':
+                raise self._error("Expecting ':' delimiter", idx)
+            idx = self._skip_whitespace(idx + 1)
+            sub_selection = selection.get(key)
+            if sub_selection is None:
+                idx = self._skip_value(idx)
+            else:
+                remaining -= 1
+                if sub_selection is True:
+                    value, idx = self._decoder.raw_decode(self._text, idx)
+                else:
+                    value, idx = self._select(
+                        idx, sub_selection, need_end or remaining > 0)
+                result[key] = value
+                if remaining == 0 and not need_end:
+                    # Nobody cares about the rest of the text
+                    return result, None
+            idx = self._skip_whitespace(idx)
+            char = self._peek(idx)
+            if char == ',':
+                idx = self._skip_whitespace(idx + 1)
+            elif char == '}':
+                return result, idx + 1
+            else:
+                raise self._error("Expecting ',' delimiter", idx)
+
+    def decode(self):
+        if self._selection is True:
+            return self._decoder.decode(self._text)
+        return self._select(0, self._selection, False)[0]
+
+
+class _IncrementalEncoder(object):
+    """
+    Encoder that produces the same text as simplejson but in small pieces.
+
+    Large containers that hold other containers are encoded one item at a
+    time, small containers and containers that hold only simple values are
+    handed to the (fast) simplejson encoder in one go. The size of the
+    largest chunk is therefore bounded by the size of the largest such leaf
+    container instead of the size of the whole document.
+    """
+
+    # Containers with at most this many items are encoded in one go
+    small_size = 256
+
+    def __init__(self, human_readable, sort_keys):
+        indent, separators = JSON._get_indent_and_separators(human_readable)
+        self._encoder = simplejson.JSONEncoder(
+            use_decimal=True, indent=indent, separators=separators,
+            sort_keys=sort_keys)
+        self._indent = indent
+        self._item_separator, self._key_separator = separators
+        self._sort_keys = sort_keys
+
+    def _encode_simple(self, obj, level):
+        text = self._encoder.encode(obj)
+        if self._indent is not None and level:
+            # JSON strings never contain raw newlines so the only newlines
+            # here come from indentation, shift them to the current level.
+            text = text.replace('\n', '\n' + self._indent * level)
+        return text
+
+    def _key_to_string(self, key):
+        if isinstance(key, _string_types):
+            return key
+        elif key is True:
+            return 'true'
+        elif key is False:
+            return 'false'
+        elif key is None:
+            return 'null'
+        else:
+            return self._encoder.encode(key)
+
+    def _is_container(self, obj):
+        return isinstance(obj, (dict, list, tuple))
+
+    def _items(self, obj):
+        """
+        Get (encoded key, original key, value) triples in output order
+        """
+        items = [(self._key_to_string(key), key, value)
+                 for key, value in obj.items()]
+        if self._sort_keys:
+            items = sorted(items, key=lambda item: item[0])
+        return [(self._encoder.encode(key_string), key, value)
+                for key_string, key, value in items]
+
+    def _open(self, bracket, level):
+        if self._indent is None:
+            return bracket, self._item_separator
+        newline_indent = '\n' + self._indent * (level + 1)
+        return (bracket + newline_indent,
+                self._item_separator + newline_indent)
+
+    def _close(self, bracket, level):
+        if self._indent is None:
+            return bracket
+        return '\n' + self._indent * level + bracket
+
+    def _is_simple(self, obj):
+        """
+        Check if obj can be handed to simplejson in one go
+
+        That is the case for containers without nested containers and for
+        small containers (no more than small_size items, including items of
+        nested containers).
+        """
+        budget = self.small_size
+        pending = [obj]
+        nested = False
+        while pending:
+            obj = pending.pop()
+            if isinstance(obj, dict):
+                values = obj.values()
+            elif isinstance(obj, (list, tuple)):
+                values = obj
+            else:
+                continue
+            budget -= len(obj)
+            containers = [value for value in values
+                          if self._is_container(value)]
+            if budget < 0:
+                return not nested and not containers
+            nested = nested or bool(containers)
+            pending.extend(containers)
+        return True
+
+    def iterencode(self, obj, level=0):
+        if self._is_simple(obj):
+            yield self._encode_simple(obj, level)
+        elif isinstance(obj, dict):
+            opening, separator = self._open('{', level)
+            prefix = opening
+            for encoded_key, key, value in self._items(obj):
+                yield prefix + encoded_key + self._key_separator
+                for chunk in self.iterencode(value, level + 1):
+                    yield chunk
+                prefix = separator
+            yield self._close('}', level)
+        else:
+            opening, separator = self._open('[', level)
+            prefix = opening
+            for value in obj:
+                yield prefix
+                for chunk in self.iterencode(value, level + 1):
+                    yield chunk
+                prefix = separator
+            yield self._close(']', level)
+
+
+class _EncodedNode(object):
+    """
+    Cached encoding of one container of a document.
+
+    Parts is a list of text chunks and child nodes (for nested containers)
+    that make up the encoded container, or None if the container was
+    modified since it was last encoded. Children maps items of the container
+    to their nodes.
+    """
+
+    __slots__ = ('parts', 'children')
+
+    def __init__(self):
+        self.parts = None
+        self.children = {}
+
+    def iterparts(self):
+        for part in self.parts:
+            if isinstance(part, _EncodedNode):
+                for chunk in part.iterparts():
+                    yield chunk
+            else:
+                yield part
+
+
+class _EncodingCache(_IncrementalEncoder):
+    """
+    Incremental encoder that remembers the encoding of each container.
+
+    Instances are registered as observers of a document (see
+    :meth:`~json_document.document.Document._fragment_modified()`). Each
+    modification invalidates the cached encoding of the modified value and of
+    all the containers on the path to it. Everything else is reused by the
+    next encoding.
+    """
+
+    def __init__(self, human_readable, sort_keys):
+        super(_EncodingCache, self).__init__(human_readable, sort_keys)
+        self.options = (human_readable, sort_keys)
+        self._root = _EncodedNode()
+
+    @classmethod
+    def get(cls, document, human_readable, sort_keys):
+        """
+        Get the cache associated with document, creating it if necessary
+        """
+        for observer in document._observers:
+            if (isinstance(observer, cls)
+                    and observer.options == (human_readable, sort_keys)):
+                return observer
+        cache = cls(human_readable, sort_keys)
+        document._observers.append(cache)
+        return cache
+
+    def __call__(self, fragment, item):
+        path = fragment._path()
+        if item is not None:
+            path.append(item)
+        if not path:
+            self._root = _EncodedNode()
+            return
+        node = self._root
+        for token in path[:-1]:
+            node.parts = None
+            node = node.children.get(token)
+            if node is None:
+                return
+        node.parts = None
+        if item is not None and isinstance(fragment._value, list):
+            # Items after the removed one have shifted
+            for index in list(node.children):
+                if index >= item:
+                    del node.children[index]
+        else:
+            node.children.pop(path[-1], None)
+
+    def _encode_node(self, obj, level, node):
+        if node.parts is not None:
+            return
+        if self._is_simple(obj):
+            node.parts = [self._encode_simple(obj, level)]
+            node.children = {}
+            return
+        if isinstance(obj, dict):
+            opening, separator = self._open('{', level)
+            closing = self._close('}', level)
+            items = [(prefix + self._key_separator, key, value)
+                     for prefix, key, value in self._items(obj)]
+        else:
+            opening, separator = self._open('[', level)
+            closing = self._close(']', level)
+            items = [('', index, value) for index, value in enumerate(obj)]
+        parts = []
+        pending = []
+        children = {}
+        prefix = opening
+        for encoded_key, key, value in items:
+            pending.append(prefix + encoded_key)
+            prefix = separator
+            if self._is_container(value):
+                child = node.children.get(key)
+                if child is None:
+                    child = _EncodedNode()
+                self._encode_node(value, level + 1, child)
+                children[key] = child
+                parts.append(''.join(pending))
+                parts.append(child)
+                pending = []
+            else:
+                pending.append(self._encode_simple(value, level + 1))
+        pending.append(closing)
+        parts.append(''.join(pending))
+        node.parts = parts
+        node.children = children
+
+    def iterencode(self, obj, level=0):
+        self._encode_node(obj, level, self._root)
+        return self._root.iterparts()
+
+
 class JSON(object):
     """
     JSON class encapsulates loading and saving JSON files using simplejson
@@ -41,6 +451,13 @@ class JSON(object):
     # version of the object.
     needs_real_object = False
 
+    # Binary serializers load from and dump to bytes instead of text.
+    binary = False
+
+    # Serializers that accept buffer objects (bytes, memoryview) in loads()
+    # are given memory-mapped data by DocumentPersistence.
+    accepts_buffer = True
+
     @classmethod
     def _get_dict_impl(cls, retain_order):
         if retain_order:
@@ -87,12 +504,64 @@ class JSON(object):
     def loads(cls, text, retain_order=True):
         """
         Same as load() but reads data from a string
+
+        Text may also be UTF-8 encoded bytes or any other buffer object (such
+        as a memoryview of a memory-mapped file).
         """
         object_pairs_hook = cls._get_dict_impl(retain_order)
         return simplejson.loads(
-            text, parse_float=decimal.Decimal,
+            _as_text(text), parse_float=decimal.Decimal,
             object_pairs_hook=object_pairs_hook)
 
+    @classmethod
+    def iterencode(cls, doc, human_readable=True, sort_keys=False):
+        """
+        Encode JSON incrementally
+
+        :Discussion:
+            Works like dumps() but instead of building the whole text in
+            memory it yields consecutive chunks of it. Joining all the chunks
+            gives the same text that dumps() would return. This is what
+            dump() uses to write large documents without keeping a full copy
+            of the serialized text around.
+
+        :Return value:
+            Iterator of JSON text chunks
+        """
+        return _IncrementalEncoder(human_readable, sort_keys).iterencode(doc)
+
+    @classmethod
+    def loads_partial(cls, text, pointers, retain_order=True):
+        """
+        Load only selected parts of a JSON document from a string
+
+        :Discussion:
+            Text may be a string, bytes or a buffer object, just like with
+            loads(). Pointers is a list of JSON Pointers (such as "/format")
+            that select the values to load. The result has the same structure
+            as the full document but objects contain only the members that
+            lead to selected values. Values that are not selected are skipped
+            without being decoded.
+
+            Only objects can be partially loaded. If a pointer leads through
+            an array then that array is loaded as a whole.
+
+        :Return value:
+            The projection of the document loaded from the string
+
+        :Exceptions:
+            JSONDecodeError
+                When the text does not represent a correct JSON document.
+                Note that the skipped parts are not checked thoroughly.
+        """
+        object_pairs_hook = cls._get_dict_impl(retain_order)
+        decoder = simplejson.JSONDecoder(
+            parse_float=decimal.Decimal, object_pairs_hook=object_pairs_hook)
+        dict_cls = simplejson.OrderedDict if retain_order else dict
+        selection = _Projection.make_selection(pointers)
+        return _Projection(
+            _as_text(text), selection, decoder, dict_cls).decode()
+
     @classmethod
     def dump(cls, stream, doc, human_readable=True, sort_keys=False):
         """
@@ -109,13 +578,14 @@ class JSON(object):
             document without altering it's general structure. This option is
             not enabled by default.
 
+            The document is written in chunks as it is encoded, see
+            iterencode().
+
         :Return value:
             None
         """
-        indent, separators = cls._get_indent_and_separators(human_readable)
-        simplejson.dump(
-            doc, stream, use_decimal=True, indent=indent,
-            separators=separators, sort_keys=sort_keys)
+        for chunk in cls.iterencode(doc, human_readable, sort_keys):
+            stream.write(chunk)
 
     @classmethod
     def dumps(cls, doc, human_readable=True, sort_keys=False):
@@ -142,4 +612,972 @@ class JSON(object):
             separators=separators, sort_keys=sort_keys)
 
 
-__all__ = ['JSON', 'JSONDecodeError']
+class MemoizingJSON(JSON):
+    """
+    JSON serializer that remembers how each part of a document was encoded.
+
+    This serializer works with :class:`~json_document.document.Document`
+    instances (as opposed to raw values). When a document is saved again
+    only the containers that were modified since (and those on the path from
+    the document root to them) are encoded again, the encoded text of
+    everything else is reused. This makes saving a large document after a
+    small change much cheaper. The output is the same as with :class:`JSON`.
+
+    The cache is kept alive by the document and holds about as much text as
+    the serialized document. Use :meth:`forget()` to release it. Changes
+    made directly to the raw value (bypassing document fragments) are not
+    noticed and must be followed by :meth:`forget()`.
+    """
+
+    needs_real_object = True
+
+    @classmethod
+    def iterencode(cls, doc, human_readable=True, sort_keys=False):
+        """
+        Encode JSON incrementally, reusing cached encoding where possible
+
+        :Discussion:
+            If doc is not a Document this is the same as
+            :meth:`JSON.iterencode()`.
+
+        :Return value:
+            Iterator of JSON text chunks
+        """
+        if not isinstance(doc, Document):
+            return JSON.iterencode(doc, human_readable, sort_keys)
+        cache = _EncodingCache.get(doc, human_readable, sort_keys)
+        return cache.iterencode(doc.value)
+
+    @classmethod
+    def dumps(cls, doc, human_readable=True, sort_keys=False):
+        """
+        Dump JSON to a string, reusing cached encoding where possible
+
+        :Return value:
+            JSON document as string
+        """
+        return ''.join(cls.iterencode(doc, human_readable, sort_keys))
+
+    @classmethod
+    def forget(cls, document):
+        """
+        Discard all cached encodings of the specified document
+        """
+        document._observers[:] = [
+            observer for observer in document._observers
+            if not isinstance(observer, _EncodingCache)]
+
+
+class JSONLines(object):
+    """
+    JSONLines class encapsulates loading and saving JSON Lines files.
+
+    JSON Lines (also known as newline-delimited JSON) is a sequence of
+    compact JSON documents, one per line. It is a good fit for large
+    collections of small records because records can be read one at a time
+    and new records can be appended without rewriting the file. Each record
+    is handled exactly as the :class:`JSON` serializer would handle it.
+    """
+
+    needs_real_object = False
+
+    binary = False
+
+    accepts_buffer = False
+
+    @classmethod
+    def iterload(cls, stream, retain_order=True):
+        """
+        Iterate over JSON documents read from the specified stream
+
+        :Discussion:
+            Documents are read and parsed one line at a time, blank lines
+            are ignored.
+
+        :Return value:
+            Iterator of documents
+
+        :Exceptions:
+            JSONDecodeError
+                When a line does not represent a correct JSON document.
+        """
+        for line in stream:
+            if line.strip():
+                yield JSON.loads(line, retain_order)
+
+    @classmethod
+    def iterload_batches(cls, stream, batch_size=1000, retain_order=True):
+        """
+        Iterate over lists of (at most batch_size) JSON documents
+
+        :Discussion:
+            Each batch of lines is parsed with a single call to the JSON
+            parser (the lines are joined into one JSON array) which is
+            considerably faster than parsing each short line separately.
+
+        :Return value:
+            Iterator of lists of documents
+
+        :Exceptions:
+            JSONDecodeError
+                When a line does not represent a correct JSON document. The
+                error refers to the offending line alone.
+        """
+        batch = []
+        for line in stream:
+            line = line.strip()
+            if line:
+                batch.append(line)
+                if len(batch) == batch_size:
+                    yield cls._loads_batch(batch, retain_order)
+                    batch = []
+        if batch:
+            yield cls._loads_batch(batch, retain_order)
+
+    @classmethod
+    def _loads_batch(cls, lines, retain_order):
+        try:
+            docs = JSON.loads("[" + ",".join(lines) + "]", retain_order)
+        except JSONDecodeError:
+            docs = None
+        # A line with more than one value (such as "1, 2") is not an error
+        # in the joined array but changes the number of items
+        if docs is None or len(docs) != len(lines):
+            # Find the broken line to report a meaningful error
+            docs = [JSON.loads(line, retain_order) for line in lines]
+        return docs
+
+    @classmethod
+    def load(cls, stream, retain_order=True):
+        """
+        Load all JSON documents from the specified stream
+
+        :Return value:
+            List of documents
+        """
+        return list(cls.iterload(stream, retain_order))
+
+    @classmethod
+    def loads(cls, text, retain_order=True):
+        """
+        Same as load() but reads data from a string
+        """
+        return cls.load(text.splitlines(), retain_order)
+
+    @classmethod
+    def dump(cls, stream, docs, human_readable=False, sort_keys=False):
+        """
+        Dump JSON documents to a stream-like object, one per line
+
+        :Discussion:
+            Docs may be any iterable, documents are written as they are
+            produced. The human_readable argument is accepted for
+            compatibility with :class:`JSON` and ignored, each document must
+            fit in one line. If sort_keys is True then resulting JSON
+            objects have sorted keys.
+
+        :Return value:
+            None
+        """
+        for doc in docs:
+            stream.write(cls.dumps_one(doc, sort_keys))
+
+    @classmethod
+    def dumps(cls, docs, human_readable=False, sort_keys=False):
+        """
+        Dump JSON documents to a string, one per line
+
+        :Return value:
+            JSON Lines text (including the final newline)
+        """
+        return "".join(cls.dumps_one(doc, sort_keys) for doc in docs)
+
+    @classmethod
+    def dumps_one(cls, doc, sort_keys=False):
+        """
+        Dump a single JSON document as one line of text
+
+        :Return value:
+            Compact JSON text followed by a newline
+        """
+        text = JSON.dumps(doc, human_readable=False, sort_keys=sort_keys)
+        return text + "\n"
+
+
+# MessagePack extension types used for values that have no native encoding
+_EXT_DECIMAL = 1
+_EXT_BIGINT = 2
+
+_float64 = struct.Struct('>d')
+_fixext_codes = {1: 0xd4, 2: 0xd5, 4: 0xd6, 8: 0xd7, 16: 0xd8}
+
+
+def _pack_length(buf, length, small_code, small_max, codes):
+    """
+    Pack the header of a string, array, map or extension
+    """
+    if length <= small_max:
+        buf.append(small_code | length)
+    elif length < 0x100 and codes[0] is not None:
+        buf.append(codes[0])
+        buf.append(length)
+    elif length < 0x10000:
+        buf.append(codes[1])
+        buf.extend(struct.pack('>H', length))
+    elif length < 0x100000000:
+        buf.append(codes[2])
+        buf.extend(struct.pack('>I', length))
+    else:
+        raise ValueError("Value is too large for MessagePack")
+
+
+def _pack_int(buf, obj):
+    if 0 <= obj < 0x80:
+        buf.append(obj)
+    elif -0x20 <= obj < 0:
+        buf.append(obj & 0xff)
+    elif 0 < obj < 0x100:
+        buf.append(0xcc)
+        buf.append(obj)
+    elif 0 < obj < 0x10000:
+        buf.extend(struct.pack('>BH', 0xcd, obj))
+    elif 0 < obj < 0x100000000:
+        buf.extend(struct.pack('>BI', 0xce, obj))
+    elif 0 < obj < 0x10000000000000000:
+        buf.extend(struct.pack('>BQ', 0xcf, obj))
+    elif -0x80 <= obj < 0:
+        buf.extend(struct.pack('>Bb', 0xd0, obj))
+    elif -0x8000 <= obj < 0:
+        buf.extend(struct.pack('>Bh', 0xd1, obj))
+    elif -0x80000000 <= obj < 0:
+        buf.extend(struct.pack('>Bi', 0xd2, obj))
+    elif -0x8000000000000000 <= obj < 0:
+        buf.extend(struct.pack('>Bq', 0xd3, obj))
+    else:
+        _pack_ext(buf, _EXT_BIGINT, str(obj).encode('ascii'))
+
+
+def _pack_ext(buf, code, data):
+    length = len(data)
+    if length in _fixext_codes:
+        buf.append(_fixext_codes[length])
+    else:
+        _pack_length(buf, length, 0, -1, (0xc7, 0xc8, 0xc9))
+    buf.append(code)
+    buf.extend(data)
+
+
+def _pack(buf, obj):
+    """
+    Append MessagePack representation of obj to the bytearray buf
+    """
+    if obj is None:
+        buf.append(0xc0)
+    elif obj is False:
+        buf.append(0xc2)
+    elif obj is True:
+        buf.append(0xc3)
+    elif isinstance(obj, _integer_types):
+        _pack_int(buf, obj)
+    elif isinstance(obj, _string_types):
+        data = obj.encode('UTF-8')
+        _pack_length(buf, len(data), 0xa0, 31, (0xd9, 0xda, 0xdb))
+        buf.extend(data)
+    elif isinstance(obj, dict):
+        _pack_length(buf, len(obj), 0x80, 15, (None, 0xde, 0xdf))
+        for key, value in obj.items():
+            _pack(buf, key)
+            _pack(buf, value)
+    elif isinstance(obj, (list, tuple)):
+        _pack_length(buf, len(obj), 0x90, 15, (None, 0xdc, 0xdd))
+        for value in obj:
+            _pack(buf, value)
+    elif isinstance(obj, decimal.Decimal):
+        _pack_ext(buf, _EXT_DECIMAL, str(obj).encode('ascii'))
+    elif isinstance(obj, float):
+        buf.append(0xcb)
+        buf.extend(_float64.pack(obj))
+    elif isinstance(obj, _binary_type):
+        _pack_length(buf, len(obj), 0, -1, (0xc4, 0xc5, 0xc6))
+        buf.extend(obj)
+    else:
+        raise TypeError("{0!r} cannot be serialized".format(obj))
+
+
+class _Unpacker(object):
+    """
+    Pure-Python MessagePack decoder that works on any buffer object
+    """
+
+    # Formats of fixed-size values, indexed by type code
+    _fixed = dict((code, struct.Struct(fmt)) for code, fmt in [
+        (0xca, '>f'), (0xcb, '>d'),
+        (0xcc, '>B'), (0xcd, '>H'), (0xce, '>I'), (0xcf, '>Q'),
+        (0xd0, '>b'), (0xd1, '>h'), (0xd2, '>i'), (0xd3, '>q')])
+    # Formats of lengths of variable-size values, indexed by type code
+    _lengths = dict((code, struct.Struct(fmt)) for code, fmt in [
+        (0xc4, '>B'), (0xc5, '>H'), (0xc6, '>I'),
+        (0xc7, '>B'), (0xc8, '>H'), (0xc9, '>I'),
+        (0xd9, '>B'), (0xda, '>H'), (0xdb, '>I'),
+        (0xdc, '>H'), (0xdd, '>I'), (0xde, '>H'), (0xdf, '>I')])
+    _fixext_lengths = {0xd4: 1, 0xd5: 2, 0xd6: 4, 0xd7: 8, 0xd8: 16}
+
+    def __init__(self, data, dict_cls):
+        if isinstance(data, _string_types) and not isinstance(data, bytes):
+            raise TypeError("MessagePack data must be binary")
+        self._data = memoryview(data)
+        self._dict_cls = dict_cls
+
+    def _octet(self, offset):
+        try:
+            return struct.unpack_from('>B', self._data, offset)[0]
+        except struct.error:
+            raise MessagePackDecodeError("Unexpected end of data")
+
+    def _slice(self, offset, length):
+        end = offset + length
+        if end > len(self._data):
+            raise MessagePackDecodeError("Unexpected end of data")
+        return self._data[offset:end], end
+
+    def _unpack_fixed(self, fmt, offset):
+        try:
+            return fmt.unpack_from(self._data, offset)[0], offset + fmt.size
+        except struct.error:
+            raise MessagePackDecodeError("Unexpected end of data")
+
+    @staticmethod
+    def _decode(data):
+        try:
+            return codecs.utf_8_decode(data, 'strict', True)[0]
+        except UnicodeDecodeError as exc:
+            raise MessagePackDecodeError(str(exc))
+
+    def _unpack_ext(self, code, data):
+        text = self._decode(data)
+        if code == _EXT_DECIMAL:
+            return decimal.Decimal(text)
+        elif code == _EXT_BIGINT:
+            return int(text)
+        raise MessagePackDecodeError(
+            "Unsupported extension type {0}".format(code))
+
+    def _unpack_array(self, length, offset):
+        result = []
+        for index in range(length):
+            value, offset = self.unpack(offset)
+            result.append(value)
+        return result, offset
+
+    def _unpack_map(self, length, offset):
+        pairs = []
+        for index in range(length):
+            key, offset = self.unpack(offset)
+            value, offset = self.unpack(offset)
+            pairs.append((key, value))
+        return self._dict_cls(pairs), offset
+
+    def unpack(self, offset):
+        code = self._octet(offset)
+        offset += 1
+        if code < 0x80:
+            return code, offset
+        elif code >= 0xe0:
+            return code - 0x100, offset
+        elif code <= 0x8f:
+            return self._unpack_map(code & 0x0f, offset)
+        elif code <= 0x9f:
+            return self._unpack_array(code & 0x0f, offset)
+        elif code <= 0xbf:
+            data, offset = self._slice(offset, code & 0x1f)
+            return self._decode(data), offset
+        elif code == 0xc0:
+            return None, offset
+        elif code == 0xc2:
+            return False, offset
+        elif code == 0xc3:
+            return True, offset
+        elif code in self._fixed:
+            return self._unpack_fixed(self._fixed[code], offset)
+        elif code in self._fixext_lengths:
+            ext_code = self._octet(offset)
+            data, offset = self._slice(
+                offset + 1, self._fixext_lengths[code])
+            return self._unpack_ext(ext_code, data), offset
+        elif code in self._lengths:
+            length, offset = self._unpack_fixed(self._lengths[code], offset)
+            if code <= 0xc6:
+                data, offset = self._slice(offset, length)
+                return bytes(data), offset
+            elif code <= 0xc9:
+                ext_code = self._octet(offset)
+                data, offset = self._slice(offset + 1, length)
+                return self._unpack_ext(ext_code, data), offset
+            elif code <= 0xdb:
+                data, offset = self._slice(offset, length)
+                return self._decode(data), offset
+            elif code <= 0xdd:
+                return self._unpack_array(length, offset)
+            else:
+                return self._unpack_map(length, offset)
+        raise MessagePackDecodeError(
+            "Invalid type code 0x{0:02x}".format(code))
+
+    def unpack_all(self):
+        obj, offset = self.unpack(0)
+        if offset != len(self._data):
+            raise MessagePackDecodeError("Extra data after the document")
+        return obj
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return msgpack.ExtType(_EXT_DECIMAL, str(obj).encode('ascii'))
+    elif isinstance(obj, _integer_types):
+        return msgpack.ExtType(_EXT_BIGINT, str(obj).encode('ascii'))
+    raise TypeError("{0!r} cannot be serialized".format(obj))
+
+
+def _msgpack_ext_hook(code, data):
+    if code == _EXT_DECIMAL:
+        return decimal.Decimal(data.decode('ascii'))
+    elif code == _EXT_BIGINT:
+        return int(data.decode('ascii'))
+    return msgpack.ExtType(code, data)
+
+
+class MessagePack(object):
+    """
+    MessagePack class encapsulates loading and saving binary documents.
+
+    The format is standard MessagePack_ which is considerably more compact
+    than JSON text. Object key order is preserved and decimal numbers (which
+    is how :class:`JSON` loads all non-integer numbers) are stored exactly,
+    as MessagePack extension type 1. Integers that do not fit in 64 bits use
+    extension type 2.
+
+    The serializer is implemented in pure Python. If the msgpack_ module is
+    installed it is used to do the actual work, the output is the same.
+
+    .. _MessagePack: http://msgpack.org/
+    .. _msgpack: https://pypi.python.org/pypi/msgpack
+    """
+
+    needs_real_object = False
+
+    # loads() expects and dumps() produces bytes rather than text
+    binary = True
+
+    accepts_buffer = True
+
+    @classmethod
+    def load(cls, stream, retain_order=True):
+        """
+        Load a MessagePack document from the specified binary stream
+
+        :Return value:
+            The document loaded from the stream. If retain_order is True then
+            the resulting objects are composed of ordered dictionaries.
+
+        :Exceptions:
+            MessagePackDecodeError
+                When the data does not represent a correct document.
+        """
+        return cls.loads(stream.read(), retain_order)
+
+    @classmethod
+    def loads(cls, data, retain_order=True):
+        """
+        Same as load() but reads data from bytes (or any buffer object)
+        """
+        dict_cls = simplejson.OrderedDict if retain_order else dict
+        if msgpack is not None:
+            try:
+                return msgpack.unpackb(
+                    data, raw=False, strict_map_key=False,
+                    object_pairs_hook=dict_cls, ext_hook=_msgpack_ext_hook)
+            except (msgpack.UnpackException, ValueError) as exc:
+                raise MessagePackDecodeError(str(exc))
+        return _Unpacker(data, dict_cls).unpack_all()
+
+    @classmethod
+    def dump(cls, stream, doc, human_readable=False, sort_keys=False):
+        """
+        Dump a MessagePack document to a binary stream-like object
+
+        :Discussion:
+            The human_readable argument is accepted for compatibility with
+            :class:`JSON` and ignored. If sort_keys is True then the keys of
+            all objects are sorted.
+
+        :Return value:
+            None
+        """
+        stream.write(cls.dumps(doc, human_readable, sort_keys))
+
+    @classmethod
+    def dumps(cls, doc, human_readable=False, sort_keys=False):
+        """
+        Dump a MessagePack document to bytes
+
+        :Return value:
+            MessagePack document as bytes
+        """
+        if sort_keys:
+            doc = cls._sorted(doc)
+        if msgpack is not None:
+            return msgpack.packb(
+                doc, use_bin_type=True, default=_msgpack_default)
+        buf = bytearray()
+        _pack(buf, doc)
+        return bytes(buf)
+
+    @classmethod
+    def _sorted(cls, doc):
+        if isinstance(doc, Mapping):
+            return simplejson.OrderedDict(
+                (key, cls._sorted(doc[key])) for key in sorted(doc))
+        elif isinstance(doc, (list, tuple, IndexedArray)):
+            return [cls._sorted(item) for item in doc]
+        return doc
+
+
+# IndexedBinary files start with a header holding the offset of the root
+# value. Each value is a record that starts with a one-byte type tag:
+#
+#   n, t, f     null, true, false
+#   i           64-bit integer
+#   I           larger integer, as 32-bit length and ASCII digits
+#   F           64-bit float
+#   D           decimal number, as 32-bit length and ASCII text
+#   s           string, as 32-bit length and UTF-8 bytes
+#   a           array, as 32-bit count and offsets of the items
+#   o           object, as 32-bit count, (key offset, value offset) pairs in
+#               the original order and the indices of the pairs sorted by
+#               the UTF-8 bytes of the keys
+#
+# Offsets are 64-bit and absolute, keys are string records. Containers are
+# written after their items. All numbers are little-endian.
+
+_IX_MAGIC = b"JDIX\x01\x00\x00\x00"
+_ix_offset = struct.Struct('<Q')
+_ix_count = struct.Struct('<I')
+_ix_int = struct.Struct('<q')
+_ix_float = struct.Struct('<d')
+_ix_pair = struct.Struct('<QQ')
+_ix_header_size = len(_IX_MAGIC) + _ix_offset.size
+
+
+def _ix_pack(buf, obj, key_offsets):
+    """
+    Append the record of obj (and its items) to buf, return its offset
+
+    Key_offsets maps keys that were already written to their offsets, so
+    that each key is stored once.
+    """
+    if obj is None:
+        offset = len(buf)
+        buf.extend(b'n')
+    elif obj is True:
+        offset = len(buf)
+        buf.extend(b't')
+    elif obj is False:
+        offset = len(buf)
+        buf.extend(b'f')
+    elif isinstance(obj, _string_types):
+        data = obj.encode('utf-8')
+        offset = len(buf)
+        buf.extend(b's')
+        buf.extend(_ix_count.pack(len(data)))
+        buf.extend(data)
+    elif isinstance(obj, _integer_types):
+        offset = len(buf)
+        if -2 ** 63 <= obj < 2 ** 63:
+            buf.extend(b'i')
+            buf.extend(_ix_int.pack(obj))
+        else:
+            data = str(obj).encode('ascii')
+            buf.extend(b'I')
+            buf.extend(_ix_count.pack(len(data)))
+            buf.extend(data)
+    elif isinstance(obj, float):
+        offset = len(buf)
+        buf.extend(b'F')
+        buf.extend(_ix_float.pack(obj))
+    elif isinstance(obj, decimal.Decimal):
+        data = str(obj).encode('ascii')
+        offset = len(buf)
+        buf.extend(b'D')
+        buf.extend(_ix_count.pack(len(data)))
+        buf.extend(data)
+    elif isinstance(obj, Mapping):
+        pairs = []
+        for key, value in obj.items():
+            if not isinstance(key, _string_types):
+                raise TypeError("{0!r} is not a valid key".format(key))
+            if key not in key_offsets:
+                key_offsets[key] = _ix_pack(buf, key, key_offsets)
+            pairs.append((key.encode('utf-8'), key_offsets[key],
+                          _ix_pack(buf, value, key_offsets)))
+        offset = len(buf)
+        buf.extend(b'o')
+        buf.extend(_ix_count.pack(len(pairs)))
+        for key, key_offset, value_offset in pairs:
+            buf.extend(_ix_pair.pack(key_offset, value_offset))
+        for index in sorted(range(len(pairs)), key=lambda i: pairs[i][0]):
+            buf.extend(_ix_count.pack(index))
+    elif isinstance(obj, Sequence) and not isinstance(
+            obj, (bytes, bytearray, memoryview)):
+        # Binary data is a sequence of integers, but not a JSON array
+        item_offsets = [_ix_pack(buf, item, key_offsets) for item in obj]
+        offset = len(buf)
+        buf.extend(b'a')
+        buf.extend(_ix_count.pack(len(item_offsets)))
+        for item_offset in item_offsets:
+            buf.extend(_ix_offset.pack(item_offset))
+    else:
+        raise TypeError("{0!r} cannot be serialized".format(obj))
+    return offset
+
+
+def _ix_unpack(data, offset):
+    """
+    Get the value of the record at offset
+
+    Arrays and objects are returned as (lazy) views
+    """
+    try:
+        tag = data[offset:offset + 1]
+        if tag == b's':
+            return _ix_string(data, offset)
+        elif tag == b'i':
+            return _ix_int.unpack_from(data, offset + 1)[0]
+        elif tag == b'o':
+            return IndexedObject(data, offset)
+        elif tag == b'a':
+            return IndexedArray(data, offset)
+        elif tag == b'n':
+            return None
+        elif tag == b't':
+            return True
+        elif tag == b'f':
+            return False
+        elif tag == b'F':
+            return _ix_float.unpack_from(data, offset + 1)[0]
+        elif tag == b'D':
+            return decimal.Decimal(_ix_string(data, offset))
+        elif tag == b'I':
+            return int(_ix_string(data, offset))
+    except struct.error:
+        raise IndexedBinaryDecodeError("Unexpected end of data")
+    raise IndexedBinaryDecodeError(
+        "Invalid record at offset {0}".format(offset))
+
+
+def _ix_string_bytes(data, offset):
+    length = _ix_count.unpack_from(data, offset + 1)[0]
+    start = offset + 1 + _ix_count.size
+    if start + length > len(data):
+        raise IndexedBinaryDecodeError("Unexpected end of data")
+    return data[start:start + length]
+
+
+def _ix_string(data, offset):
+    try:
+        return codecs.utf_8_decode(
+            _ix_string_bytes(data, offset), 'strict', True)[0]
+    except UnicodeDecodeError as exc:
+        raise IndexedBinaryDecodeError(str(exc))
+
+
+class IndexedObject(Mapping):
+    """
+    Read-only view of an object stored in IndexedBinary data
+
+    Looking up a key is a binary search in the sorted key table of the
+    object. Keys are iterated in their original order. Values are decoded
+    on each access, arrays and objects are returned as views.
+    """
+
+    __slots__ = ('_data', '_offset', '_count')
+
+    def __init__(self, data, offset):
+        self._data = data
+        self._offset = offset
+        self._count = _ix_count.unpack_from(data, offset + 1)[0]
+        if offset + 1 + _ix_count.size + self._count * (
+                _ix_pair.size + _ix_count.size) > len(data):
+            raise IndexedBinaryDecodeError("Unexpected end of data")
+
+    def _pair(self, index):
+        return _ix_pair.unpack_from(
+            self._data, self._offset + 1 + _ix_count.size
+            + index * _ix_pair.size)
+
+    def __getitem__(self, key):
+        if not isinstance(key, _string_types):
+            raise KeyError(key)
+        needle = key.encode('utf-8')
+        data = self._data
+        sorted_start = (self._offset + 1 + _ix_count.size
+                        + self._count * _ix_pair.size)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            index = _ix_count.unpack_from(
+                data, sorted_start + middle * _ix_count.size)[0]
+            key_offset, value_offset = self._pair(index)
+            probe = _ix_string_bytes(data, key_offset)
+            if probe < needle:
+                low = middle + 1
+            elif probe > needle:
+                high = middle
+            else:
+                return _ix_unpack(data, value_offset)
+        raise KeyError(key)
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield _ix_string(self._data, self._pair(index)[0])
+
+    def __len__(self):
+        return self._count
+
+    def items(self):
+        """
+        List of (key, value) pairs (without looking up each key)
+        """
+        return [(_ix_string(self._data, key_offset),
+                 _ix_unpack(self._data, value_offset))
+                for key_offset, value_offset in (
+                    self._pair(index) for index in range(self._count))]
+
+    def __repr__(self):
+        return "<{0} of {1} items at offset {2}>".format(
+            self.__class__.__name__, self._count, self._offset)
+
+
+class IndexedArray(Sequence):
+    """
+    Read-only view of an array stored in IndexedBinary data
+
+    Items are found through the offset table of the array and decoded on
+    each access, arrays and objects are returned as views.
+    """
+
+    __slots__ = ('_data', '_offset', '_count')
+
+    def __init__(self, data, offset):
+        self._data = data
+        self._offset = offset
+        self._count = _ix_count.unpack_from(data, offset + 1)[0]
+        if offset + 1 + _ix_count.size + self._count * _ix_offset.size > len(
+                data):
+            raise IndexedBinaryDecodeError("Unexpected end of data")
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        item_offset = _ix_offset.unpack_from(
+            self._data, self._offset + 1 + _ix_count.size
+            + index * _ix_offset.size)[0]
+        return _ix_unpack(self._data, item_offset)
+
+    def __len__(self):
+        return self._count
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence) and not isinstance(
+                other, _string_types):
+            return len(self) == len(other) and all(
+                mine == theirs for mine, theirs in zip(self, other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "<{0} of {1} items at offset {2}>".format(
+            self.__class__.__name__, self._count, self._offset)
+
+
+class IndexedBinary(object):
+    """
+    IndexedBinary class encapsulates loading and saving binary documents
+    with random access.
+
+    In this format every object carries a table of its keys, sorted so that
+    a key can be found with a binary search, and every array carries a table
+    of the offsets of its items. A single value can therefore be read
+    without decoding the rest of the document. :meth:`map_file()` maps a
+    file into memory and returns views (:class:`IndexedObject` and
+    :class:`IndexedArray`) that decode values only when they are accessed.
+    Processes that map the same file share its pages.
+
+    Like :class:`MessagePack` it preserves key order and stores decimal
+    numbers and large integers exactly. Use :meth:`from_json()` and
+    :meth:`to_json()` to convert documents from and to :class:`JSON`.
+    """
+
+    needs_real_object = False
+
+    # loads() expects and dumps() produces bytes rather than text
+    binary = True
+
+    accepts_buffer = True
+
+    @classmethod
+    def view(cls, data):
+        """
+        Get the root value of IndexedBinary data without decoding it
+
+        :Discussion:
+            Data can be bytes or any other buffer object (such as mmap), it
+            must not be modified or closed while the views are in use.
+
+        :Return value:
+            :class:`IndexedObject`, :class:`IndexedArray` or a simple value
+
+        :Exceptions:
+            IndexedBinaryDecodeError
+                When the data does not start with an IndexedBinary header.
+        """
+        if data[:len(_IX_MAGIC)] != _IX_MAGIC:
+            raise IndexedBinaryDecodeError("Not an IndexedBinary document")
+        root = _ix_offset.unpack_from(data, len(_IX_MAGIC))[0]
+        return _ix_unpack(data, root)
+
+    @classmethod
+    def map_file(cls, pathname):
+        """
+        Map an IndexedBinary file into memory and get a view of its root
+
+        :Discussion:
+            The mapping is read-only and stays alive as long as any view
+            that uses it. Replace the file (see the atomic option of
+            :class:`~json_document.storage.FileStorage`) instead of
+            modifying it in place while it is mapped.
+
+        :Return value:
+            :class:`IndexedObject`, :class:`IndexedArray` or a simple value
+        """
+        with open(pathname, 'rb') as stream:
+            data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls.view(data)
+
+    @classmethod
+    def open_document(cls, pathname, document_cls=Document):
+        """
+        Get a frozen document backed by a memory-mapped IndexedBinary file
+
+        :Discussion:
+            Accessing ``doc["a"][123]["b"]`` only reads the parts of the
+            file that lead to that value. See :meth:`Document.freeze()
+            <json_document.document.Document.freeze>` for what frozen
+            documents can do.
+
+        :Return value:
+            Instance of document_cls
+        """
+        doc = document_cls(cls.map_file(pathname))
+        doc.freeze()
+        return doc
+
+    @classmethod
+    def _thaw(cls, value, dict_cls):
+        if isinstance(value, IndexedObject):
+            return dict_cls(
+                (key, cls._thaw(item, dict_cls))
+                for key, item in value.items())
+        elif isinstance(value, IndexedArray):
+            return [cls._thaw(item, dict_cls) for item in value]
+        return value
+
+    @classmethod
+    def load(cls, stream, retain_order=True):
+        """
+        Load an IndexedBinary document from the specified binary stream
+
+        :Return value:
+            The document loaded from the stream (made of regular
+            dictionaries and lists). If retain_order is True then the
+            resulting objects are composed of ordered dictionaries.
+
+        :Exceptions:
+            IndexedBinaryDecodeError
+                When the data does not represent a correct document.
+        """
+        return cls.loads(stream.read(), retain_order)
+
+    @classmethod
+    def loads(cls, data, retain_order=True):
+        """
+        Same as load() but reads data from bytes (or any buffer object)
+        """
+        dict_cls = simplejson.OrderedDict if retain_order else dict
+        return cls._thaw(cls.view(data), dict_cls)
+
+    @classmethod
+    def dump(cls, stream, doc, human_readable=False, sort_keys=False):
+        """
+        Dump an IndexedBinary document to a binary stream-like object
+
+        :Discussion:
+            The human_readable argument is accepted for compatibility with
+            :class:`JSON` and ignored. If sort_keys is True then the keys of
+            all objects are sorted (the key tables are sorted anyway, this
+            only changes the order of iteration).
+
+        :Return value:
+            None
+        """
+        stream.write(cls.dumps(doc, human_readable, sort_keys))
+
+    @classmethod
+    def dumps(cls, doc, human_readable=False, sort_keys=False):
+        """
+        Dump an IndexedBinary document to bytes
+
+        :Return value:
+            IndexedBinary document as bytes
+        """
+        if sort_keys:
+            doc = MessagePack._sorted(doc)
+        buf = bytearray(_ix_header_size)
+        root = _ix_pack(buf, doc, {})
+        buf[:_ix_header_size] = _IX_MAGIC + _ix_offset.pack(root)
+        return bytes(buf)
+
+    @classmethod
+    def from_json(cls, text, sort_keys=False):
+        """
+        Convert a JSON document to an IndexedBinary document
+
+        :Return value:
+            IndexedBinary document as bytes
+        """
+        return cls.dumps(JSON.loads(text), sort_keys=sort_keys)
+
+    @classmethod
+    def to_json(cls, data, human_readable=True, sort_keys=False):
+        """
+        Convert an IndexedBinary document to a JSON document
+
+        :Return value:
+            JSON document as string
+        """
+        return JSON.dumps(cls.loads(data), human_readable, sort_keys)
+
+
+__all__ = ['IndexedArray', 'IndexedBinary', 'IndexedBinaryDecodeError',
+           'IndexedObject', 'JSON', 'JSONDecodeError', 'JSONLines',
+           'MemoizingJSON', 'MessagePack', 'MessagePackDecodeError']
@@ -0,0 +1,696 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+json_document.server
+--------------------
+
+Sharing one document between processes over a Unix domain socket
+
+:class:`DocumentServer` owns a document (and its persistence), processes
+that would otherwise load their own copy of it use :class:`DocumentClient`
+to read and modify parts of it.
+
+The protocol is line-based, each request and each response is a JSON
+object on a line of its own::
+
+    {"id": 1, "op": "get", "path": "/database/host"}
+    {"id": 1, "revision": 7, "value": "localhost"}
+
+Requests (all of them take an optional id that is copied to the response):
+
+    ``{"op": "get", "path": P}``
+        Get the value at JSON Pointer P. With ``"if_revision": R`` the
+        response holds ``"not_modified": true`` instead of the value if the
+        value did not change since revision R (see
+        :attr:`~json_document.document.DocumentFragment.subtree_revision`).
+    ``{"op": "set", "path": P, "value": V}``
+        Set the value at P, creating missing objects on the way. The token
+        ``-`` appends to an array.
+    ``{"op": "remove", "path": P}``
+        Remove the value at P.
+    ``{"op": "patch", "patch": [...]}``
+        Apply a JSON Patch (RFC 6902). The patch is atomic, if one of its
+        operations fails the earlier ones are undone.
+    ``{"op": "batch", "requests": [...]}``
+        Handle several requests (other than batch) in one round trip. The
+        response holds the list of their responses as ``"results"``.
+    ``{"op": "subscribe"}``, ``{"op": "unsubscribe"}``
+        Start or stop receiving change notifications.
+
+Each response holds the document revision after the request was handled.
+Failed requests get ``"error": {"type": T, "message": M}`` instead of a
+value. Change notifications look like this::
+
+    {"event": "change", "revision": 8, "paths": ["/database/host"]}
+
+Paths are the JSON Pointers of the values that changed (the empty pointer
+if the whole document was replaced). A notification is sent before the
+response to the request that made the change.
+"""
+
+import copy
+import errno
+import os
+import select
+import socket
+import threading
+
+from json_document import pointer
+from json_document.document import (
+    _ChangeTracker, _is_array, _is_object, _thaw)
+from json_document.errors import RemoteError
+from json_document.serializers import JSON
+
+
+def _encode(message):
+    return (JSON.dumps(message, human_readable=False) + "\n").encode("UTF-8")
+
+
+def _decode(line):
+    return JSON.loads(line.decode("UTF-8"))
+
+
+def _is_prefix(tokens, other_tokens):
+    return other_tokens[:len(tokens)] == tokens
+
+
+class _Connection(object):
+
+    __slots__ = ('sock', 'inbuf', 'outbuf', 'subscribed')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = b""
+        self.outbuf = bytearray()
+        self.subscribed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+
+class DocumentServer(object):
+    """
+    Serve a document to :class:`DocumentClient` instances.
+
+    The document is persistence.document. Each request that modifies it is
+    saved with persistence.save() before the response is sent, unless save
+    is False (the application can then save the document itself, for
+    example with :class:`~json_document.autosave.AutoSave`). If saving
+    fails the client gets the error, the change stays in memory.
+
+    Requests are handled one by one by a single thread, started with
+    :meth:`start()` (or by calling :meth:`run_once()` from the application
+    main loop), so each request sees the effects of the previous ones.
+    Changes made to the document outside of requests (for example by
+    reloading it with :class:`~json_document.watcher.Watcher` callbacks
+    that call :meth:`wakeup()`) are announced to the subscribed clients
+    too. Such changes must be made from the thread that runs the server.
+
+    A stale socket file left by a server that is no longer running is
+    replaced.
+    """
+
+    def __init__(self, persistence, address, save=True, backlog=16):
+        self.persistence = persistence
+        self.document = persistence.document
+        self.address = address
+        self.save = save
+        self._listener = self._listen(address, backlog)
+        self._connections = []
+        self._changes = _ChangeTracker()
+        self.document._observers.append(self._changes)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._wakeup = os.pipe()
+
+    @staticmethod
+    def _listen(address, backlog):
+        if os.path.exists(address):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(address)
+            except socket.error as exc:
+                if exc.errno != errno.ECONNREFUSED:
+                    raise
+                os.unlink(address)
+            else:
+                raise ValueError(
+                    "Another server is listening on {0}".format(address))
+            finally:
+                probe.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(address)
+        listener.listen(backlog)
+        listener.setblocking(False)
+        return listener
+
+    # Operations on the document
+
+    @staticmethod
+    def _key(fragment, token):
+        """
+        Convert a reference token to an item of fragment
+        """
+        value = fragment.value
+        if _is_object(value):
+            return token
+        elif _is_array(value) and token.isdigit():
+            return int(token)
+        raise KeyError(token)
+
+    def _resolve(self, tokens):
+        fragment = self.document
+        for token in tokens:
+            fragment = fragment[self._key(fragment, token)]
+        return fragment
+
+    def _add(self, tokens, value):
+        """
+        Add (or replace) the value at tokens, returns the inverse operation
+        """
+        if not tokens:
+            old_value = self.document.value
+            self.document.value = value
+            return ("add", tokens, old_value)
+        parent = self._resolve(tokens[:-1])
+        token = tokens[-1]
+        if _is_array(parent.value):
+            items = list(parent.value)
+            index = len(items) if token == "-" else self._key(parent, token)
+            if not 0 <= index <= len(items):
+                raise IndexError(token)
+            items.insert(index, value)
+            parent.value = items
+            return ("remove", tokens[:-1] + [str(index)], None)
+        key = self._key(parent, token)
+        if key in parent.value:
+            old_value = parent.value[key]
+            parent[key].value = value
+            return ("replace", tokens, old_value)
+        parent[key] = value
+        return ("remove", tokens, None)
+
+    def _remove(self, tokens):
+        """
+        Remove the value at tokens, returns the inverse operation
+        """
+        if not tokens:
+            raise ValueError("Cannot remove the whole document")
+        parent = self._resolve(tokens[:-1])
+        key = self._key(parent, tokens[-1])
+        old_value = parent.value[key]
+        if not _is_object(parent.value):
+            del parent[key]
+            return ("add", tokens, old_value)
+        position = list(parent.value).index(key)
+        del parent[key]
+        # Like in _merge_dict() so that the member can be added again
+        parent._forget_orphan(key)
+        return ("insert", tokens, (position, old_value))
+
+    def _insert(self, tokens, position, value):
+        """
+        Add an object member at the given position (undoes _remove())
+        """
+        self._add(tokens, value)
+        parent = self._resolve(tokens[:-1])
+        keys = list(parent.value)
+        if position < len(keys) - 1:
+            keys.insert(position, keys.pop())
+            parent._reorder(keys)
+
+    def _replace(self, tokens, value):
+        """
+        Replace the existing value at tokens, returns the inverse operation
+        """
+        if not tokens:
+            return self._add(tokens, value)
+        parent = self._resolve(tokens[:-1])
+        fragment = parent[self._key(parent, tokens[-1])]
+        old_value = fragment.value
+        fragment.value = value
+        return ("replace", tokens, old_value)
+
+    def _set(self, tokens, value):
+        """
+        Set the value at tokens, creating missing objects on the way
+        """
+        if not tokens:
+            return self._add(tokens, value)
+        fragment = self.document
+        for index, token in enumerate(tokens[:-1]):
+            if _is_object(fragment.value) and token not in fragment.value:
+                self._add(tokens[:index + 1], {})
+            fragment = fragment[self._key(fragment, token)]
+        if _is_array(fragment.value):
+            if tokens[-1] == "-" or self._key(
+                    fragment, tokens[-1]) == len(fragment.value):
+                return self._add(tokens, value)
+            return self._replace(tokens, value)
+        return self._add(tokens, value)
+
+    def _patch(self, patch):
+        """
+        Apply a JSON Patch, undo it if any of its operations fails
+        """
+        undo = []
+        try:
+            for op in patch:
+                tokens = pointer.split(op["path"])
+                if op["op"] == "add":
+                    undo.append(self._add(tokens, op["value"]))
+                elif op["op"] == "remove":
+                    undo.append(self._remove(tokens))
+                elif op["op"] == "replace":
+                    undo.append(self._replace(tokens, op["value"]))
+                elif op["op"] in ("move", "copy"):
+                    from_tokens = pointer.split(op["from"])
+                    value = copy.deepcopy(self._resolve(from_tokens).value)
+                    if op["op"] == "move":
+                        if _is_prefix(from_tokens, tokens) and (
+                                from_tokens != tokens):
+                            raise ValueError(
+                                "Cannot move a value into itself")
+                        undo.append(self._remove(from_tokens))
+                    undo.append(self._add(tokens, value))
+                elif op["op"] == "test":
+                    if self._resolve(tokens).value != op["value"]:
+                        raise ValueError(
+                            "Test failed: {0}".format(op["path"]))
+                else:
+                    raise ValueError(
+                        "Unknown patch operation: {0!r}".format(op["op"]))
+        except Exception:
+            for op, tokens, value in reversed(undo):
+                if op == "add":
+                    self._add(tokens, value)
+                elif op == "remove":
+                    self._remove(tokens)
+                elif op == "insert":
+                    self._insert(tokens, *value)
+                else:
+                    self._replace(tokens, value)
+            raise
+
+    # Requests
+
+    def _handle(self, connection, request, nested=False):
+        """
+        Handle one request, return the response
+        """
+        response = {}
+        if "id" in request:
+            response["id"] = request["id"]
+        try:
+            response.update(self._dispatch(connection, request, nested))
+        except Exception as exc:
+            response["error"] = {
+                "type": exc.__class__.__name__, "message": str(exc)}
+        response["revision"] = self.document.revision
+        return response
+
+    def _dispatch(self, connection, request, nested):
+        op = request.get("op")
+        if op == "get":
+            tokens = pointer.split(request.get("path", ""))
+            fragment = self._resolve(tokens)
+            if_revision = request.get("if_revision")
+            if (if_revision is not None
+                    and fragment.subtree_revision <= if_revision):
+                return {"not_modified": True}
+            value = fragment.value
+            if self.document.is_frozen:
+                # Read-only mappings cannot be serialized
+                value = _thaw(value)
+            return {"value": value}
+        elif op == "set":
+            self._set(pointer.split(request["path"]), request["value"])
+        elif op == "remove":
+            self._remove(pointer.split(request["path"]))
+        elif op == "patch":
+            self._patch(request["patch"])
+        elif op == "batch" and not nested:
+            return {"results": [
+                self._handle(connection, sub_request, True)
+                for sub_request in request["requests"]]}
+        elif op == "subscribe":
+            connection.subscribed = True
+        elif op == "unsubscribe":
+            connection.subscribed = False
+        else:
+            raise ValueError("Unknown operation: {0!r}".format(op))
+        return {}
+
+    def _handle_line(self, connection, line):
+        revision = self.document.revision
+        try:
+            request = _decode(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be an object")
+        except ValueError as exc:
+            response = {"error": {"type": exc.__class__.__name__,
+                                  "message": str(exc)},
+                        "revision": self.document.revision}
+        else:
+            response = self._handle(connection, request)
+        if self.document.revision != revision and self.save:
+            try:
+                self.persistence.save()
+            except Exception as exc:
+                response["error"] = {
+                    "type": exc.__class__.__name__, "message": str(exc)}
+        self._notify()
+        connection.outbuf.extend(_encode(response))
+
+    def _notify(self):
+        """
+        Send a notification about the recorded changes
+        """
+        paths = [pointer.join(path) for path, change in self._changes.paths()]
+        if not paths:
+            return
+        self._changes.clear()
+        data = _encode({"event": "change", "paths": paths,
+                        "revision": self.document.revision})
+        for connection in self._connections:
+            if connection.subscribed:
+                connection.outbuf.extend(data)
+
+    # Main loop
+
+    def _accept(self):
+        try:
+            sock = self._listener.accept()[0]
+        except socket.error as exc:
+            if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        sock.setblocking(False)
+        self._connections.append(_Connection(sock))
+
+    def _drop(self, connection):
+        self._connections.remove(connection)
+        connection.sock.close()
+
+    def _read(self, connection):
+        try:
+            data = connection.sock.recv(65536)
+        except socket.error as exc:
+            if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = b""
+        if not data:
+            self._drop(connection)
+            return
+        lines = (connection.inbuf + data).split(b"\n")
+        connection.inbuf = lines.pop()
+        for line in lines:
+            if line.strip():
+                self._handle_line(connection, line)
+
+    def _write(self, connection):
+        try:
+            sent = connection.sock.send(connection.outbuf)
+        except socket.error as exc:
+            if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self._drop(connection)
+            return
+        del connection.outbuf[:sent]
+
+    def run_once(self, timeout=0):
+        """
+        Wait (at most timeout seconds) for requests and handle them.
+
+        This is what the background thread does in a loop. It can be called
+        directly by applications that have their own main loop instead.
+        """
+        self._notify()
+        writers = [connection for connection in self._connections
+                   if connection.outbuf]
+        readable, writable = select.select(
+            [self._listener, self._wakeup[0]] + self._connections,
+            writers, [], timeout)[:2]
+        for connection in writable:
+            self._write(connection)
+        for item in readable:
+            if item is self._listener:
+                self._accept()
+            elif item is self._wakeup[0]:
+                os.read(self._wakeup[0], 4096)
+            elif item in self._connections:
+                self._read(item)
+        self._notify()
+        # Responses are usually small, try to send them right away
+        for connection in list(self._connections):
+            if connection.outbuf:
+                self._write(connection)
+
+    def wakeup(self):
+        """
+        Make :meth:`run_once()` return soon (safe to call from any thread)
+        """
+        os.write(self._wakeup[1], b"x")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.run_once(None)
+
+    def start(self):
+        """
+        Start the background thread
+        """
+        if self._thread is not None:
+            raise ValueError("The server is already running")
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread and wait for it to finish
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self.wakeup()
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        """
+        Stop the server, disconnect all clients and remove the socket
+        """
+        self.stop()
+        for connection in list(self._connections):
+            self._drop(connection)
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            os.unlink(self.address)
+            os.close(self._wakeup[0])
+            os.close(self._wakeup[1])
+            self.document._observers.remove(self._changes)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class DocumentClient(object):
+    """
+    Client of :class:`DocumentServer`
+
+    Values returned by :meth:`get()` are cached. When subscribe is True the
+    client receives change notifications and a cached value is used until a
+    notification says it has changed, so reading a value that did not
+    change does not contact the server at all. Notifications are processed
+    whenever the client talks to the server and by :meth:`poll()`, each of
+    them is passed to on_change as (revision, paths). Since notifications
+    travel while the client is busy, a cached value may lag behind a change
+    made by another process for a moment, just like a document reloaded by
+    a :class:`~json_document.watcher.Watcher`.
+
+    When subscribe is False cached values are revalidated with the server on
+    each :meth:`get()`, they are sent again only if they changed.
+
+    Cached values are shared with the callers of :meth:`get()` and must not
+    be modified. Clients are not thread-safe, use one client per thread.
+    Errors reported by the server are raised as
+    :class:`~json_document.errors.RemoteError`.
+    """
+
+    def __init__(self, address, subscribe=True, on_change=None, cache=True,
+                 timeout=None):
+        self.on_change = on_change
+        self.cache = cache
+        self.revision = None
+        # Maps tokens (as tuples) to (revision, value) pairs
+        self._cache = {}
+        self._subscribed = False
+        self._next_id = 0
+        self._inbuf = b""
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(address)
+        if subscribe:
+            self._call({"op": "subscribe"})
+            self._subscribed = True
+
+    def _send(self, request):
+        self._next_id += 1
+        request["id"] = self._next_id
+        self._sock.sendall(_encode(request))
+        return self._next_id
+
+    def _read_message(self):
+        while b"\n" not in self._inbuf:
+            data = self._sock.recv(65536)
+            if not data:
+                raise EOFError("The server closed the connection")
+            self._inbuf += data
+        line, self._inbuf = self._inbuf.split(b"\n", 1)
+        return _decode(line)
+
+    def _process(self, message):
+        """
+        Process one message, return True if it was a notification
+        """
+        if message.get("event") != "change":
+            self.revision = message["revision"]
+            return False
+        self.revision = message["revision"]
+        changed = [pointer.split(path) for path in message["paths"]]
+        for key in list(self._cache):
+            tokens = list(key)
+            if any(_is_prefix(tokens, path) or _is_prefix(path, tokens)
+                   for path in changed):
+                del self._cache[key]
+        if self.on_change is not None:
+            self.on_change(message["revision"], message["paths"])
+        return True
+
+    def _call(self, request):
+        request_id = self._send(request)
+        while True:
+            message = self._read_message()
+            if self._process(message):
+                continue
+            if message.get("id") == request_id:
+                return self._result(message)
+
+    @staticmethod
+    def _result(response):
+        if "error" in response:
+            error = response["error"]
+            raise RemoteError(error["type"], error["message"])
+        return response
+
+    def poll(self, timeout=0):
+        """
+        Process change notifications that arrived so far
+
+        Waits at most timeout seconds (None means forever) for the first
+        notification. Returns the number of notifications processed.
+        """
+        count = 0
+        while True:
+            if b"\n" not in self._inbuf:
+                readable = select.select(
+                    [self._sock], [], [], timeout)[0]
+                if not readable:
+                    return count
+            self._process(self._read_message())
+            count += 1
+            timeout = 0
+
+    def get(self, path=""):
+        """
+        Get the value at JSON Pointer path
+        """
+        key = tuple(pointer.split(path))
+        request = {"op": "get", "path": path}
+        if self.cache and key in self._cache:
+            if self._subscribed:
+                self.poll()
+                if key in self._cache:
+                    return self._cache[key][1]
+            else:
+                request["if_revision"] = self._cache[key][0]
+        response = self._call(request)
+        if response.get("not_modified"):
+            return self._cache[key][1]
+        if self.cache:
+            self._cache[key] = (response["revision"], response["value"])
+        return response["value"]
+
+    def set(self, path, value):
+        """
+        Set the value at JSON Pointer path, return the new revision
+        """
+        return self._call(
+            {"op": "set", "path": path, "value": value})["revision"]
+
+    def remove(self, path):
+        """
+        Remove the value at JSON Pointer path, return the new revision
+        """
+        return self._call({"op": "remove", "path": path})["revision"]
+
+    def patch(self, patch):
+        """
+        Apply a JSON Patch (list of operations), return the new revision
+        """
+        return self._call({"op": "patch", "patch": patch})["revision"]
+
+    def batch(self, requests):
+        """
+        Send several requests in one round trip
+
+        Requests are dictionaries like ``{"op": "get", "path": "/foo"}``.
+        They are handled in order, one failing request does not stop the
+        others. Returns the list of results: values for get requests, new
+        revisions for other requests and RemoteError instances for the
+        requests that failed. Values are not cached.
+        """
+        response = self._call({"op": "batch", "requests": [
+            dict(request) for request in requests]})
+        results = []
+        for request, result in zip(requests, response["results"]):
+            if "error" in result:
+                results.append(RemoteError(
+                    result["error"]["type"], result["error"]["message"]))
+            elif request.get("op") == "get":
+                results.append(result["value"])
+            else:
+                results.append(result["revision"])
+        return results
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -16,12 +16,23 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with json-document.  If not, see <http://www.gnu.org/licenses/>.
 
-from json_document.document import DocumentPersistence
-from json_document.storage import FileStorage
-from json_document.serializers import JSON
+from json_document.document import (
+    CollectionPersistence,
+    DirectoryPersistence,
+    Document,
+    DocumentPersistence,
+    JournalPersistence,
+    SQLitePersistence)
+from json_document.storage import (
+    DirectoryStorage,
+    FileStorage,
+    JournalStorage,
+    SQLiteStorage)
+from json_document.serializers import JSON, JSONLines
 
 
-def persistence(document, path, ignore_missing=True, serializer=None):
+def persistence(document, path, ignore_missing=True, serializer=None,
+                streaming=False, atomic=False):
     """
     Get a DocumentPersistance instance setup for looking at the specified path
     with the specified document instance and the JSON serializer (by default)
@@ -29,4 +40,54 @@ def persistence(document, path, ignore_missing=True, serializer=None):
     if serializer is None:
         serializer = JSON
     return DocumentPersistence(
-        document, FileStorage(path, ignore_missing), serializer)
+        document, FileStorage(path, ignore_missing, atomic), serializer,
+        streaming)
+
+
+def journal(document, path, ignore_missing=True, serializer=None,
+            compact_ratio=1.0):
+    """
+    Get a JournalPersistence instance setup for looking at the specified path
+    (and the journal next to it) with the specified document instance and
+    the JSON serializer (by default)
+    """
+    if serializer is None:
+        serializer = JSON
+    return JournalPersistence(
+        document, JournalStorage(path, ignore_missing), serializer,
+        compact_ratio)
+
+
+def sqlite(document, database, name="document", depth=1):
+    """
+    Get a SQLitePersistence instance setup for looking at the specified
+    document (by name) in the specified SQLite database
+    """
+    return SQLitePersistence(
+        document, SQLiteStorage(database, name, depth))
+
+
+def directory(document, path, ignore_missing=True, serializer=None,
+              lazy=True):
+    """
+    Get a DirectoryPersistence instance setup for looking at the specified
+    directory with the specified document instance and the JSON serializer
+    (by default)
+    """
+    if serializer is None:
+        serializer = JSON
+    return DirectoryPersistence(
+        document, DirectoryStorage(path, ignore_missing), serializer, lazy)
+
+
+def collection(path, document_cls=Document, ignore_missing=True,
+               serializer=None):
+    """
+    Get a CollectionPersistence instance setup for looking at the specified
+    path with the specified document class and the JSONLines serializer (by
+    default)
+    """
+    if serializer is None:
+        serializer = JSONLines
+    return CollectionPersistence(
+        FileStorage(path, ignore_missing), serializer, document_cls)
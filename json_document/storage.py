@@ -24,7 +24,33 @@ Storage classes (for storing serializer output)
 """
 
 import abc
+import binascii
+import codecs
+import contextlib
 import errno
+import hashlib
+import io
+import mmap
+import os
+import sqlite3
+import stat
+import time
+
+import simplejson
+
+from json_document import pointer
+from json_document.serializers import JSON
+
+
+try:
+    _text_type = unicode
+except NameError:
+    _text_type = str
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
 
 
 class IStorage(object):
@@ -34,6 +60,10 @@ class IStorage(object):
 
     __metaclass__ = abc.ABCMeta
 
+    # Storage classes that can hold binary data implement read_bytes() and
+    # read_buffer() and accept bytes in write().
+    binary = False
+
     @abc.abstractmethod
     def write(self, data):
         """
@@ -46,6 +76,153 @@ class IStorage(object):
         Read all data from the storage
         """
 
+    def read_bytes(self):
+        """
+        Read all data from the storage as bytes
+
+        This is used with binary serializers. The default implementation
+        raises NotImplementedError, storage classes that can hold binary data
+        should override it and set binary to True.
+        """
+        raise NotImplementedError(
+            "{0} cannot hold binary data".format(self.__class__.__name__))
+
+    def read_buffer(self):
+        """
+        Read all data from the storage as a buffer
+
+        Returns a context manager that yields bytes or another object that
+        supports the buffer protocol (such as memoryview). The buffer may only
+        be used until the context manager exits. The default implementation
+        uses :meth:`read_bytes()`, storage classes that can avoid copying the
+        data should override it.
+        """
+        return _StaticContext(self.read_bytes())
+
+    def fingerprint(self, content=False):
+        """
+        Get a value that changes whenever the stored data changes
+
+        Fingerprints can be compared for equality. If content is True the
+        fingerprint should include a hash of the data. None means that the
+        storage cannot tell, this is what the default implementation returns.
+        """
+        return None
+
+    def open_write(self):
+        """
+        Open the storage for incremental writing.
+
+        Returns a context manager that yields a file-like object. Everything
+        written to that object replaces the data in the storage. The default
+        implementation collects all chunks in memory and passes them to
+        :meth:`write()` on exit, storage classes that can do better should
+        override it.
+        """
+        return _CollectingWriter(self)
+
+    def open_read(self):
+        """
+        Open the storage for incremental reading.
+
+        Returns a context manager that yields a file-like object with the
+        data in the storage. The default implementation reads everything with
+        :meth:`read()` and wraps it in an in-memory stream.
+        """
+        return io.StringIO(_text_type(self.read()))
+
+    def append(self, data):
+        """
+        Append data to the storage
+
+        Data is appended as whole lines: if the storage is not empty and
+        does not end with a newline, one is added before data. The default
+        implementation rewrites the storage with :meth:`read()` and
+        :meth:`write()`, storage classes that can append directly should
+        override it.
+        """
+        old_data = self.read()
+        if old_data and not old_data.endswith("\n"):
+            old_data += "\n"
+        self.write(old_data + data)
+
+
+# os.replace() is not available on Python 2, rename() replaces files
+# atomically on POSIX systems there.
+_replace = getattr(os, 'replace', os.rename)
+
+
+class _StaticContext(object):
+    """
+    Context manager that just yields a value
+    """
+
+    def __init__(self, value):
+        self._value = value
+
+    def __enter__(self):
+        return self._value
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class _CollectingWriter(object):
+    """
+    Helper for :meth:`IStorage.open_write()` that calls ``write()`` on exit
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            if self._chunks:
+                data = self._chunks[0][:0].join(self._chunks)
+            else:
+                data = ''
+            self._storage.write(data)
+
+
+class _BufferedUTF8Writer(object):
+    """
+    File-like wrapper that encodes text to UTF-8 and writes it in large blocks
+
+    Serializers tend to produce lots of tiny chunks. Those are collected until
+    at least buffer_size characters are pending and then written to the
+    underlying binary stream at once, so memory usage stays bounded while the
+    number of encode and write calls stays low.
+    """
+
+    buffer_size = 64 * 1024
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._chunks = []
+        self._pending = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._pending += len(data)
+        if self._pending >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            data = self._chunks[0][:0].join(self._chunks)
+            if isinstance(data, _text_type):
+                data = data.encode('UTF-8')
+            self._stream.write(data)
+        self._chunks = []
+        self._pending = 0
+
 
 class FileStorage(IStorage):
     """
@@ -54,11 +231,30 @@ class FileStorage(IStorage):
     This class is used in conjunction with
     :class:`~json_document.document.DocumentPersistance` to *bind* a Document
     to a file (via a serializer).
+
+    If atomic is True the file is never modified in place. Data is written to
+    a temporary file in the same directory which then replaces the original
+    file. Readers (and a crash in the middle of writing) can only observe
+    the old or the new content, never a partially written file.
+
+    If fsync is True the data is flushed to the disk before write() returns.
+    In atomic mode the directory is synchronized as well so that the rename
+    is durable.
+
+    Use_mmap controls whether :meth:`read_buffer()` maps the file into
+    memory. By default (None) this is done only in atomic mode, see
+    :meth:`read_buffer()` for why.
     """
 
-    def __init__(self, pathname, ignore_missing=False):
+    binary = True
+
+    def __init__(self, pathname, ignore_missing=False, atomic=False,
+                 fsync=False, use_mmap=None):
         self._pathname = pathname
         self._ignore_missing = ignore_missing
+        self._atomic = atomic
+        self._fsync = fsync
+        self._use_mmap = atomic if use_mmap is None else use_mmap
 
     @property
     def pathname(self):
@@ -71,15 +267,249 @@ class FileStorage(IStorage):
         The data overwrites anything present in the file earlier. If data is an
         Unicode object it is automatically converted to UTF-8.
         """
-        if isinstance(data, unicode):
+        if isinstance(data, _text_type):
             data = data.encode('UTF-8')
-        elif isinstance(data, str):
+        elif isinstance(data, bytes):
             pass
         else:
             raise TypeError("data must be an unicode or byte-string")
-        with open(self._pathname, 'wt') as stream:
+        with self._open_binary() as stream:
             stream.write(data)
 
+    @contextlib.contextmanager
+    def open_write(self):
+        """
+        Open the file for incremental writing.
+
+        Text written to the returned object is encoded to UTF-8 and written
+        in blocks as it is produced. Even if atomic is False the blocks go to
+        a temporary file which replaces the file when the context manager
+        exits, so an error in the middle of serialization leaves the old
+        content intact.
+        """
+        with self._open_binary(atomic=True) as stream:
+            writer = _BufferedUTF8Writer(stream)
+            yield writer
+            writer.flush()
+
+    @contextlib.contextmanager
+    def _open_binary(self, atomic=None):
+        """
+        Open the file (or a temporary file in atomic mode) for writing
+
+        Atomic overrides the mode of the storage unless it is None.
+        """
+        if atomic is None:
+            atomic = self._atomic
+        if not atomic:
+            with open(self._pathname, 'wb') as stream:
+                yield stream
+                self._sync_file(stream)
+            return
+        temp_pathname, stream = self._create_temporary_file()
+        try:
+            with stream:
+                yield stream
+                self._sync_file(stream)
+            self._copy_mode(temp_pathname)
+            _replace(temp_pathname, self._pathname)
+        except BaseException:
+            os.unlink(temp_pathname)
+            raise
+        if self._fsync:
+            self._sync_directory()
+
+    # Files modified less than this many seconds before their fingerprint
+    # is taken may be modified again without changing the modification time
+    # (some file systems store it with a precision of one or two seconds).
+    racy_window = 2
+
+    def fingerprint(self, content=False):
+        """
+        Get the fingerprint of the file.
+
+        The fingerprint is made of the modification time, size, inode and
+        device number of the file. If content is True the SHA-1 hash of the
+        data is included as well. None is returned if the file does not
+        exist. Without content None is also returned if the file was
+        modified very recently (see racy_window) because another
+        modification may not be visible in the file status yet.
+        """
+        try:
+            info = os.stat(self._pathname)
+        except OSError as exc:
+            if exc.errno == errno.ENOENT:
+                return None
+            raise
+        mtime = getattr(info, 'st_mtime_ns', info.st_mtime)
+        result = (mtime, info.st_size, info.st_ino, info.st_dev)
+        if content:
+            with self.read_buffer() as data:
+                return result + (hashlib.sha1(data).hexdigest(),)
+        if info.st_mtime > time.time() - self.racy_window:
+            return None
+        return result
+
+    def _create_temporary_file(self):
+        """
+        Create a new, uniquely named file next to the target file
+
+        The file is created with the same permissions a regular open() would
+        use (that is, subject to umask).
+        """
+        dirname, basename = os.path.split(self._pathname)
+        while True:
+            temp_pathname = os.path.join(dirname, ".{0}.{1}.tmp".format(
+                basename, binascii.hexlify(os.urandom(6)).decode('ascii')))
+            try:
+                fd = os.open(temp_pathname,
+                             os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            else:
+                return temp_pathname, os.fdopen(fd, 'wb')
+
+    def _copy_mode(self, temp_pathname):
+        """
+        Give the temporary file permissions of the file it replaces
+        """
+        try:
+            mode = stat.S_IMODE(os.stat(self._pathname).st_mode)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+        else:
+            os.chmod(temp_pathname, mode)
+
+    def _sync_file(self, stream):
+        if self._fsync:
+            stream.flush()
+            os.fsync(stream.fileno())
+
+    def _sync_directory(self):
+        dirname = os.path.dirname(self._pathname) or os.curdir
+        try:
+            fd = os.open(dirname, os.O_RDONLY)
+        except OSError:
+            # Directories cannot be opened on some platforms
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def open_read(self):
+        """
+        Open the file for incremental reading.
+
+        The returned stream decodes the file as UTF-8. If ignore_missing is
+        True and the file does not exist an empty stream is returned instead.
+        """
+        try:
+            return io.open(self._pathname, 'rt', encoding='UTF-8')
+        except IOError as exc:
+            if self._ignore_missing is True and exc.errno == errno.ENOENT:
+                return io.StringIO()
+            else:
+                raise
+
+    def append(self, data):
+        """
+        Append the specified data to the end of the file
+
+        The file is created if necessary. Existing content is not rewritten,
+        but if the file does not end with a newline one is added before
+        data. If data is an Unicode object it is automatically converted to
+        UTF-8.
+        """
+        if isinstance(data, _text_type):
+            data = data.encode('UTF-8')
+        with open(self._pathname, 'a+b') as stream:
+            stream.seek(0, os.SEEK_END)
+            if stream.tell() > 0:
+                stream.seek(-1, os.SEEK_END)
+                if stream.read(1) != b"\n":
+                    data = b"\n" + data
+                stream.seek(0, os.SEEK_END)
+            stream.write(data)
+            self._sync_file(stream)
+
+    def read_bytes(self):
+        """
+        Read all data from the file as bytes.
+
+        If ignore_missing is True and the file does not exist an empty byte
+        string is returned instead.
+        """
+        try:
+            with open(self._pathname, 'rb') as stream:
+                return stream.read()
+        except IOError as exc:
+            if self._ignore_missing is True and exc.errno == errno.ENOENT:
+                return b''
+            else:
+                raise
+
+    @contextlib.contextmanager
+    def read_buffer(self):
+        """
+        Map the file into memory and yield a read-only memoryview of it.
+
+        No copy of the data is made, the pages of the file are shared with
+        the operating system cache (and with other processes that map the
+        same file). The mapping is released when the context manager exits.
+        If ignore_missing is True and the file does not exist an empty byte
+        string is yielded instead.
+
+        .. warning::
+
+            If another process truncates a mapped file (for example by
+            rewriting it in place) accessing the missing pages kills the
+            reader with SIGBUS, there is no exception that could be handled.
+            This is why the file is only mapped if it is known to be
+            replaced atomically (atomic mode, which all writers of the file
+            must use) or if use_mmap is True. Otherwise the file is read
+            into bytes.
+        """
+        if not self._use_mmap:
+            yield self.read_bytes()
+            return
+        try:
+            stream = open(self._pathname, 'rb')
+        except IOError as exc:
+            if self._ignore_missing is True and exc.errno == errno.ENOENT:
+                mapping = None
+            else:
+                raise
+        else:
+            with stream:
+                try:
+                    mapping = mmap.mmap(
+                        stream.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    # Empty files cannot be mapped
+                    mapping = None
+        if mapping is None:
+            yield b''
+            return
+        try:
+            view = memoryview(mapping)
+        except TypeError:
+            # Python 2 mmap objects only support the old buffer interface
+            view = mapping
+        try:
+            yield view
+        finally:
+            if view is not mapping:
+                view.release()
+            try:
+                mapping.close()
+            except BufferError:
+                # Somebody still holds a view, leave it to the garbage
+                # collector.
+                pass
+
     def read(self):
         """
         Read all data from the file.
@@ -88,11 +518,593 @@ class FileStorage(IStorage):
         ignore_missing is True and the file does not exist an empty string is
         returned instead.
         """
+        return codecs.utf_8_decode(self.read_bytes(), 'strict', True)[0]
+
+
+class JournalStorage(IStorage):
+    """
+    File-based storage with an append-only journal.
+
+    This class is used in conjunction with
+    :class:`~json_document.document.JournalPersistence`. Data is kept in two
+    files: a snapshot at pathname and a journal next to it (pathname with
+    the ``.journal`` suffix). Calling write() replaces the snapshot
+    (atomically) and starts a new, empty journal. Calling append_journal()
+    adds text to the end of the journal without touching the snapshot.
+
+    The first line of the journal identifies the snapshot it applies to (by
+    size and CRC-32 checksum). A journal that does not match the snapshot,
+    for example because the process was interrupted after the snapshot was
+    replaced but before the journal was reset, is ignored by read_journal().
+
+    If fsync is True both files are flushed to the disk before write() and
+    append_journal() return.
+    """
+
+    binary = True
+
+    def __init__(self, pathname, ignore_missing=False, fsync=False):
+        self._snapshot = FileStorage(
+            pathname, ignore_missing, atomic=True, fsync=fsync)
+        self._journal = FileStorage(
+            pathname + ".journal", ignore_missing=True, atomic=True,
+            fsync=fsync)
+
+    @property
+    def pathname(self):
+        return self._snapshot.pathname
+
+    @property
+    def journal_pathname(self):
+        return self._journal.pathname
+
+    @staticmethod
+    def _make_header(data):
+        """
+        Make the first line of a journal for snapshot data
+        """
+        return '{{"snapshot_size": {0}, "snapshot_crc32": {1}}}\n'.format(
+            len(data), binascii.crc32(data) & 0xffffffff)
+
+    def write(self, data):
+        """
+        Replace the snapshot with data and reset the journal.
+
+        Data can be an Unicode object (encoded to UTF-8) or bytes.
+        """
+        if isinstance(data, _text_type):
+            data = data.encode('UTF-8')
+        self._snapshot.write(data)
+        self._journal.write(self._make_header(data))
+
+    def read(self):
+        """
+        Read the snapshot (see :meth:`FileStorage.read()`)
+        """
+        return self._snapshot.read()
+
+    def read_bytes(self):
+        """
+        Read the snapshot as bytes (see :meth:`FileStorage.read_bytes()`)
+        """
+        return self._snapshot.read_bytes()
+
+    def read_buffer(self):
+        """
+        Map the snapshot into memory (see :meth:`FileStorage.read_buffer()`)
+        """
+        return self._snapshot.read_buffer()
+
+    def open_read(self):
+        """
+        Open the snapshot for reading (see :meth:`FileStorage.open_read()`)
+        """
+        return self._snapshot.open_read()
+
+    def fingerprint(self, content=False):
+        """
+        Get the fingerprint of the snapshot and the journal
+
+        See :meth:`FileStorage.fingerprint()`.
+        """
+        snapshot = self._snapshot.fingerprint(content)
+        journal = self._journal.fingerprint(content)
+        if snapshot is None or journal is None:
+            return None
+        return snapshot, journal
+
+    def read_journal(self):
+        """
+        Read the journal of the current snapshot.
+
+        Returns the list of lines (including line endings) appended to the
+        journal since the snapshot was last written. If there is no journal
+        that matches the snapshot None is returned instead. Nothing may be
+        appended to the journal before the snapshot is written again in that
+        case.
+        """
+        text = self._journal.read()
+        header, newline, rest = text.partition("\n")
+        with self._snapshot.read_buffer() as data:
+            expected = self._make_header(data)
+        if header + newline != expected:
+            return None
+        return rest.splitlines(True)
+
+    def append_journal(self, data):
+        """
+        Append data to the end of the journal
+        """
+        self._journal.append(data)
+
+    def _size(self, pathname):
         try:
-            with open(self._pathname, 'rt') as stream:
-                return stream.read().decode('UTF-8')
-        except IOError as exc:
-            if self._ignore_missing is True and exc.errno == errno.ENOENT:
-                return ''
-            else:
+            return os.stat(pathname).st_size
+        except OSError as exc:
+            if exc.errno == errno.ENOENT:
+                return 0
+            raise
+
+    def snapshot_size(self):
+        """
+        Get the size of the snapshot file in bytes (0 if it is missing)
+        """
+        return self._size(self.pathname)
+
+    def journal_size(self):
+        """
+        Get the size of the journal file in bytes (0 if it is missing)
+        """
+        return self._size(self.journal_pathname)
+
+
+class SQLiteStorage(IStorage):
+    """
+    Storage that keeps documents in an SQLite database.
+
+    This class is used in conjunction with
+    :class:`~json_document.document.SQLitePersistence`. Instead of storing
+    the serialized document as a whole it is split into rows, one per value,
+    keyed by JSON Pointer. Objects and arrays less than depth levels deep are
+    split into their members (so with the default depth of 1 each top-level
+    member or array element gets its own row), deeper values are stored as
+    compact JSON text. This allows :meth:`load()` to fetch only selected
+    parts of the document and :meth:`apply()` to update only the rows that
+    were modified.
+
+    Database is a file name (or ``":memory:"``) or an existing
+    ``sqlite3.Connection``. Any number of documents, identified by name, can
+    be stored in one database. All modifications are done in transactions.
+
+    The regular IStorage methods work with JSON text (they are meant to be
+    used with the :class:`~json_document.serializers.JSON` serializer) and
+    load or replace the whole document.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS json_document (
+            document TEXT NOT NULL,
+            pointer TEXT NOT NULL,
+            parent TEXT,
+            position INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            data TEXT,
+            PRIMARY KEY (document, pointer));
+        CREATE INDEX IF NOT EXISTS json_document_parent
+            ON json_document (document, parent, position);
+        """
+
+    def __init__(self, database, name="document", depth=1):
+        if isinstance(database, sqlite3.Connection):
+            self._connection = database
+        else:
+            self._connection = sqlite3.connect(database)
+        self._name = name
+        self._depth = depth
+        with self._connection:
+            self._connection.executescript(self._SCHEMA)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def depth(self):
+        return self._depth
+
+    def close(self):
+        """
+        Close the database connection
+        """
+        self._connection.close()
+
+    def write(self, data):
+        """
+        Replace the document with one parsed from JSON text
+        """
+        self.store(JSON.loads(data))
+
+    def read(self):
+        """
+        Read the whole document as JSON text
+        """
+        return JSON.dumps(self.load(), human_readable=False)
+
+    def fingerprint(self, content=False):
+        """
+        Get a value that changes whenever the database is modified.
+
+        The fingerprint is made of the data version of the database (which
+        changes when another connection commits a modification) and the
+        number of rows modified through this connection. Modifications of
+        other documents in the same database change it as well. If content
+        is True the SHA-1 hash of the rows of this document is included.
+        """
+        version = self._connection.execute(
+            "PRAGMA data_version").fetchone()[0]
+        result = (version, self._connection.total_changes)
+        if content:
+            digest = hashlib.sha1()
+            for row in self._connection.execute(
+                    "SELECT pointer, parent, position, kind, data"
+                    " FROM json_document WHERE document = ?"
+                    " ORDER BY pointer", (self._name,)):
+                digest.update(JSON.dumps(
+                    list(row), human_readable=False).encode('UTF-8'))
+            result += (digest.hexdigest(),)
+        return result
+
+    def _subtree_query(self, columns, ptr):
+        """
+        Make a query (and parameters) selecting the row at ptr and all the
+        rows below it.
+
+        Pointers of rows below ptr start with ptr + "/". Since "0" follows
+        "/" they are all in the [ptr + "/", ptr + "0") range which can be
+        looked up with the primary key index.
+        """
+        if ptr == "":
+            return ("SELECT {0} FROM json_document WHERE document = ?".format(
+                columns), (self._name,))
+        return ("SELECT {0} FROM json_document WHERE document = ? AND"
+                " (pointer = ? OR pointer >= ? AND pointer < ?)".format(
+                    columns), (self._name, ptr, ptr + "/", ptr + "0"))
+
+    def _delete_subtree(self, ptr):
+        query, params = self._subtree_query("pointer", ptr)
+        self._connection.execute(
+            "DELETE FROM json_document WHERE document = ? AND pointer IN"
+            " ({0})".format(query), (self._name,) + params)
+
+    def _get_row(self, ptr):
+        return self._connection.execute(
+            "SELECT pointer, parent, position, kind, data FROM json_document"
+            " WHERE document = ? AND pointer = ?",
+            (self._name, ptr)).fetchone()
+
+    def _make_rows(self, tokens, value, position):
+        """
+        Make rows for value (found at tokens)
+        """
+        ptr = pointer.join(tokens)
+        parent = pointer.join(tokens[:-1]) if tokens else None
+        if len(tokens) < self._depth and isinstance(value, dict):
+            yield ptr, parent, position, "object", None
+            for index, (key, item) in enumerate(value.items()):
+                for row in self._make_rows(tokens + [key], item, index):
+                    yield row
+        elif len(tokens) < self._depth and isinstance(value, list):
+            yield ptr, parent, position, "array", None
+            for index, item in enumerate(value):
+                for row in self._make_rows(tokens + [index], item, index):
+                    yield row
+        else:
+            yield (ptr, parent, position, "value",
+                   JSON.dumps(value, human_readable=False))
+
+    def _insert(self, tokens, value, position):
+        self._connection.executemany(
+            "INSERT INTO json_document (document, pointer, parent, position,"
+            " kind, data) VALUES (?, ?, ?, ?, ?, ?)",
+            ((self._name,) + row
+             for row in self._make_rows(tokens, value, position)))
+
+    def store(self, value):
+        """
+        Replace the whole document with value
+        """
+        with self._connection:
+            self._delete_subtree("")
+            self._insert([], value, 0)
+
+    def _set(self, tokens, value):
+        """
+        Set the value at tokens (at most depth tokens)
+        """
+        ptr = pointer.join(tokens)
+        row = self._get_row(ptr)
+        if row is not None:
+            position = row[2]
+        elif not tokens:
+            position = 0
+        else:
+            parent = self._get_row(pointer.join(tokens[:-1]))
+            if parent is None or parent[3] == "value":
+                raise KeyError(tokens[-1])
+            position = self._connection.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM json_document"
+                " WHERE document = ? AND parent = ?",
+                (self._name, parent[0])).fetchone()[0]
+        self._delete_subtree(ptr)
+        self._insert(tokens, value, position)
+
+    def _update_row(self, tokens, func):
+        """
+        Modify the JSON text of the row that holds the value at tokens
+        (more than depth tokens)
+        """
+        row_pointer = pointer.join(tokens[:self._depth])
+        row = self._get_row(row_pointer)
+        if row is None or row[3] != "value":
+            raise KeyError(tokens[self._depth - 1])
+        obj = JSON.loads(row[4])
+        func(obj, tokens[self._depth:])
+        self._connection.execute(
+            "UPDATE json_document SET data = ? WHERE document = ? AND"
+            " pointer = ?", (JSON.dumps(obj, human_readable=False),
+                             self._name, row_pointer))
+
+    def apply(self, ops):
+        """
+        Apply a list of operations to the document in one transaction.
+
+        Operations have the form used by the journal of
+        :class:`~json_document.document.JournalPersistence`: ``{"op": "set",
+        "path": "/foo", "value": 1}`` or ``{"op": "remove", "path":
+        "/bar"}``. Only the rows at or below the modified paths are written.
+        Removing a value that does not exist is not an error. Setting or
+        removing array elements must not change the length of the array,
+        set the whole array instead.
+        """
+        with self._connection:
+            for op in ops:
+                tokens = pointer.split(op["path"])
+                if op["op"] == "set":
+                    if len(tokens) <= self._depth:
+                        self._set(tokens, op["value"])
+                    else:
+                        value = op["value"]
+                        self._update_row(
+                            tokens,
+                            lambda obj, tokens: pointer.assign(
+                                obj, tokens, value))
+                elif op["op"] == "remove":
+                    if len(tokens) <= self._depth:
+                        self._delete_subtree(pointer.join(tokens))
+                    else:
+                        try:
+                            self._update_row(tokens, _remove_ignoring_missing)
+                        except KeyError:
+                            pass
+                else:
+                    raise ValueError(
+                        "Unknown operation: {0!r}".format(op["op"]))
+
+    def _select_rows(self, only):
+        """
+        Find rows needed to load values selected by JSON Pointers in only
+
+        Returns a dictionary of rows (keyed by pointer) and a dictionary
+        mapping pointers of rows that should be loaded only partially to
+        lists of pointers to load from them.
+        """
+        whole = set()
+        partial = {}
+        rows = {}
+        for item in only:
+            tokens = pointer.split(item)
+            for index in range(min(len(tokens), self._depth) + 1):
+                ptr = pointer.join(tokens[:index])
+                row = rows.get(ptr) or self._get_row(ptr)
+                if row is None:
+                    break
+                rows[ptr] = row
+                if index == len(tokens) or row[3] == "array":
+                    # Arrays on the way are loaded as a whole
+                    whole.add(ptr)
+                    break
+                if row[3] == "value":
+                    if index == self._depth:
+                        partial.setdefault(ptr, []).append(
+                            pointer.join(tokens[index:]))
+                    break
+        for ptr in whole:
+            query, params = self._subtree_query(
+                "pointer, parent, position, kind, data", ptr)
+            for row in self._connection.execute(query, params):
+                rows[row[0]] = row
+                partial.pop(row[0], None)
+        return rows, partial
+
+    def load(self, only=None):
+        """
+        Load the document (or a part of it)
+
+        If only is a list of JSON Pointers then just the values they point
+        to are loaded. Like with :meth:`JSON.loads_partial()
+        <json_document.serializers.JSON.loads_partial>` objects on the way to
+        selected values contain only the members that lead to them, arrays
+        on the way are loaded as a whole and missing values are ignored.
+
+        :Exceptions:
+            KeyError
+                When the document does not exist
+        """
+        if only is None:
+            query, params = self._subtree_query(
+                "pointer, parent, position, kind, data", "")
+            rows = dict((row[0], row) for row in
+                        self._connection.execute(query, params))
+            partial = {}
+        else:
+            rows, partial = self._select_rows(only)
+        if "" not in rows:
+            raise KeyError(self._name)
+        children = {}
+        for row in rows.values():
+            children.setdefault(row[1], []).append(row)
+        return self._build(rows[""], children, partial)
+
+    def _build(self, row, children, partial):
+        ptr, kind, data = row[0], row[3], row[4]
+        if kind == "value":
+            if ptr in partial:
+                return JSON.loads_partial(data, partial[ptr])
+            return JSON.loads(data)
+        rows = sorted(children.get(ptr, ()), key=lambda row: row[2])
+        if kind == "array":
+            return [self._build(item, children, partial) for item in rows]
+        obj = simplejson.OrderedDict()
+        for item in rows:
+            obj[pointer.split(item[0])[-1]] = self._build(
+                item, children, partial)
+        return obj
+
+
+def _remove_ignoring_missing(obj, tokens):
+    try:
+        pointer.remove(obj, tokens)
+    except LookupError:
+        pass
+
+
+class DirectoryStorage(IStorage):
+    """
+    Storage that keeps each top-level member of a document in its own file.
+
+    This class is used in conjunction with
+    :class:`~json_document.document.DirectoryPersistence`. The document (a
+    dictionary) is stored in a directory. Each member (section) is kept in a
+    separate file, named after the percent-encoded key with suffix appended.
+    The list of keys (which also preserves their order) is kept in the
+    ``.index`` file. All files are replaced atomically. The index is
+    written after the sections so it never refers to a missing file.
+
+    The regular IStorage methods work with JSON text (they are meant to be
+    used with the :class:`~json_document.serializers.JSON` serializer) and
+    read or replace the whole document.
+    """
+
+    INDEX = ".index"
+
+    def __init__(self, pathname, ignore_missing=False, fsync=False,
+                 suffix=".json"):
+        self._pathname = pathname
+        self._ignore_missing = ignore_missing
+        self._fsync = fsync
+        self._suffix = suffix
+
+    @property
+    def pathname(self):
+        return self._pathname
+
+    def _section_pathname(self, key):
+        if isinstance(key, _text_type):
+            key = key.encode('UTF-8')
+        filename = quote(key, safe='')
+        if filename.startswith('.'):
+            # Keep "." and ".." (and hidden files) out of the way
+            filename = '%2E' + filename[1:]
+        return os.path.join(self._pathname, filename + self._suffix)
+
+    def section(self, key):
+        """
+        Get the storage of the section with the specified key
+        """
+        return FileStorage(
+            self._section_pathname(key), atomic=True, fsync=self._fsync)
+
+    def remove_section(self, key):
+        """
+        Remove the file of the section with the specified key (if any)
+        """
+        try:
+            os.unlink(self._section_pathname(key))
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
                 raise
+
+    def create(self):
+        """
+        Create the directory if it does not exist yet
+        """
+        try:
+            os.mkdir(self._pathname)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    def _index(self):
+        return FileStorage(
+            os.path.join(self._pathname, self.INDEX),
+            ignore_missing=self._ignore_missing, atomic=True,
+            fsync=self._fsync)
+
+    def keys(self):
+        """
+        Read the list of keys from the index
+
+        If ignore_missing is True and the index does not exist an empty list
+        is returned instead.
+        """
+        text = self._index().read()
+        if not text:
+            return []
+        return JSON.loads(text)
+
+    def write_keys(self, keys):
+        """
+        Replace the index with the specified list of keys
+        """
+        self._index().write(JSON.dumps(list(keys), human_readable=False))
+
+    def write(self, data):
+        """
+        Replace the whole document with one parsed from JSON text
+        """
+        obj = JSON.loads(data)
+        if not isinstance(obj, dict):
+            raise TypeError("DirectoryStorage can only store objects")
+        old_keys = self.keys()
+        self.create()
+        for key, value in obj.items():
+            self.section(key).write(JSON.dumps(value))
+        self.write_keys(obj.keys())
+        for key in old_keys:
+            if key not in obj:
+                self.remove_section(key)
+
+    def fingerprint(self, content=False):
+        """
+        Get the fingerprint of the index and all the sections.
+
+        See :meth:`FileStorage.fingerprint()`. None is returned if the
+        fingerprint of any of the files is None.
+        """
+        result = [self._index().fingerprint(content)]
+        if result[0] is None:
+            return None
+        for key in self.keys():
+            section = self.section(key).fingerprint(content)
+            if section is None:
+                return None
+            result.append(section)
+        return tuple(result)
+
+    def read(self):
+        """
+        Read the whole document as JSON text
+        """
+        return "{" + ", ".join(
+            JSON.dumps(key) + ": " + self.section(key).read()
+            for key in self.keys()) + "}"
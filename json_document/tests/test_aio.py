@@ -0,0 +1,207 @@
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests for the asyncio persistence."""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from unittest2 import TestCase, skipIf
+
+try:
+    import asyncio
+    from json_document.aio import (
+        AsyncDocumentPersistence,
+        AsyncFileStorage,
+        AsyncStorage,
+        subscribe_queue)
+except (ImportError, SyntaxError):
+    asyncio = None
+
+from json_document.document import Document
+from json_document.serializers import JSON
+from json_document.storage import FileStorage
+
+
+@skipIf(asyncio is None, "asyncio is not available")
+class AsyncDocumentPersistenceTests(TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.pathname = os.path.join(self.dirname, "doc.json")
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        shutil.rmtree(self.dirname)
+
+    def run_coroutine(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_storage(self):
+        storage = AsyncFileStorage(self.pathname, atomic=True)
+        self.run_coroutine(storage.write(u'{"a": 1}'))
+        self.assertEqual(self.run_coroutine(storage.read()), u'{"a": 1}')
+        self.assertEqual(
+            self.run_coroutine(storage.read_bytes()), b'{"a": 1}')
+        self.assertEqual(
+            self.run_coroutine(storage.fingerprint(content=True)),
+            storage.storage.fingerprint(content=True))
+
+    def test_aload(self):
+        FileStorage(self.pathname).write(u'{"a": 1}')
+        persistence = AsyncDocumentPersistence(
+            Document({}), AsyncFileStorage(self.pathname), JSON,
+            check_content=True)
+        self.assertTrue(self.run_coroutine(persistence.aload()))
+        self.assertEqual(persistence.document.value, {"a": 1})
+        self.assertFalse(persistence.is_dirty)
+        # Nothing changed, nothing to load
+        self.assertFalse(self.run_coroutine(persistence.aload()))
+        self.assertTrue(self.run_coroutine(persistence.aload(force=True)))
+
+    def test_aload_keeps_concurrent_changes(self):
+        FileStorage(self.pathname).write(u'{"a": 1}')
+        doc = Document({})
+        loop = self.loop
+        modified = threading.Event()
+
+        def modify():
+            doc["b"] = 2
+            modified.set()
+
+        class ModifyingStorage(FileStorage):
+
+            def read_buffer(self):
+                # Another coroutine runs while the executor reads
+                loop.call_soon_threadsafe(modify)
+                modified.wait(5)
+                return super(ModifyingStorage, self).read_buffer()
+        persistence = AsyncDocumentPersistence(
+            doc, ModifyingStorage(self.pathname), JSON)
+        self.assertFalse(self.run_coroutine(persistence.aload()))
+        self.assertEqual(doc.value, {"b": 2})
+        self.assertTrue(persistence.is_dirty)
+
+    def test_aload_partial(self):
+        FileStorage(self.pathname).write(u'{"a": 1, "b": 2}')
+        persistence = AsyncDocumentPersistence(
+            Document({}), FileStorage(self.pathname), JSON)
+        self.run_coroutine(persistence.aload(only=["/b"]))
+        self.assertEqual(persistence.document.value, {"b": 2})
+        self.assertEqual(persistence.document.projection, ["/b"])
+
+    def test_asave(self):
+        doc = Document({})
+        persistence = AsyncDocumentPersistence(
+            doc, AsyncFileStorage(self.pathname, ignore_missing=True), JSON,
+            check_content=True)
+        doc["a"] = 1
+        self.run_coroutine(persistence.asave())
+        self.assertFalse(persistence.is_dirty)
+        self.assertEqual(
+            JSON.loads(FileStorage(self.pathname).read()), {"a": 1})
+        # The blocking interface agrees that nothing changed
+        self.assertFalse(persistence.load())
+
+    def test_asave_while_modified(self):
+        doc = Document({"a": 1})
+        calls = []
+
+        class ModifyingJSON(JSON):
+
+            @classmethod
+            def dumps(cls, obj, *args, **kwargs):
+                text = JSON.dumps(obj, *args, **kwargs)
+                if not calls:
+                    # Another coroutine modified the document meanwhile
+                    doc["a"] = 2
+                calls.append(text)
+                return text
+        persistence = AsyncDocumentPersistence(
+            doc, AsyncStorage(FileStorage(self.pathname)), ModifyingJSON)
+        self.run_coroutine(persistence.asave())
+        # The copy taken before serialization was saved
+        self.assertEqual(
+            JSON.loads(FileStorage(self.pathname).read()), {"a": 1})
+        self.assertTrue(persistence.is_dirty)
+        self.run_coroutine(persistence.asave())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(
+            JSON.loads(FileStorage(self.pathname).read()), {"a": 2})
+        self.assertFalse(persistence.is_dirty)
+
+    def test_asave_partial(self):
+        FileStorage(self.pathname).write(u'{"a": 1, "b": 2}')
+        persistence = AsyncDocumentPersistence(
+            Document({}), FileStorage(self.pathname), JSON)
+        self.run_coroutine(persistence.aload(only=["/b"]))
+        persistence.document["b"] = 3
+        self.run_coroutine(persistence.asave(merge=True))
+        self.assertEqual(
+            JSON.loads(FileStorage(self.pathname).read()), {"a": 1, "b": 3})
+
+    def test_concurrent_coroutines(self):
+        doc = Document({})
+        persistence = AsyncDocumentPersistence(
+            doc, FileStorage(self.pathname, ignore_missing=True), JSON)
+
+        def modify(i):
+            doc[str(i)] = i
+            return persistence.asave()
+        self.run_coroutine(asyncio.gather(*[modify(i) for i in range(20)]))
+        self.assertEqual(
+            JSON.loads(FileStorage(self.pathname).read()), doc.value)
+        self.assertFalse(persistence.is_dirty)
+
+
+@skipIf(asyncio is None, "asyncio is not available")
+class SubscribeQueueTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_changes_are_queued(self):
+        doc = Document({"a": {"b": 1}})
+        queue, subscription = subscribe_queue(doc, "/a/*")
+        doc["a"]["b"] = 2
+        with doc.batch():
+            doc["a"]["c"] = 3
+            doc["a"]["b"] = 3
+        subscription.cancel()
+        doc["a"]["b"] = 4
+        self.assertEqual(
+            self.loop.run_until_complete(queue.get()), ["/a/b"])
+        self.assertEqual(
+            self.loop.run_until_complete(queue.get()), ["/a/c", "/a/b"])
+        self.assertTrue(queue.empty())
+
+    def test_changes_from_other_threads(self):
+        doc = Document({"a": 1})
+        queue, subscription = subscribe_queue(doc, "/a")
+        thread = threading.Thread(target=doc.__setitem__, args=("a", 2))
+        thread.start()
+        changes = self.loop.run_until_complete(
+            asyncio.wait_for(queue.get(), 5))
+        thread.join()
+        self.assertEqual(changes, ["/a"])
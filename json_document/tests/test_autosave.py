@@ -0,0 +1,179 @@
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests for background saving."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from unittest2 import TestCase
+
+from json_document.autosave import AutoSave
+from json_document.document import (
+    Document,
+    DocumentPersistence,
+    JournalPersistence)
+from json_document.errors import PartialDocumentError
+from json_document.locking import ConcurrentDocument
+from json_document.serializers import JSON, MemoizingJSON
+from json_document.storage import FileStorage, JournalStorage
+
+
+class CountingStorage(FileStorage):
+
+    def __init__(self, pathname):
+        super(CountingStorage, self).__init__(pathname, ignore_missing=True)
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+        super(CountingStorage, self).write(text)
+
+
+class AutoSaveTests(TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.pathname = os.path.join(self.dirname, "doc.json")
+        self.storage = CountingStorage(self.pathname)
+        self.doc = ConcurrentDocument({})
+        self.persistence = DocumentPersistence(
+            self.doc, self.storage, JSON)
+        self.errors = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def _autosave(self, **kwargs):
+        kwargs.setdefault("on_error", lambda persistence, exc:
+                          self.errors.append(exc))
+        return AutoSave(self.persistence, **kwargs)
+
+    def _wait_for_write(self, timeout=5):
+        deadline = time.time() + timeout
+        while not self.storage.writes and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _stored(self):
+        return JSON.loads(FileStorage(self.pathname).read())
+
+    def test_saves_in_background(self):
+        with self._autosave(delay=0.01) as autosave:
+            self.doc["a"] = 1
+            self._wait_for_write()
+            self.assertEqual(self._stored(), {"a": 1})
+            self.assertFalse(self.persistence.is_dirty)
+            autosave.close()
+        self.assertEqual(len(self.storage.writes), 1)
+
+    def test_changes_are_coalesced(self):
+        with self._autosave(delay=0.2, max_delay=10):
+            for i in range(10):
+                self.doc["a"] = i
+            self._wait_for_write()
+        self.assertEqual(len(self.storage.writes), 1)
+        self.assertEqual(self._stored(), {"a": 9})
+
+    def test_max_delay(self):
+        with self._autosave(delay=10, max_delay=0.05):
+            self.doc["a"] = 1
+            self._wait_for_write()
+            self.assertEqual(len(self.storage.writes), 1)
+
+    def test_flush(self):
+        autosave = self._autosave(delay=10, max_delay=10)
+        self.doc["a"] = 1
+        autosave.flush()
+        self.assertEqual(self._stored(), {"a": 1})
+        autosave.flush()
+        autosave.close()
+        self.assertEqual(len(self.storage.writes), 1)
+
+    def test_streaming(self):
+        self.persistence.streaming = True
+        with self._autosave(delay=10, max_delay=10) as autosave:
+            self.doc["a"] = 1
+            autosave.flush()
+            self.assertEqual(self._stored(), {"a": 1})
+        # The document is streamed with open_write(), not written at once
+        self.assertEqual(self.storage.writes, [])
+
+    def test_close_saves_remaining_changes(self):
+        autosave = self._autosave(delay=10, max_delay=10)
+        self.doc["a"] = 1
+        autosave.close()
+        self.assertEqual(self._stored(), {"a": 1})
+        # Changes after close() are not saved any more
+        self.doc["a"] = 2
+        time.sleep(0.05)
+        self.assertEqual(self._stored(), {"a": 1})
+
+    def test_errors(self):
+        self.doc._projection = ("/a",)
+        with self._autosave(delay=0.01):
+            self.doc["a"] = 1
+            deadline = time.time() + 5
+            while not self.errors and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertIsInstance(self.errors[0], PartialDocumentError)
+            self.doc._projection = None
+
+    def test_concurrent_modifications(self):
+        with self._autosave(delay=0, max_delay=0):
+            for i in range(2000):
+                with self.doc.writing():
+                    self.doc[str(i)] = list(range(i % 7))
+                    if i >= 50:
+                        del self.doc[str(i - 50)]
+        self.assertEqual(self.errors, [])
+        self.assertEqual(self._stored(), self.doc.value)
+        for text in self.storage.writes:
+            JSON.loads(text)
+
+    def test_unsupported_persistence(self):
+        persistence = JournalPersistence(
+            Document({}), JournalStorage(self.pathname), JSON)
+        self.assertRaises(TypeError, AutoSave, persistence)
+
+    def test_memoizing_serializer(self):
+        self.persistence.serializer = MemoizingJSON()
+        with self.doc.writing():
+            self.doc["a"] = {"b": [1]}
+        with self._autosave(delay=0, max_delay=0):
+            for i in range(500):
+                with self.doc.writing():
+                    self.doc["a"]["b"] = list(range(i % 9))
+                    self.doc["a"]["c"] = i
+        self.assertEqual(self.errors, [])
+        self.assertEqual(self._stored(), self.doc.value)
+
+    def test_lock(self):
+        self.doc = Document({})
+        self.persistence = DocumentPersistence(
+            self.doc, self.storage, JSON)
+        lock = threading.Lock()
+        with self._autosave(delay=0, max_delay=0, lock=lock):
+            for i in range(500):
+                with lock:
+                    self.doc[str(i % 20)] = list(range(i % 7))
+        self.assertEqual(self.errors, [])
+        self.assertEqual(self._stored(), self.doc.value)
+
+    def test_plain_document_needs_lock(self):
+        persistence = DocumentPersistence(
+            Document({}), self.storage, JSON)
+        self.assertRaises(TypeError, AutoSave, persistence)
@@ -0,0 +1,129 @@
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests for sharing documents between threads."""
+
+import threading
+import time
+
+from unittest2 import TestCase
+
+from json_document.locking import ConcurrentDocument, ReadWriteLock
+
+
+class ReadWriteLockTests(TestCase):
+
+    def test_many_readers(self):
+        lock = ReadWriteLock()
+        lock.acquire_read()
+        lock.acquire_read()
+        lock.release_read()
+        lock.release_read()
+
+    def test_writer_waits_for_readers(self):
+        lock = ReadWriteLock()
+        events = []
+        lock.acquire_read()
+
+        def write():
+            with lock.write_locked():
+                events.append("write")
+        thread = threading.Thread(target=write)
+        thread.start()
+        time.sleep(0.05)
+        events.append("read done")
+        lock.release_read()
+        thread.join()
+        self.assertEqual(events, ["read done", "write"])
+
+    def test_waiting_writer_blocks_new_readers(self):
+        lock = ReadWriteLock()
+        events = []
+        lock.acquire_read()
+
+        def write():
+            with lock.write_locked():
+                events.append("write")
+
+        def read():
+            with lock.read_locked():
+                events.append("read")
+        writer = threading.Thread(target=write)
+        writer.start()
+        time.sleep(0.05)
+        reader = threading.Thread(target=read)
+        reader.start()
+        time.sleep(0.05)
+        self.assertEqual(events, [])
+        lock.release_read()
+        writer.join()
+        reader.join()
+        self.assertEqual(events, ["write", "read"])
+
+
+class ConcurrentDocumentTests(TestCase):
+
+    def test_snapshot(self):
+        doc = ConcurrentDocument({"a": [1, {"b": 2}]})
+        snapshot = doc.snapshot()
+        self.assertEqual(snapshot["a"][1]["b"], 2)
+        self.assertIsInstance(snapshot["a"], tuple)
+        self.assertIs(doc.snapshot(), snapshot)
+        with doc.writing():
+            doc["a"] = []
+        self.assertEqual(doc.snapshot()["a"], ())
+        self.assertEqual(snapshot["a"][0], 1)
+
+    def test_snapshot_is_read_only(self):
+        doc = ConcurrentDocument({"a": 1})
+        try:
+            doc.snapshot()["a"] = 2
+        except TypeError:
+            pass
+        self.assertEqual(doc["a"].value, 1)
+
+    def test_stress(self):
+        # The writer keeps "a" and "b" equal, readers must never see
+        # them differ.
+        doc = ConcurrentDocument({"a": 0, "b": 0, "items": []})
+        stop = threading.Event()
+        errors = []
+
+        def read():
+            while not stop.is_set():
+                snapshot = doc.snapshot()
+                if snapshot["a"] != snapshot["b"]:
+                    errors.append(dict(snapshot))
+                with doc.reading():
+                    a = doc["a"].value
+                    b = doc["b"].value
+                    count = len(doc["items"])
+                if a != b or count != min(a, 10):
+                    errors.append((a, b, count))
+
+        readers = [threading.Thread(target=read) for i in range(8)]
+        for reader in readers:
+            reader.start()
+        try:
+            for i in range(1, 500):
+                with doc.writing():
+                    doc["a"] = i
+                    doc["items"] = list(range(min(i, 10)))
+                    doc["b"] = i
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(doc.snapshot()["a"], 499)
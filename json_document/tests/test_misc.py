@@ -23,6 +23,8 @@ json_document.tests
 Unit tests for this package
 """
 
+import copy
+import operator
 import sys
 
 if sys.version_info[0] > 2:
@@ -39,8 +41,12 @@ from unittest2 import TestCase
 from json_document.document import (
     DefaultValue,
     Document,
-    DocumentFragment)
+    DocumentFragment,
+    DocumentPersistence,
+    LazyValue)
+from json_document.errors import FrozenDocumentError
 from json_document.serializers import JSON
+from json_document.storage import IStorage
 from json_document.errors import OrphanedFragmentError
 from json_document import bridge
 
@@ -171,6 +177,50 @@ class JSONDumpTests(TestCase):
         self.assertEqual(observed_text, self.expected_compact_sorted_text)
 
 
+class JSONIterencodeTests(TestCase):
+    """
+    Checks that JSON.iterencode() produces the same text as JSON.dumps()
+    """
+
+    def setUp(self):
+        super(JSONIterencodeTests, self).setUp()
+        self.doc = OrderedDict([
+            ("format", "Dashboard Bundle Format 1.0"),
+            ("test_runs", [
+                OrderedDict([
+                    ("test_id", "stream"),
+                    ("attributes", {}),
+                    ("test_results", [
+                        {"result": "pass", "measurement": Decimal("1.5")},
+                        {"result": "fail", "message": "line 1\nline 2"},
+                    ]),
+                ]),
+                [],
+                [[1, 2], [3]],
+            ]),
+            ("misc", {1: [None], "z": [True, False]}),
+        ])
+
+    def test_iterencode_matches_dumps(self):
+        for human_readable in (True, False):
+            for sort_keys in (True, False):
+                self.assertEqual(
+                    "".join(JSON.iterencode(
+                        self.doc, human_readable, sort_keys)),
+                    JSON.dumps(self.doc, human_readable, sort_keys))
+
+    def test_iterencode_produces_multiple_chunks(self):
+        doc = {"runs": [{"id": i, "results": []} for i in range(1000)]}
+        chunks = list(JSON.iterencode(doc))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), JSON.dumps(doc))
+
+    def test_iterencode_of_simple_values(self):
+        for value in ([], {}, None, 1, "text", [1, 2]):
+            self.assertEqual(
+                "".join(JSON.iterencode(value)), JSON.dumps(value))
+
+
 class JSONParsingTests(TestCase):
     """
     Sanity checks for deserialization options
@@ -212,6 +262,9 @@ class FakeDocument(object):
     def _bump_revision(self):
         self._revision = object()
 
+    def _fragment_modified(self, fragment, item=None):
+        self._bump_revision()
+
     @property
     def revision(self):
         return self._revision
@@ -510,6 +563,17 @@ class DocumentFragmentDelTests(TestCase):
         self.assertEqual(doc['foo'].value, "bar")
         self.assertFalse(doc.is_default)
 
+    def test_delitem_shifts_list_fragments(self):
+        doc = Document({"list": ["a", "b", "c"]})
+        fragment_a = doc["list"][0]
+        fragment_c = doc["list"][2]
+        del doc["list"][1]
+        self.assertFalse(fragment_a.is_orphaned)
+        self.assertEqual(fragment_c.item, 1)
+        self.assertIs(doc["list"][1], fragment_c)
+        fragment_c.value = "C"
+        self.assertEqual(doc.value, {"list": ["a", "C"]})
+
     def test_delitem_bumps_document_revision(self):
         doc = Document({"item": "value"})
         before = doc._revision
@@ -662,6 +726,132 @@ class DocumentFragmentIterTests(TestCase):
         self.assertRaises(TypeError, iter, fragment)
 
 
+class DocumentFragmentMergeValueTests(TestCase):
+    """
+    Tests related to DocumentFragment._merge_value()
+    """
+
+    def setUp(self):
+        super(DocumentFragmentMergeValueTests, self).setUp()
+        self.doc = Document(OrderedDict([
+            ("same", {"a": [1, 2]}),
+            ("changed", {"b": 1, "c": 2}),
+            ("list", [1, {"d": 3}, 5]),
+            ("removed", 1)]))
+        self.same = self.doc["same"]
+        self.same_a = self.doc["same"]["a"]
+        self.changed = self.doc["changed"]
+        self.list_item = self.doc["list"][1]
+        self.removed = self.doc["removed"]
+
+    def test_unchanged_value(self):
+        self.doc._merge_value(copy.deepcopy(self.doc.value))
+        self.assertEqual(self.doc.revision, 0)
+
+    def test_fragments_of_unchanged_parts_are_kept(self):
+        self.doc._merge_value(OrderedDict([
+            ("same", {"a": [1, 2]}),
+            ("changed", {"b": 10, "c": 2}),
+            ("list", [1, {"d": 3}, 5, 6]),
+            ("added", True)]))
+        self.assertEqual(self.doc.value, {
+            "same": {"a": [1, 2]},
+            "changed": {"b": 10, "c": 2},
+            "list": [1, {"d": 3}, 5, 6],
+            "added": True})
+        self.assertIs(self.doc["same"], self.same)
+        self.assertIs(self.doc["same"]["a"], self.same_a)
+        self.assertIs(self.doc["changed"], self.changed)
+        self.assertIs(self.doc["list"][1], self.list_item)
+        self.assertFalse(self.changed.is_orphaned)
+        self.assertTrue(self.removed.is_orphaned)
+
+    def test_observers_see_only_changes(self):
+        seen = []
+        self.doc._observers.append(
+            lambda fragment, item: seen.append((fragment._path(), item)))
+        self.doc._merge_value(OrderedDict([
+            ("same", {"a": [1, 2]}),
+            ("changed", {"b": 1, "c": 3}),
+            ("list", [1, {"d": 3}, 5]),
+            ("removed", 1)]))
+        self.assertEqual(seen, [(["changed", "c"], None)])
+
+    def test_key_order(self):
+        self.doc._merge_value(OrderedDict([
+            ("removed", 1),
+            ("list", [1, {"d": 3}, 5]),
+            ("changed", {"b": 1, "c": 2}),
+            ("same", {"a": [1, 2]})]))
+        self.assertEqual(list(self.doc.value.keys()),
+                         ["removed", "list", "changed", "same"])
+        self.assertIs(self.doc["same"], self.same)
+
+    def test_type_change(self):
+        self.doc["list"]._merge_value({"e": 1})
+        self.assertEqual(self.doc["list"].value, {"e": 1})
+        self.assertTrue(self.list_item.is_orphaned)
+
+    def test_equal_values_of_other_types(self):
+        self.doc._merge_value(OrderedDict([
+            ("same", {"a": [True, 2.0]}),
+            ("changed", {"b": Decimal("1.0"), "c": 2}),
+            ("list", [1, {"d": 3}, 5]),
+            ("removed", 1)]))
+        self.assertIs(self.doc["same"]["a"][0].value, True)
+        self.assertIsInstance(self.doc["same"]["a"][1].value, float)
+        self.doc["changed"]["b"] = Decimal("1.00")
+        self.assertEqual(
+            str(self.doc["changed"]["b"].value), "1.00")
+        self.assertFalse(self.changed.is_orphaned)
+
+
+class LazyValueTests(TestCase):
+    """
+    Tests related to LazyValue placeholders
+    """
+
+    def setUp(self):
+        super(LazyValueTests, self).setUp()
+        self.loaded = []
+        self.doc = Document({})
+        self.doc._value = {"a": self.make_lazy("a", 1), "b": 2,
+                           "c": self.make_lazy("c", [3])}
+        self.doc._lazy_items = 2
+
+    def make_lazy(self, name, value):
+        def loader():
+            self.loaded.append(name)
+            return value
+        return LazyValue(loader)
+
+    def test_getitem_loads_only_accessed_item(self):
+        self.assertEqual(self.doc["a"].value, 1)
+        self.assertEqual(self.loaded, ["a"])
+        self.assertEqual(self.doc["a"].value, 1)
+        self.assertEqual(self.loaded, ["a"])
+
+    def test_len_and_contains_do_not_load(self):
+        self.assertEqual(len(self.doc), 3)
+        self.assertIn("c", self.doc)
+        self.assertEqual(self.loaded, [])
+
+    def test_value_loads_everything(self):
+        self.assertEqual(self.doc.value, {"a": 1, "b": 2, "c": [3]})
+        self.assertEqual(sorted(self.loaded), ["a", "c"])
+        self.assertEqual(self.doc._lazy_items, 0)
+
+    def test_loading_does_not_bump_revision(self):
+        self.doc["c"]
+        self.assertEqual(self.doc.revision, 0)
+
+    def test_delitem(self):
+        del self.doc["a"]
+        self.assertEqual(self.doc._lazy_items, 1)
+        self.assertEqual(self.doc.value, {"b": 2, "c": [3]})
+        self.assertEqual(self.loaded, ["c"])
+
+
 class DocumentTests(TestCase):
     """
     Tests related to the Document class
@@ -695,6 +885,245 @@ class DocumentTests(TestCase):
         self.assertIs(doc._item, None)
 
 
+class DocumentFreezeTests(TestCase):
+    """
+    Tests related to Document.freeze()
+    """
+
+    schema = {
+        "type": "object",
+        "properties": {
+            "items": {"type": "array", "items": {"type": "integer"}},
+            "extra": {"type": "object", "optional": True,
+                      "default": {"a": 1}}}}
+
+    def setUp(self):
+        self.doc = Document({"items": [1, 2], "name": "x"}, self.schema)
+
+    def test_value_is_read_only(self):
+        self.doc.freeze()
+        self.assertTrue(self.doc.is_frozen)
+        self.assertEqual(self.doc.value["items"], (1, 2))
+        self.assertRaises(
+            TypeError, operator.setitem, self.doc.value, "name", 1)
+
+    def test_reading(self):
+        self.doc.freeze()
+        self.assertEqual(self.doc["items"][1].value, 2)
+        self.assertEqual(len(self.doc["items"]), 2)
+        self.assertIn("name", self.doc)
+        self.assertEqual(
+            [fragment.value for fragment in self.doc["items"]], [1, 2])
+        self.assertEqual(self.doc["extra"]["a"].value, 1)
+        self.doc.validate()
+
+    def test_modifications_raise(self):
+        items = self.doc["items"]
+        self.doc.freeze()
+        revision = self.doc.revision
+        self.assertRaises(FrozenDocumentError, self.doc.__setitem__, "a", 1)
+        self.assertRaises(FrozenDocumentError, self.doc.__delitem__, "name")
+        self.assertRaises(
+            FrozenDocumentError, setattr, self.doc["name"], "value", "y")
+        self.assertRaises(
+            FrozenDocumentError, self.doc["extra"].revert_to_default)
+        self.assertRaises(FrozenDocumentError, setattr, self.doc, "value", {})
+        self.assertEqual(self.doc.revision, revision)
+        # Fragments of the mutable value were orphaned
+        self.assertTrue(items.is_orphaned)
+
+    def test_fragments_are_not_cached(self):
+        self.doc.freeze()
+        self.assertIsNot(self.doc["items"], self.doc["items"])
+        self.assertEqual(self.doc._fragment_cache, {})
+        self.assertEqual(self.doc["items"]._fragment_cache, {})
+
+    def test_save(self):
+        storage = IStorage()
+        written = []
+        storage.write = written.append
+        persistence = DocumentPersistence(self.doc, storage, JSON)
+        self.doc.freeze()
+        persistence.save()
+        self.assertEqual(
+            JSON.loads(written[0]), {"items": [1, 2], "name": "x"})
+
+    def test_gc_freeze(self):
+        import gc
+        if not hasattr(gc, "freeze"):
+            self.skipTest("gc.freeze() is not available")
+        try:
+            self.doc.freeze(gc_freeze=True)
+            self.assertGreater(gc.get_freeze_count(), 0)
+        finally:
+            gc.unfreeze()
+
+
+class DocumentSubtreeRevisionTests(TestCase):
+
+    def setUp(self):
+        self.doc = Document({"a": {"x": 1, "y": [1, 2, 3]}, "b": {"z": 1}})
+
+    def test_starts_at_document_revision(self):
+        self.doc["a"]["x"] = 2
+        self.assertEqual(self.doc.subtree_revision, self.doc.revision)
+        self.assertEqual(self.doc["b"].subtree_revision, self.doc.revision)
+
+    def test_bumped_along_ancestors(self):
+        a, b, y = self.doc["a"], self.doc["b"], self.doc["a"]["y"]
+        revision = b.subtree_revision
+        self.doc["a"]["x"] = 2
+        self.assertEqual(self.doc["a"]["x"].subtree_revision,
+                         self.doc.revision)
+        self.assertEqual(a.subtree_revision, self.doc.revision)
+        self.assertEqual(self.doc.subtree_revision, self.doc.revision)
+        self.assertEqual(b.subtree_revision, revision)
+        self.assertEqual(y.subtree_revision, revision)
+
+    def test_new_fragments_start_at_parent_revision(self):
+        self.doc["a"]["x"] = 2
+        self.assertEqual(self.doc["a"]["y"].subtree_revision,
+                         self.doc["a"].subtree_revision)
+
+    def test_added_and_removed_items(self):
+        y = self.doc["a"]["y"]
+        self.doc["a"]["new"] = 1
+        self.assertEqual(self.doc["a"].subtree_revision, self.doc.revision)
+        self.assertLess(y.subtree_revision, self.doc.revision)
+        del self.doc["a"]["new"]
+        self.assertEqual(self.doc["a"].subtree_revision, self.doc.revision)
+
+    def test_replaced_values(self):
+        old = self.doc["a"]["x"]
+        self.doc["a"] = {"x": 1}
+        self.assertTrue(old.is_orphaned)
+        self.assertEqual(self.doc["a"]["x"].subtree_revision,
+                         self.doc.revision)
+
+    def test_shifted_list_items(self):
+        items = list(self.doc["a"]["y"])
+        first = items[0].subtree_revision
+        del self.doc["a"]["y"][0]
+        self.assertEqual(self.doc["a"]["y"][0].value, 2)
+        self.assertEqual(self.doc["a"]["y"][0].subtree_revision,
+                         self.doc.revision)
+        self.assertGreater(self.doc["a"]["y"][1].subtree_revision, first)
+
+
+class DocumentSubscribeTests(TestCase):
+
+    def setUp(self):
+        self.doc = Document({
+            "services": {"web": {"port": 80, "host": "a"},
+                         "db": {"port": 5432, "host": "b"}},
+            "list": [{"port": 1}, {"port": 2}]})
+        self.events = []
+
+    def subscribe(self, pattern):
+        return self.doc.subscribe(
+            pattern, lambda changes: self.events.append((pattern, changes)))
+
+    def test_exact_path(self):
+        self.subscribe("/services/web/port")
+        self.doc["services"]["web"]["port"] = 8080
+        self.doc["services"]["web"]["host"] = "c"
+        self.doc["services"]["db"]["port"] = 1
+        self.assertEqual(self.events, [
+            ("/services/web/port", ["/services/web/port"])])
+
+    def test_wildcard(self):
+        self.subscribe("/services/*/port")
+        self.doc["services"]["web"]["port"] = 8080
+        self.doc["services"]["db"]["host"] = "c"
+        self.doc["services"]["db"]["port"] = 1
+        self.assertEqual(self.events, [
+            ("/services/*/port", ["/services/web/port"]),
+            ("/services/*/port", ["/services/db/port"])])
+
+    def test_array_items(self):
+        self.subscribe("/list/*/port")
+        self.doc["list"][1]["port"] = 3
+        del self.doc["list"][0]
+        self.assertEqual(self.events, [
+            ("/list/*/port", ["/list/1/port"]),
+            ("/list/*/port", ["/list"])])
+
+    def test_changes_inside_and_around(self):
+        self.subscribe("/services/web")
+        self.subscribe("/services/*/port/deeper")
+        self.subscribe("")
+        self.doc["services"]["web"]["port"] = 8080
+        self.doc["services"] = {}
+        self.assertEqual(sorted(self.events), sorted([
+            ("/services/web", ["/services/web/port"]),
+            ("/services/*/port/deeper", ["/services/web/port"]),
+            ("", ["/services/web/port"]),
+            ("/services/web", ["/services"]),
+            ("/services/*/port/deeper", ["/services"]),
+            ("", ["/services"])]))
+
+    def test_added_and_removed_members(self):
+        self.subscribe("/services/*")
+        self.doc["services"]["new"] = {}
+        del self.doc["services"]["db"]
+        self.assertEqual(self.events, [
+            ("/services/*", ["/services/new"]),
+            ("/services/*", ["/services/db"])])
+
+    def test_cancel(self):
+        subscription = self.subscribe("/services/*/port")
+        other = self.subscribe("/services/web/port")
+        subscription.cancel()
+        self.doc["services"]["web"]["port"] = 8080
+        self.assertEqual(self.events, [
+            ("/services/web/port", ["/services/web/port"])])
+        other.cancel()
+        self.assertEqual(self.doc._subscriptions.root.children, {})
+
+    def test_batch(self):
+        self.subscribe("/services/*/port")
+        self.subscribe("/list")
+        with self.doc.batch():
+            self.doc["services"]["web"]["port"] = 8080
+            with self.doc.batch():
+                self.doc["services"]["db"]["port"] = 1
+                self.doc["services"]["web"]["port"] = 8081
+            self.assertEqual(self.events, [])
+        self.assertEqual(self.events, [
+            ("/services/*/port",
+             ["/services/web/port", "/services/db/port"])])
+
+    def test_batch_without_subscriptions(self):
+        with self.doc.batch() as doc:
+            doc["list"] = []
+        self.assertEqual(self.doc["list"].value, [])
+
+    def test_subscribe_inside_batch(self):
+        with self.doc.batch():
+            self.subscribe("/list")
+            self.doc["list"] = []
+            self.doc["list"] = [1]
+            self.assertEqual(self.events, [])
+        self.assertEqual(self.events, [("/list", ["/list"])])
+
+    def test_failing_callback(self):
+        observed = []
+        self.doc._observers.append(
+            lambda fragment, item: observed.append(self.events[:]))
+
+        def fail(changes):
+            raise ValueError(changes)
+        self.doc.subscribe("/list", fail)
+        self.subscribe("/list")
+        with self.assertRaises(ValueError):
+            self.doc["list"] = []
+        # Observers run first, the other subscribers are still called
+        self.assertEqual(observed, [[]])
+        self.assertEqual(self.events, [("/list", ["/list"])])
+        self.assertEqual(self.doc["list"].value, [])
+        self.assertEqual(self.doc._subscriptions.pending, {})
+
+
 class DocumentUsageTests(TestCase):
     """
     Tests related to using document features
@@ -786,3 +1215,102 @@ class DecoratorTests(TestCase):
         self.assertEqual(self.doc.value, {'bridge_to_readwrite': obj2})
         del self.doc.bridge_to_readwrite
         self.assertEqual(self.doc.value, {})
+
+
+class ComputedTests(TestCase):
+    """
+    Tests for the bridge.computed decorator
+    """
+
+    class Order(Document):
+
+        calls = None
+
+        @bridge.computed
+        def total(self):
+            """total"""
+            self.calls.append("total")
+            return sum(item["price"].value * item["count"].value
+                       for item in self["items"])
+
+        @bridge.computed
+        def customer_name(self):
+            self.calls.append("customer_name")
+            return self["customer"]["name"].value.title()
+
+        @bridge.computed
+        def has_discount(self):
+            self.calls.append("has_discount")
+            return "discount" in self["customer"]
+
+        @bridge.computed
+        def total_with_tax(self):
+            self.calls.append("total_with_tax")
+            return self.total * 2
+
+        @bridge.computed(depends=["/items"])
+        def item_count(self):
+            self.calls.append("item_count")
+            return len(self.value["items"])
+
+    def setUp(self):
+        super(ComputedTests, self).setUp()
+        self.doc = self.Order({
+            "customer": {"name": "john", "city": "x"},
+            "items": [{"price": 2, "count": 1}, {"price": 3, "count": 2}]})
+        self.doc.calls = []
+
+    def test_value_is_cached(self):
+        self.assertEqual(self.doc.total, 8)
+        self.assertEqual(self.doc.total, 8)
+        self.assertEqual(self.doc.calls, ["total"])
+        self.assertEqual(self.Order.total.__doc__, "total")
+
+    def test_unrelated_changes_keep_the_value(self):
+        self.assertEqual(self.doc.total, 8)
+        self.assertEqual(self.doc.customer_name, "John")
+        self.doc["customer"]["city"] = "y"
+        self.doc["notes"] = "..."
+        self.assertEqual(self.doc.total, 8)
+        self.assertEqual(self.doc.customer_name, "John")
+        self.assertEqual(self.doc.calls, ["total", "customer_name"])
+
+    def test_dependencies_are_tracked(self):
+        self.assertEqual(self.doc.total, 8)
+        self.doc["items"][1]["count"] = 3
+        self.assertEqual(self.doc.total, 11)
+        self.doc["items"][0] = {"price": 1, "count": 1}
+        self.assertEqual(self.doc.total, 10)
+        del self.doc["items"][0]
+        self.assertEqual(self.doc.total, 9)
+        self.doc.value = {"items": []}
+        self.assertEqual(self.doc.total, 0)
+        self.assertEqual(self.doc.calls, ["total"] * 5)
+
+    def test_missing_values(self):
+        self.assertFalse(self.doc.has_discount)
+        self.doc["customer"]["discount"] = 10
+        self.assertTrue(self.doc.has_discount)
+        self.assertEqual(self.doc.calls, ["has_discount"] * 2)
+
+    def test_nested(self):
+        self.assertEqual(self.doc.total_with_tax, 16)
+        self.doc["customer"]["name"] = "jane"
+        self.assertEqual(self.doc.total_with_tax, 16)
+        self.doc["items"][0]["price"] = 4
+        self.assertEqual(self.doc.total_with_tax, 20)
+        self.assertEqual(self.doc.calls, [
+            "total_with_tax", "total", "total_with_tax", "total"])
+
+    def test_declared_dependencies(self):
+        self.assertEqual(self.doc.item_count, 2)
+        # Reading the whole value would depend on everything
+        self.doc["customer"]["name"] = "jane"
+        self.assertEqual(self.doc.item_count, 2)
+        self.doc["items"][0]["count"] = 5
+        self.assertEqual(self.doc.item_count, 2)
+        self.assertEqual(self.doc.calls, ["item_count", "item_count"])
+
+    def test_read_only(self):
+        with self.assertRaises(AttributeError):
+            self.doc.total = 1
@@ -0,0 +1,287 @@
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests for multi-process validation."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from json_schema_validator.errors import ValidationError
+from unittest2 import TestCase
+
+from json_document.document import (
+    DirectoryPersistence,
+    Document,
+    DocumentPersistence,
+    JournalPersistence,
+    SQLitePersistence)
+from json_document.parallel import (
+    PersistenceGroup,
+    validate_chunked,
+    validate_corpus)
+from json_document.serializers import IndexedBinary, JSON
+from json_document.storage import (
+    DirectoryStorage,
+    FileStorage,
+    JournalStorage,
+    SQLiteStorage)
+
+
+class Person(Document):
+
+    document_schema = {
+        "type": "object",
+        "properties": {
+            "name": {"type": "string"},
+            "age": {"type": "integer", "optional": True}}}
+
+
+class ValidateCorpusTests(TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def _store(self, name, text):
+        storage = FileStorage(os.path.join(self.dirname, name))
+        storage.write(text)
+        return storage
+
+    def test_values(self):
+        values = [{"name": "a"}, {"name": 1}, {"name": "c", "age": 3}] * 10
+        errors = validate_corpus(values, Person.document_schema, workers=2)
+        self.assertEqual(len(errors), 30)
+        for index, error in enumerate(errors):
+            if index % 3 == 1:
+                self.assertIsInstance(error, ValidationError)
+                self.assertEqual(error.object_expr, "object.name")
+                self.assertEqual(error.pointer, "/name")
+            else:
+                self.assertIsNone(error)
+
+    def test_storages(self):
+        storages = [
+            self._store("valid.json", u'{"name": "a"}'),
+            self._store("invalid.json", u'{"name": 1}'),
+            self._store("malformed.json", u'{"name"'),
+            FileStorage(os.path.join(self.dirname, "missing.json"))]
+        errors = validate_corpus(
+            iter(storages), Person, workers=2, chunksize=1)
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], ValidationError)
+        self.assertIsInstance(errors[2], ValueError)
+        self.assertIsInstance(errors[3], EnvironmentError)
+
+    def test_strings_are_values(self):
+        schema = {"type": "string"}
+        pathname = self._store("object.json", u'{}').pathname
+        errors = validate_corpus([pathname], schema, workers=0)
+        self.assertEqual(errors, [None])
+
+    def test_binary_serializer(self):
+        storages = [FileStorage(os.path.join(self.dirname, name))
+                    for name in ("valid.ix", "invalid.ix")]
+        storages[0].write(IndexedBinary.dumps({"name": "a"}))
+        storages[1].write(IndexedBinary.dumps({"name": 1}))
+        errors = validate_corpus(
+            storages, Person, workers=2, serializer=IndexedBinary)
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], ValidationError)
+
+    def test_document_class_schema(self):
+        class Team(Document):
+            document_schema = {
+                "type": "object",
+                "properties": {"leader": Person}}
+        errors = validate_corpus(
+            [{"leader": {"name": "a"}}, {"leader": {}}], Team, workers=2)
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], ValidationError)
+
+    def test_in_process(self):
+        errors = validate_corpus(
+            [{"name": "a"}, {"name": 1}], Person, workers=0)
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], ValidationError)
+
+
+class ValidateChunkedTests(TestCase):
+
+    schema = {
+        "type": "object",
+        "properties": {
+            "records": {
+                "type": "array",
+                "uniqueItems": True,
+                "maxItems": 100,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer"},
+                        "tags": {
+                            "type": "array",
+                            "items": {"type": "string"}}}}},
+            "index": {
+                "type": "object",
+                "additionalProperties": {"type": "integer"}}}}
+
+    def _make_value(self, size=50):
+        return {
+            "records": [{"id": i, "tags": ["a"]} for i in range(size)],
+            "index": dict(("key {0}".format(i), i) for i in range(size))}
+
+    def _validate(self, value, workers=2):
+        return validate_chunked(
+            value, self.schema, workers=workers, min_size=10, chunksize=7)
+
+    def test_valid(self):
+        self.assertEqual(self._validate(self._make_value()), [])
+
+    def test_errors_in_chunks(self):
+        value = self._make_value()
+        value["records"][3]["id"] = "3"
+        value["records"][40]["tags"][0] = 1
+        value["index"]["a/b"] = None
+        errors = self._validate(value)
+        self.assertEqual(
+            sorted(error.pointer for error in errors),
+            ["/index/a~1b", "/records/3/id", "/records/40/tags/0"])
+        for error in errors:
+            self.assertIsInstance(error, ValidationError)
+
+    def test_unique_items(self):
+        value = self._make_value()
+        value["records"][30] = {"tags": ["a"], "id": 10}
+        errors = self._validate(value)
+        self.assertEqual([error.pointer for error in errors], ["/records/30"])
+        self.assertEqual(errors[0].schema_expr,
+                         "schema.properties.records.uniqueItems")
+
+    def test_unique_items_compares_json_values(self):
+        schema = {"type": "array", "uniqueItems": True,
+                  "items": {"type": ["boolean", "number"]}}
+        for min_size in (2, 10000):
+            self.assertEqual(validate_chunked(
+                [True, 1, False, 0], schema, workers=0, min_size=min_size),
+                [])
+            errors = validate_chunked(
+                [True, 1, 1.0], schema, workers=0, min_size=min_size)
+            self.assertEqual([error.pointer for error in errors], ["/2"])
+
+    def test_size_errors_do_not_stop_validation(self):
+        value = self._make_value(size=101)
+        value["index"]["bad"] = "bad"
+        errors = self._validate(value)
+        self.assertEqual([error.pointer for error in errors],
+                         ["/records", "/index/bad"])
+
+    def test_small_values_are_not_split(self):
+        value = self._make_value(size=5)
+        value["records"][3]["id"] = "3"
+        value["records"][4]["id"] = "4"
+        # The regular validator stops at the first error
+        errors = self._validate(value, workers=0)
+        self.assertEqual([error.pointer for error in errors],
+                         ["/records/3/id"])
+
+
+class PersistenceGroupTests(TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def _make(self, name, text=None):
+        pathname = os.path.join(self.dirname, name)
+        if text is not None:
+            FileStorage(pathname).write(text)
+        return DocumentPersistence(
+            Document({}), FileStorage(pathname), JSON)
+
+    def test_load(self):
+        persistences = [
+            self._make("{0}.json".format(i), u'{{"n": {0}}}'.format(i))
+            for i in range(20)]
+        group = PersistenceGroup(persistences, threads=4)
+        self.assertEqual(group.load(), [])
+        for i, persistence in enumerate(persistences):
+            self.assertEqual(persistence.document.value, {"n": i})
+            self.assertFalse(persistence.is_dirty)
+
+    def test_load_errors(self):
+        good = self._make("good.json", u'{"a": 1}')
+        malformed = self._make("malformed.json", u'{"a"')
+        missing = self._make("missing.json")
+        errors = PersistenceGroup([good, malformed, missing]).load()
+        self.assertEqual([persistence for persistence, exc in errors],
+                         [malformed, missing])
+        self.assertIsInstance(errors[0][1], ValueError)
+        self.assertIsInstance(errors[1][1], EnvironmentError)
+        self.assertEqual(good.document.value, {"a": 1})
+
+    def test_load_large_in_processes(self):
+        persistences = [
+            self._make("large.json", JSON.dumps({"items": list(range(100))})),
+            self._make("small.json", u'{"a": 1}')]
+        group = PersistenceGroup(persistences, processes=2, large_size=100)
+        self.assertEqual(group.load(), [])
+        self.assertEqual(persistences[0].document["items"][99].value, 99)
+        self.assertEqual(persistences[1].document.value, {"a": 1})
+
+    def test_load_other_persistence_classes(self):
+        pathname = os.path.join(self.dirname, "journal.json")
+        writer = JournalPersistence(
+            Document({"a": 1}), JournalStorage(pathname), JSON)
+        writer.save()
+        reader = JournalPersistence(
+            Document({}), JournalStorage(pathname), JSON)
+        self.assertEqual(PersistenceGroup([reader], processes=2).load(), [])
+        self.assertEqual(reader.document.value, {"a": 1})
+
+    def test_load_sqlite_and_directory(self):
+        connection = sqlite3.connect(
+            os.path.join(self.dirname, "db.sqlite"), check_same_thread=False)
+        self.addCleanup(connection.close)
+        SQLitePersistence(Document({"a": 1}), SQLiteStorage(connection)).save()
+        pathname = os.path.join(self.dirname, "directory")
+        DirectoryPersistence(
+            Document({"b": 2}), DirectoryStorage(pathname), JSON).save()
+        persistences = [
+            SQLitePersistence(Document({}), SQLiteStorage(connection)),
+            DirectoryPersistence(
+                Document({}), DirectoryStorage(pathname), JSON,
+                check_content=True)]
+        group = PersistenceGroup(persistences)
+        self.assertEqual(group.load(), [])
+        self.assertEqual(persistences[0].document.value, {"a": 1})
+        self.assertEqual(persistences[1].document.value, {"b": 2})
+        self.assertEqual(group.load(force=True), [])
+
+    def test_save(self):
+        persistences = [self._make("{0}.json".format(i)) for i in range(5)]
+        for i, persistence in enumerate(persistences):
+            persistence.document["n"] = i
+        group = PersistenceGroup()
+        for persistence in persistences:
+            group.add(persistence)
+        self.assertEqual(group.save(), [])
+        for i, persistence in enumerate(persistences):
+            self.assertEqual(
+                JSON.loads(persistence.storage.read()), {"n": i})
@@ -0,0 +1,65 @@
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests for JSON Pointer helpers."""
+
+from unittest2 import TestCase
+
+from json_document import pointer
+
+
+class PointerTests(TestCase):
+
+    def test_split_and_join_round_trip(self):
+        for text, tokens in [
+                ("", []),
+                ("/foo", ["foo"]),
+                ("/foo/0", ["foo", "0"]),
+                ("/a~1b/m~0n", ["a/b", "m~n"]),
+                ("/", [""])]:
+            self.assertEqual(pointer.split(text), tokens)
+            self.assertEqual(pointer.join(tokens), text)
+
+    def test_join_converts_indices(self):
+        self.assertEqual(pointer.join(["foo", 1]), "/foo/1")
+
+    def test_split_rejects_relative_pointers(self):
+        self.assertRaises(ValueError, pointer.split, "foo")
+
+    def test_resolve(self):
+        obj = {"foo": [{"bar": 1}]}
+        self.assertEqual(pointer.resolve(obj, ["foo", "0", "bar"]), 1)
+        self.assertIs(pointer.resolve(obj, []), obj)
+        self.assertRaises(LookupError, pointer.resolve, obj, ["foo", "1"])
+        self.assertRaises(LookupError, pointer.resolve, obj, ["foo", "x"])
+        self.assertRaises(LookupError, pointer.resolve, obj, ["bar"])
+
+    def test_assign_creates_intermediate_objects(self):
+        obj = {}
+        pointer.assign(obj, ["foo", "bar"], 1)
+        self.assertEqual(obj, {"foo": {"bar": 1}})
+
+    def test_assign_to_list(self):
+        obj = {"foo": [1, 2]}
+        pointer.assign(obj, ["foo", "0"], 0)
+        pointer.assign(obj, ["foo", "-"], 3)
+        pointer.assign(obj, ["foo", "3"], 4)
+        self.assertEqual(obj, {"foo": [0, 2, 3, 4]})
+
+    def test_remove(self):
+        obj = {"foo": [1, 2], "bar": 1}
+        pointer.remove(obj, ["foo", "0"])
+        pointer.remove(obj, ["bar"])
+        self.assertEqual(obj, {"foo": [2]})
+        self.assertRaises(LookupError, pointer.remove, obj, ["bar"])
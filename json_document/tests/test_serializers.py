@@ -0,0 +1,408 @@
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests for serializer classes."""
+
+import os
+import shutil
+import sys
+import tempfile
+
+if sys.version_info[0] > 2:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from io import BytesIO
+
+from decimal import Decimal
+
+from simplejson import OrderedDict
+from unittest2 import TestCase, skipIf
+
+from json_document import serializers
+from json_document.document import Document
+from json_document.serializers import (
+    IndexedArray,
+    IndexedBinary,
+    IndexedBinaryDecodeError,
+    IndexedObject,
+    JSON,
+    JSONDecodeError,
+    JSONLines,
+    MemoizingJSON,
+    MessagePack,
+    MessagePackDecodeError)
+
+
+class JSONPartialLoadTests(TestCase):
+    """Tests for JSON.loads_partial()."""
+
+    text = ('{"format": "1.0", '
+            '"skipped": {"text": "tricky \\" } ] {", "list": [[{}], "]"]}, '
+            '"runs": {"first": {"id": 1, "value": 1.5}, "second": {"id": 2}}, '
+            '"items": [{"name": "a"}, {"name": "b"}]}')
+
+    def test_loads_selected_values(self):
+        obj = JSON.loads_partial(self.text, ["/format", "/runs/first/value"])
+        self.assertEqual(obj, {
+            "format": "1.0",
+            "runs": {"first": {"value": Decimal("1.5")}}})
+
+    def test_retains_order(self):
+        obj = JSON.loads_partial(self.text, ["/runs", "/format"])
+        self.assertIsInstance(obj, OrderedDict)
+        self.assertEqual(list(obj.keys()), ["format", "runs"])
+        self.assertEqual(list(obj["runs"].keys()), ["first", "second"])
+
+    def test_loads_buffer(self):
+        data = memoryview(self.text.encode('UTF-8'))
+        obj = JSON.loads_partial(data, ["/format"])
+        self.assertEqual(obj, {"format": "1.0"})
+        self.assertEqual(JSON.loads(data), JSON.loads(self.text))
+
+    def test_loads_truncated_character(self):
+        # Data cut in the middle of the last character
+        broken = u'"ab" \u017c'.encode('UTF-8')[:-1]
+        self.assertRaises(ValueError, JSON.loads, broken)
+        self.assertRaises(ValueError, JSON.loads, memoryview(broken))
+
+    def test_does_not_retain_order(self):
+        obj = JSON.loads_partial(self.text, ["/runs"], retain_order=False)
+        self.assertNotIsInstance(obj, OrderedDict)
+
+    def test_missing_values_are_ignored(self):
+        obj = JSON.loads_partial(self.text, ["/format", "/runs/third"])
+        self.assertEqual(obj, {"format": "1.0", "runs": {}})
+
+    def test_arrays_are_loaded_as_a_whole(self):
+        obj = JSON.loads_partial(self.text, ["/items/1/name"])
+        self.assertEqual(obj, {"items": [{"name": "a"}, {"name": "b"}]})
+
+    def test_empty_pointer_loads_everything(self):
+        self.assertEqual(
+            JSON.loads_partial(self.text, ["", "/format"]),
+            JSON.loads(self.text))
+
+    def test_broken_text(self):
+        self.assertRaises(JSONDecodeError, JSON.loads_partial, "", ["/a"])
+        self.assertRaises(
+            JSONDecodeError, JSON.loads_partial, '{"a" 1}', ["/a"])
+        self.assertRaises(
+            JSONDecodeError, JSON.loads_partial, '{"a": [1}', ["/b"])
+
+
+class MemoizingJSONTests(TestCase):
+    """Tests for the MemoizingJSON serializer."""
+
+    def setUp(self):
+        super(MemoizingJSONTests, self).setUp()
+        # Make sure even tiny containers are cached separately
+        encoder_cls = serializers._IncrementalEncoder
+        self.addCleanup(setattr, encoder_cls, "small_size",
+                        encoder_cls.small_size)
+        encoder_cls.small_size = 0
+        self.doc = Document(OrderedDict([
+            ("a", {"x": [1, 2], "y": {"z": None}}),
+            ("b", [{"c": 1}, {"d": [2]}, {"e": 3}]),
+            ("f", "text")]))
+
+    def assertSameAsJSON(self):
+        for human_readable in (True, False):
+            for sort_keys in (True, False):
+                self.assertEqual(
+                    MemoizingJSON.dumps(self.doc, human_readable, sort_keys),
+                    JSON.dumps(self.doc.value, human_readable, sort_keys))
+
+    def test_output_follows_modifications(self):
+        self.assertSameAsJSON()
+        self.doc["a"]["x"][0] = 3
+        self.assertSameAsJSON()
+        self.doc["a"]["w"] = [4]
+        self.assertSameAsJSON()
+        del self.doc["b"][0]
+        self.assertSameAsJSON()
+        self.doc["b"][1]["e"] = {"g": 5}
+        self.assertSameAsJSON()
+        self.doc["a"].value = {"v": []}
+        self.assertSameAsJSON()
+        self.doc.value = {"new": ["value"]}
+        self.assertSameAsJSON()
+
+    def test_unmodified_parts_are_reused(self):
+        MemoizingJSON.dumps(self.doc)
+        cache = serializers._EncodingCache.get(self.doc, True, False)
+        b_node = cache._root.children["b"]
+        d_node = b_node.children[1]
+        self.doc["a"]["y"]["z"] = 1
+        self.assertIsNone(cache._root.parts)
+        self.assertIsNone(cache._root.children["a"].parts)
+        self.assertIsNotNone(b_node.parts)
+        self.doc["b"][0]["c"] = 2
+        self.assertIsNone(b_node.parts)
+        self.assertIsNotNone(d_node.parts)
+        self.assertSameAsJSON()
+
+    def test_dump_streams_cached_text(self):
+        stream = StringIO()
+        MemoizingJSON.dump(stream, self.doc)
+        self.assertEqual(stream.getvalue(), JSON.dumps(self.doc.value))
+
+    def test_forget(self):
+        MemoizingJSON.dumps(self.doc)
+        self.assertEqual(len(self.doc._observers), 1)
+        MemoizingJSON.forget(self.doc)
+        self.assertEqual(self.doc._observers, [])
+
+    def test_plain_values(self):
+        self.assertEqual(MemoizingJSON.dumps({"a": [1]}),
+                         JSON.dumps({"a": [1]}))
+
+
+class JSONLinesTests(TestCase):
+    """Tests for the JSONLines serializer."""
+
+    text = '{"id": 1, "value": 1.5}\n\n{"id": 2}\n[]\n'
+
+    def test_loads(self):
+        self.assertEqual(JSONLines.loads(self.text), [
+            {"id": 1, "value": Decimal("1.5")}, {"id": 2}, []])
+
+    def test_iterload_is_lazy(self):
+        stream = iter(['{"id": 1}\n', 'broken\n'])
+        records = JSONLines.iterload(stream)
+        self.assertEqual(next(records), {"id": 1})
+        self.assertRaises(JSONDecodeError, next, records)
+
+    def test_iterload_batches(self):
+        batches = list(JSONLines.iterload_batches(
+            self.text.splitlines(True), batch_size=2))
+        self.assertEqual(batches, [
+            [{"id": 1, "value": Decimal("1.5")}, {"id": 2}], [[]]])
+        self.assertIsInstance(batches[0][0], OrderedDict)
+
+    def test_iterload_batches_reports_broken_line(self):
+        batches = JSONLines.iterload_batches(['{"id": 1}', '{"id":'])
+        with self.assertRaises(JSONDecodeError) as cm:
+            list(batches)
+        self.assertEqual(cm.exception.doc, '{"id":')
+
+    def test_iterload_batches_rejects_line_with_many_values(self):
+        batches = JSONLines.iterload_batches(['{"id": 1}', '1,2'])
+        with self.assertRaises(JSONDecodeError) as cm:
+            list(batches)
+        self.assertEqual(cm.exception.doc, '1,2')
+
+    def test_dumps(self):
+        text = JSONLines.dumps([{"text": "two\nlines"}, [1, 2]])
+        self.assertEqual(text, '{"text":"two\\nlines"}\n[1,2]\n')
+        self.assertEqual(
+            JSONLines.loads(text), [{"text": "two\nlines"}, [1, 2]])
+
+
+class MessagePackTests(TestCase):
+    """Tests for the pure-Python implementation of MessagePack."""
+
+    def setUp(self):
+        super(MessagePackTests, self).setUp()
+        self.addCleanup(setattr, serializers, "msgpack", serializers.msgpack)
+        serializers.msgpack = None
+        self.doc = OrderedDict([
+            ("format", "Dashboard Bundle Format 1.0"),
+            ("numbers", [0, 1, -1, 127, -32, -33, 255, 65536, 2 ** 40,
+                         -2 ** 40, 2 ** 64 - 1, 2 ** 70, -2 ** 70]),
+            ("decimals", [Decimal("1.10"), Decimal("-0.5e-10")]),
+            ("other", [None, True, False, 1.5, u"\u017c" * 40, "x" * 300]),
+            ("nested", OrderedDict(
+                ("key%d" % i, {"a": [i]}) for i in range(20))),
+        ])
+
+    def test_round_trip(self):
+        obj = MessagePack.loads(MessagePack.dumps(self.doc))
+        self.assertEqual(obj, self.doc)
+        self.assertEqual(list(obj.keys()), list(self.doc.keys()))
+        self.assertEqual(str(obj["decimals"][0]), "1.10")
+
+    def test_does_not_retain_order(self):
+        obj = MessagePack.loads(MessagePack.dumps(self.doc), False)
+        self.assertNotIsInstance(obj, OrderedDict)
+
+    def test_sort_keys(self):
+        obj = MessagePack.loads(MessagePack.dumps(
+            {"b": {"d": 1, "c": 2}, "a": 3}, sort_keys=True))
+        self.assertEqual(list(obj.keys()), ["a", "b"])
+        self.assertEqual(list(obj["b"].keys()), ["c", "d"])
+
+    def test_known_encoding(self):
+        self.assertEqual(
+            MessagePack.dumps({"a": [1, None, Decimal("1.5")]}),
+            b"\x81\xa1a\x93\x01\xc0\xc7\x03\x011.5")
+
+    def test_is_more_compact_than_json(self):
+        self.assertLess(len(MessagePack.dumps(self.doc)),
+                        len(JSON.dumps(self.doc, human_readable=False)))
+
+    def test_broken_data(self):
+        data = MessagePack.dumps(self.doc)
+        for broken in (b"", data[:-1], data + b"\x00", b"\xc1"):
+            self.assertRaises(
+                MessagePackDecodeError, MessagePack.loads, broken)
+
+    def test_truncated_character(self):
+        data = MessagePack.dumps(u"ab\u017c")
+        # The length says two bytes, the last character is cut in half
+        broken = bytearray(data[:-1])
+        broken[0] -= 1
+        self.assertRaises(
+            MessagePackDecodeError, MessagePack.loads, bytes(broken))
+
+    @skipIf(serializers.msgpack is None, "msgpack is not installed")
+    def test_same_output_as_msgpack(self):
+        data = MessagePack.dumps(self.doc)
+        serializers.msgpack = self._get_msgpack()
+        self.assertEqual(MessagePack.dumps(self.doc), data)
+        self.assertEqual(MessagePack.loads(data), self.doc)
+
+    def _get_msgpack(self):
+        import msgpack
+        return msgpack
+
+
+@skipIf(serializers.msgpack is None, "msgpack is not installed")
+class MsgpackMessagePackTests(MessagePackTests):
+    """Tests for MessagePack backed by the msgpack module."""
+
+    def setUp(self):
+        super(MsgpackMessagePackTests, self).setUp()
+        serializers.msgpack = self._get_msgpack()
+
+
+class IndexedBinaryTests(TestCase):
+
+    def setUp(self):
+        super(IndexedBinaryTests, self).setUp()
+        self.doc = OrderedDict([
+            ("format", "Dashboard Bundle Format 1.0"),
+            ("numbers", [0, -1, 2 ** 63 - 1, -2 ** 63, 2 ** 70, -2 ** 70]),
+            ("decimals", [Decimal("1.10"), Decimal("-0.5e-10")]),
+            ("other", [None, True, False, 1.5, u"\u017c" * 40, "", [], {}]),
+            ("nested", OrderedDict(
+                ("key%d" % i, {"a": [i]}) for i in range(20, 0, -1))),
+        ])
+        self.data = IndexedBinary.dumps(self.doc)
+
+    def test_round_trip(self):
+        obj = IndexedBinary.loads(self.data)
+        self.assertEqual(obj, self.doc)
+        self.assertEqual(list(obj.keys()), list(self.doc.keys()))
+        self.assertEqual(list(obj["nested"].keys()),
+                         list(self.doc["nested"].keys()))
+        self.assertEqual(str(obj["decimals"][0]), "1.10")
+
+    def test_does_not_retain_order(self):
+        obj = IndexedBinary.loads(self.data, False)
+        self.assertNotIsInstance(obj, OrderedDict)
+        self.assertEqual(obj, self.doc)
+
+    def test_sort_keys(self):
+        obj = IndexedBinary.view(IndexedBinary.dumps(
+            {"b": {"d": 1, "c": 2}, "a": 3}, sort_keys=True))
+        self.assertEqual(list(obj), ["a", "b"])
+        self.assertEqual(list(obj["b"]), ["c", "d"])
+
+    def test_keys_are_stored_once(self):
+        doc = [{"some-long-key-name": i} for i in range(10)]
+        data = IndexedBinary.dumps(doc)
+        self.assertEqual(data.count(b"some-long-key-name"), 1)
+
+    def test_view_is_lazy(self):
+        view = IndexedBinary.view(self.data)
+        self.assertIsInstance(view, IndexedObject)
+        self.assertIsInstance(view["numbers"], IndexedArray)
+        self.assertIsInstance(view["nested"]["key7"], IndexedObject)
+        self.assertEqual(view["nested"]["key7"]["a"][0], 7)
+        self.assertEqual(len(view["nested"]), 20)
+
+    def test_view_lookup(self):
+        view = IndexedBinary.view(self.data)
+        for key in self.doc["nested"]:
+            self.assertEqual(view["nested"][key], self.doc["nested"][key])
+        self.assertRaises(KeyError, view.__getitem__, "key0")
+        self.assertRaises(KeyError, view.__getitem__, "zzz")
+        self.assertRaises(KeyError, view.__getitem__, 1)
+        self.assertNotIn("key0", view["nested"])
+        self.assertEqual(view.get("missing", 5), 5)
+
+    def test_view_indexing(self):
+        numbers = IndexedBinary.view(self.data)["numbers"]
+        self.assertEqual(numbers[-1], -2 ** 70)
+        self.assertEqual(numbers[1:3], [-1, 2 ** 63 - 1])
+        self.assertEqual(numbers, self.doc["numbers"])
+        self.assertNotEqual(numbers, self.doc["numbers"][:-1])
+        self.assertRaises(IndexError, numbers.__getitem__, 6)
+        self.assertRaises(IndexError, numbers.__getitem__, -7)
+
+    def test_view_of_simple_value(self):
+        self.assertEqual(IndexedBinary.view(IndexedBinary.dumps(u"x")), u"x")
+
+    def test_json_conversion(self):
+        text = JSON.dumps(self.doc)
+        data = IndexedBinary.from_json(text)
+        self.assertEqual(IndexedBinary.loads(data), JSON.loads(text))
+        self.assertEqual(IndexedBinary.to_json(data), text)
+
+    def test_dump_and_load_stream(self):
+        stream = BytesIO()
+        IndexedBinary.dump(stream, self.doc)
+        stream.seek(0)
+        self.assertEqual(IndexedBinary.load(stream), self.doc)
+
+    def test_broken_data(self):
+        for broken in (b"", b"JDIX", self.data[:-1], b"XXXX" + self.data[4:]):
+            self.assertRaises(
+                IndexedBinaryDecodeError, IndexedBinary.loads, broken)
+
+    def test_truncated_character(self):
+        data = IndexedBinary.dumps([u"ab\u017c"])
+        # Same length, but the string ends in the middle of a character
+        broken = data.replace(b"ab\xc5\xbc", b"aba\xc5")
+        self.assertNotEqual(broken, data)
+        self.assertRaises(
+            IndexedBinaryDecodeError,
+            lambda: IndexedBinary.loads(broken)[0])
+
+    def test_unsupported_values(self):
+        self.assertRaises(TypeError, IndexedBinary.dumps, {1: 2})
+        self.assertRaises(TypeError, IndexedBinary.dumps, [object()])
+
+    def test_binary_data_is_not_an_array(self):
+        values = [bytearray(b"ab"), memoryview(b"ab")]
+        if bytes is not str:
+            values.append(b"ab")
+        for value in values:
+            self.assertRaises(TypeError, IndexedBinary.dumps, {"a": value})
+
+    def test_mapped_document(self):
+        dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirname)
+        pathname = os.path.join(dirname, "doc.jdix")
+        with open(pathname, "wb") as stream:
+            stream.write(self.data)
+        doc = IndexedBinary.open_document(pathname)
+        self.assertTrue(doc.is_frozen)
+        self.assertIsInstance(doc.value, IndexedObject)
+        self.assertEqual(doc["nested"]["key3"]["a"][0].value, 3)
+        self.assertEqual([item.value for item in doc["numbers"]],
+                         self.doc["numbers"])
+        self.assertEqual(IndexedBinary.dumps(doc.value), self.data)
@@ -0,0 +1,191 @@
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests for the document server."""
+
+import os
+import shutil
+import socket
+import tempfile
+
+from unittest2 import TestCase
+
+from json_document.document import Document, DocumentPersistence
+from json_document.errors import RemoteError
+from json_document.serializers import JSON
+from json_document.server import DocumentClient, DocumentServer
+from json_document.storage import FileStorage
+
+
+class DocumentServerTests(TestCase):
+
+    def setUp(self):
+        super(DocumentServerTests, self).setUp()
+        self.dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dirname)
+        self.pathname = os.path.join(self.dirname, "doc.json")
+        FileStorage(self.pathname).write(JSON.dumps(
+            {"db": {"host": "localhost", "port": 5432}, "list": [1, 2, 3]}))
+        self.persistence = DocumentPersistence(
+            Document({}), FileStorage(self.pathname), JSON)
+        self.persistence.load()
+        self.address = os.path.join(self.dirname, "socket")
+        self.server = DocumentServer(self.persistence, self.address)
+        self.server.start()
+        self.addCleanup(self.server.close)
+        self.changes = []
+        self.client = self._connect(on_change=lambda revision, paths:
+                                    self.changes.append(paths))
+
+    def _connect(self, **kwargs):
+        client = DocumentClient(self.address, timeout=5, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def _stored(self):
+        return JSON.loads(FileStorage(self.pathname).read())
+
+    def test_get(self):
+        self.assertEqual(self.client.get("/db/host"), "localhost")
+        self.assertEqual(self.client.get("/list/1"), 2)
+        self.assertEqual(self.client.get()["db"]["port"], 5432)
+
+    def test_get_missing(self):
+        for path in ("/missing", "/list/3", "/list/-1", "/db/host/x"):
+            self.assertRaises(RemoteError, self.client.get, path)
+        self.assertRaises(ValueError, self.client.get, "missing")
+        # The connection is still usable
+        self.assertEqual(self.client.get("/list/0"), 1)
+
+    def test_set(self):
+        revision = self.client.set("/db/host", "example.org")
+        self.assertEqual(revision, self.server.document.revision)
+        self.assertEqual(self.client.get("/db/host"), "example.org")
+        self.client.set("/new/nested", True)
+        self.client.set("/list/-", 4)
+        self.client.set("/list/0", 0)
+        self.assertEqual(self._stored()["new"], {"nested": True})
+        self.assertEqual(self._stored()["list"], [0, 2, 3, 4])
+
+    def test_remove_and_add_again(self):
+        self.client.remove("/db/host")
+        self.assertNotIn("host", self._stored()["db"])
+        self.client.set("/db/host", "example.org")
+        self.assertEqual(self._stored()["db"]["host"], "example.org")
+        self.client.remove("/list/0")
+        self.assertEqual(self._stored()["list"], [2, 3])
+
+    def test_patch(self):
+        self.client.patch([
+            {"op": "add", "path": "/list/1", "value": 10},
+            {"op": "replace", "path": "/db/port", "value": 1},
+            {"op": "copy", "from": "/db", "path": "/backup"},
+            {"op": "move", "from": "/backup/host", "path": "/host"},
+            {"op": "test", "path": "/host", "value": "localhost"},
+            {"op": "remove", "path": "/list/0"}])
+        self.assertEqual(self._stored(), {
+            "db": {"host": "localhost", "port": 1}, "list": [10, 2, 3],
+            "backup": {"port": 1}, "host": "localhost"})
+
+    def test_failed_patch_is_undone(self):
+        value = self.client.get()
+        self.assertRaises(RemoteError, self.client.patch, [
+            {"op": "add", "path": "/list/0", "value": 0},
+            {"op": "remove", "path": "/db/host"},
+            {"op": "replace", "path": "/db/port", "value": 1},
+            {"op": "test", "path": "/db/port", "value": 2}])
+        self.assertEqual(self.client.get(), value)
+        self.assertEqual(self._stored(), value)
+
+    def test_undone_remove_keeps_order_and_fragments(self):
+        port = self.server.document["db"]["port"]
+        self.assertRaises(RemoteError, self.client.patch, [
+            {"op": "remove", "path": "/db/host"},
+            {"op": "test", "path": "/db/port", "value": 1}])
+        self.assertEqual(list(self.server.document["db"].value),
+                         ["host", "port"])
+        self.assertFalse(port.is_orphaned)
+        self.assertIs(self.server.document["db"]["port"], port)
+        self.assertEqual(self.client.get("/db/host"), "localhost")
+
+    def test_batch(self):
+        results = self.client.batch([
+            {"op": "set", "path": "/db/port", "value": 1},
+            {"op": "get", "path": "/missing"},
+            {"op": "get", "path": "/db/port"}])
+        self.assertEqual(results[0], self.server.document.revision)
+        self.assertIsInstance(results[1], RemoteError)
+        self.assertEqual(results[1].error_type, "KeyError")
+        self.assertEqual(results[2], 1)
+
+    def test_unknown_operation(self):
+        self.assertRaises(RemoteError, self.client._call, {"op": "foo"})
+        results = self.client.batch([
+            {"op": "foo"}, {"op": "batch", "requests": []}])
+        self.assertIsInstance(results[0], RemoteError)
+        self.assertIsInstance(results[1], RemoteError)
+
+    def test_notifications(self):
+        other = self._connect()
+        other.set("/db/port", 1)
+        self.assertEqual(self.client.poll(5), 1)
+        self.assertEqual(self.changes, [["/db/port"]])
+        self.assertEqual(self.client.revision, other.revision)
+
+    def test_cached_value_is_invalidated(self):
+        other = self._connect(subscribe=False)
+        self.assertEqual(self.client.get("/db"), other.get("/db"))
+        revision = self.server.document.revision
+        # Unrelated changes keep the cached value
+        other.set("/list/0", 5)
+        self.client.poll(5)
+        self.assertIs(self.client.get("/db"), self.client.get("/db"))
+        other.set("/db/port", 1)
+        self.client.poll(5)
+        self.assertEqual(self.client.get("/db")["port"], 1)
+        self.assertNotEqual(self.server.document.revision, revision)
+
+    def test_revalidation_without_subscription(self):
+        client = self._connect(subscribe=False)
+        value = client.get("/db")
+        self.assertIs(client.get("/db"), value)
+        self._connect().set("/list/0", 1)
+        self.assertIs(client.get("/db"), value)
+        self._connect().set("/db/port", 1)
+        self.assertEqual(client.get("/db")["port"], 1)
+
+    def test_external_changes_are_announced(self):
+        self.server.stop()
+        self.server.document["db"]["port"] = 1
+        self.server.run_once(0)
+        self.assertEqual(self.client.poll(5), 1)
+        self.assertEqual(self.changes, [["/db/port"]])
+
+    def test_malformed_request(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.settimeout(5)
+        sock.connect(self.address)
+        sock.sendall(b"not json\n")
+        self.assertIn(b'"error"', sock.recv(4096))
+
+    def test_stale_socket_is_replaced(self):
+        self.server.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.address)
+        listener.close()
+        server = DocumentServer(self.persistence, self.address, save=False)
+        self.addCleanup(server.close)
+        self.assertRaises(ValueError, DocumentServer, self.persistence,
+                          self.address)
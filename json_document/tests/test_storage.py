@@ -0,0 +1,915 @@
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests for storage classes and document persistence."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from unittest2 import TestCase
+
+from json_document.document import (
+    CollectionPersistence,
+    DirectoryPersistence,
+    Document,
+    DocumentPersistence,
+    JournalPersistence,
+    SQLitePersistence)
+from json_document.errors import PartialDocumentError
+from json_document.serializers import JSON, JSONLines, MessagePack
+from json_document.storage import (
+    DirectoryStorage,
+    FileStorage,
+    IStorage,
+    JournalStorage,
+    SQLiteStorage)
+
+
+class MemoryStorage(IStorage):
+    """Storage that keeps everything in memory and counts writes."""
+
+    def __init__(self, data=''):
+        self.data = data
+        self.writes = 0
+
+    def write(self, data):
+        self.data = data
+        self.writes += 1
+
+    def read(self):
+        return self.data
+
+
+class StorageTestCase(TestCase):
+
+    def setUp(self):
+        super(StorageTestCase, self).setUp()
+        self.dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dirname)
+        self.pathname = os.path.join(self.dirname, "document.json")
+
+    def read_file(self):
+        with open(self.pathname, 'rb') as stream:
+            return stream.read().decode('UTF-8')
+
+
+class OpenWriteTests(StorageTestCase):
+    """Tests for IStorage.open_write() and FileStorage.open_write()."""
+
+    def test_default_open_write_passes_data_to_write(self):
+        storage = MemoryStorage()
+        with storage.open_write() as stream:
+            stream.write("foo")
+            stream.write("bar")
+        self.assertEqual(storage.data, "foobar")
+        self.assertEqual(storage.writes, 1)
+
+    def test_default_open_write_does_not_write_on_error(self):
+        storage = MemoryStorage("old")
+        with self.assertRaises(ValueError):
+            with storage.open_write() as stream:
+                stream.write("new")
+                raise ValueError()
+        self.assertEqual(storage.data, "old")
+
+    def test_file_open_write_encodes_utf8(self):
+        storage = FileStorage(self.pathname)
+        with storage.open_write() as stream:
+            stream.write(u"za\u017c\u00f3\u0142\u0107")
+        self.assertEqual(self.read_file(), u"za\u017c\u00f3\u0142\u0107")
+
+    def test_file_open_write_writes_in_blocks(self):
+        storage = FileStorage(self.pathname)
+        with storage.open_write() as stream:
+            for i in range(100000):
+                stream.write("x")
+            # Not everything is still held in memory
+            self.assertGreater(sum(
+                os.path.getsize(os.path.join(self.dirname, name))
+                for name in os.listdir(self.dirname)), 0)
+        self.assertEqual(self.read_file(), "x" * 100000)
+
+    def test_file_open_write_keeps_old_content_on_error(self):
+        with open(self.pathname, 'wb') as stream:
+            stream.write(b"old")
+        storage = FileStorage(self.pathname)
+        with self.assertRaises(ValueError):
+            with storage.open_write() as stream:
+                stream.write("x" * 100000)
+                raise ValueError()
+        self.assertEqual(self.read_file(), "old")
+        self.assertEqual(os.listdir(self.dirname), ["document.json"])
+
+
+class AtomicFileStorageTests(StorageTestCase):
+    """Tests for FileStorage in atomic mode."""
+
+    def setUp(self):
+        super(AtomicFileStorageTests, self).setUp()
+        with open(self.pathname, 'wb') as stream:
+            stream.write(b"old")
+        os.chmod(self.pathname, 0o640)
+
+    def test_write_replaces_file(self):
+        inode = os.stat(self.pathname).st_ino
+        FileStorage(self.pathname, atomic=True).write("new")
+        self.assertEqual(self.read_file(), "new")
+        self.assertNotEqual(os.stat(self.pathname).st_ino, inode)
+        self.assertEqual(os.listdir(self.dirname), ["document.json"])
+
+    def test_write_preserves_permissions(self):
+        FileStorage(self.pathname, atomic=True).write("new")
+        self.assertEqual(os.stat(self.pathname).st_mode & 0o777, 0o640)
+
+    def test_write_with_fsync(self):
+        FileStorage(self.pathname, atomic=True, fsync=True).write("new")
+        self.assertEqual(self.read_file(), "new")
+
+    def test_write_creates_missing_file(self):
+        os.unlink(self.pathname)
+        FileStorage(self.pathname, atomic=True).write("new")
+        self.assertEqual(self.read_file(), "new")
+
+    def test_failed_open_write_keeps_old_content(self):
+        storage = FileStorage(self.pathname, atomic=True)
+        with self.assertRaises(ValueError):
+            with storage.open_write() as stream:
+                stream.write("x" * 100000)
+                raise ValueError()
+        self.assertEqual(self.read_file(), "old")
+        self.assertEqual(os.listdir(self.dirname), ["document.json"])
+
+    def test_open_write_replaces_file_on_exit(self):
+        storage = FileStorage(self.pathname, atomic=True)
+        with storage.open_write() as stream:
+            stream.write("x" * 100000)
+            self.assertEqual(self.read_file(), "old")
+        self.assertEqual(self.read_file(), "x" * 100000)
+
+
+class AppendTests(StorageTestCase):
+    """Tests for IStorage.append() and FileStorage.append()."""
+
+    def test_default_append_rewrites_storage(self):
+        storage = MemoryStorage("foo\n")
+        storage.append("bar")
+        self.assertEqual(storage.data, "foo\nbar")
+
+    def test_default_append_adds_missing_newline(self):
+        storage = MemoryStorage("foo")
+        storage.append("bar\n")
+        self.assertEqual(storage.data, "foo\nbar\n")
+
+    def test_file_append(self):
+        storage = FileStorage(self.pathname)
+        storage.append("foo\n")
+        storage.append(u"\u017c\n")
+        self.assertEqual(self.read_file(), u"foo\n\u017c\n")
+
+    def test_file_append_adds_missing_newline(self):
+        storage = FileStorage(self.pathname)
+        storage.append("foo")
+        storage.append(u"\u017c")
+        self.assertEqual(self.read_file(), u"foo\n\u017c")
+
+    def test_file_open_read_ignores_missing_file(self):
+        storage = FileStorage(self.pathname, ignore_missing=True)
+        with storage.open_read() as stream:
+            self.assertEqual(stream.read(), "")
+
+
+class ReadBufferTests(StorageTestCase):
+    """Tests for IStorage.read_buffer() and FileStorage.read_buffer()."""
+
+    def test_file_read_decodes_utf8(self):
+        with open(self.pathname, 'wb') as stream:
+            stream.write(u"\u017c\u00f3\u0142w".encode('UTF-8'))
+        self.assertEqual(
+            FileStorage(self.pathname).read(), u"\u017c\u00f3\u0142w")
+
+    def test_file_read_reports_truncated_character(self):
+        with open(self.pathname, 'wb') as stream:
+            stream.write(u'"\u017c"'.encode('UTF-8')[:-2])
+        self.assertRaises(UnicodeDecodeError, FileStorage(self.pathname).read)
+
+    def test_file_read_buffer(self):
+        with open(self.pathname, 'wb') as stream:
+            stream.write(b'{"foo": "bar"}')
+        for storage in (FileStorage(self.pathname),
+                        FileStorage(self.pathname, atomic=True),
+                        FileStorage(self.pathname, use_mmap=True)):
+            with storage.read_buffer() as data:
+                self.assertEqual(bytes(data), b'{"foo": "bar"}')
+
+    def test_file_read_buffer_maps_only_atomic_files(self):
+        with open(self.pathname, 'wb') as stream:
+            stream.write(b'{"foo": "bar"}')
+        with FileStorage(self.pathname).read_buffer() as data:
+            self.assertIsInstance(data, bytes)
+        with FileStorage(self.pathname, atomic=True).read_buffer() as data:
+            self.assertNotIsInstance(data, bytes)
+        storage = FileStorage(self.pathname, atomic=True, use_mmap=False)
+        with storage.read_buffer() as data:
+            self.assertIsInstance(data, bytes)
+
+    def test_file_read_buffer_of_empty_file(self):
+        open(self.pathname, 'wb').close()
+        with FileStorage(self.pathname, use_mmap=True).read_buffer() as data:
+            self.assertEqual(bytes(data), b'')
+
+    def test_file_read_buffer_ignores_missing_file(self):
+        for use_mmap in (False, True):
+            storage = FileStorage(
+                self.pathname, ignore_missing=True, use_mmap=use_mmap)
+            with storage.read_buffer() as data:
+                self.assertEqual(bytes(data), b'')
+            self.assertEqual(storage.read(), u"")
+
+    def test_file_read_buffer_reports_missing_file(self):
+        for use_mmap in (False, True):
+            storage = FileStorage(self.pathname, use_mmap=use_mmap)
+            self.assertRaises(IOError, storage.read_buffer().__enter__)
+
+    def test_default_read_buffer_uses_read_bytes(self):
+        storage = MemoryStorage()
+        storage.read_bytes = lambda: b"foo"
+        with storage.read_buffer() as data:
+            self.assertEqual(data, b"foo")
+
+    def test_persistence_loads_from_buffer(self):
+        with open(self.pathname, 'wb') as stream:
+            stream.write(u'{"foo": "\u017c"}'.encode('UTF-8'))
+        doc = Document({})
+        DocumentPersistence(doc, FileStorage(self.pathname), JSON).load()
+        self.assertEqual(doc.value, {"foo": u"\u017c"})
+
+    def test_persistence_falls_back_to_text_storage(self):
+        doc = Document({})
+        DocumentPersistence(doc, MemoryStorage('{"foo": 1}'), JSON).load()
+        self.assertEqual(doc.value, {"foo": 1})
+
+
+class FingerprintTests(StorageTestCase):
+    """Tests for storage fingerprints and conditional loading."""
+
+    def setUp(self):
+        super(FingerprintTests, self).setUp()
+        self.write_file(u'{"foo": {"bar": 1}}')
+        self.doc = Document({})
+        self.persistence = DocumentPersistence(
+            self.doc, FileStorage(self.pathname), JSON)
+
+    def write_file(self, text, mtime=1000000000):
+        with open(self.pathname, 'wb') as stream:
+            stream.write(text.encode('UTF-8'))
+        # Outside of the racy window
+        os.utime(self.pathname, (mtime, mtime))
+
+    def test_fingerprint(self):
+        storage = FileStorage(self.pathname)
+        self.assertIsNotNone(storage.fingerprint())
+        self.assertEqual(storage.fingerprint(), storage.fingerprint())
+        self.assertNotEqual(
+            storage.fingerprint(), storage.fingerprint(content=True))
+
+    def test_recently_modified_file_has_no_fingerprint(self):
+        os.utime(self.pathname, None)
+        storage = FileStorage(self.pathname)
+        self.assertIsNone(storage.fingerprint())
+        self.assertIsNotNone(storage.fingerprint(content=True))
+
+    def test_missing_file_has_no_fingerprint(self):
+        storage = FileStorage(self.pathname + ".missing")
+        self.assertIsNone(storage.fingerprint())
+
+    def test_load_is_skipped_if_nothing_changed(self):
+        self.assertTrue(self.persistence.load())
+        fragment = self.doc["foo"]
+        self.assertFalse(self.persistence.load())
+        self.assertFalse(fragment.is_orphaned)
+        self.assertTrue(self.persistence.load(force=True))
+
+    def test_load_after_modification(self):
+        self.persistence.load()
+        self.write_file(u'{"foo": {"bar": 22}}', mtime=1000000001)
+        self.assertTrue(self.persistence.load())
+        self.assertEqual(self.doc["foo"]["bar"].value, 22)
+
+    def test_content_check(self):
+        persistence = DocumentPersistence(
+            self.doc, FileStorage(self.pathname), JSON, check_content=True)
+        persistence.load()
+        # Same size and modification time, only the content tells
+        self.write_file(u'{"foo": {"bar": 2}}')
+        self.assertTrue(persistence.load())
+        self.assertEqual(self.doc["foo"]["bar"].value, 2)
+        self.assertFalse(persistence.load())
+
+    def test_modified_document_is_loaded(self):
+        self.persistence.load()
+        self.doc["foo"]["bar"] = 3
+        self.assertTrue(self.persistence.load())
+        self.assertEqual(self.doc["foo"]["bar"].value, 1)
+
+    def test_other_projection_is_loaded(self):
+        self.persistence.load(only=["/foo"])
+        self.assertFalse(self.persistence.load(only=["/foo"]))
+        self.assertTrue(self.persistence.load())
+        self.assertFalse(self.doc.is_partial)
+
+    def test_save_remembers_fingerprint(self):
+        self.persistence.load()
+        self.doc["foo"]["bar"] = 3
+        self.persistence.save()
+        os.utime(self.pathname, (1000000002, 1000000002))
+        self.persistence._remember_fingerprint()
+        self.assertFalse(self.persistence.load())
+
+    def test_preserve_fragments(self):
+        persistence = DocumentPersistence(
+            self.doc, FileStorage(self.pathname), JSON,
+            preserve_fragments=True)
+        persistence.load()
+        foo = self.doc["foo"]
+        self.write_file(u'{"foo": {"bar": 1}, "froz": 2}', mtime=1000000001)
+        self.assertTrue(persistence.load())
+        self.assertEqual(self.doc.value, {"foo": {"bar": 1}, "froz": 2})
+        self.assertIs(self.doc["foo"], foo)
+        self.assertFalse(foo.is_orphaned)
+        self.assertFalse(persistence.is_dirty)
+
+    def test_storage_without_fingerprints(self):
+        persistence = DocumentPersistence(
+            Document({}), MemoryStorage('{}'), JSON)
+        self.assertTrue(persistence.load())
+        self.assertTrue(persistence.load())
+
+    def test_journal(self):
+        doc = Document({"foo": 1})
+        pathname = os.path.join(self.dirname, "journaled.json")
+        persistence = JournalPersistence(doc, JournalStorage(pathname), JSON)
+        persistence.save()
+        for name in (pathname, pathname + ".journal"):
+            os.utime(name, (1000000000, 1000000000))
+        self.assertTrue(persistence.load())
+        self.assertFalse(persistence.load())
+        other = Document({})
+        other_persistence = JournalPersistence(
+            other, JournalStorage(pathname), JSON)
+        other_persistence.load()
+        other["foo"] = 2
+        other_persistence.save()
+        self.assertTrue(persistence.load())
+        self.assertEqual(doc["foo"].value, 2)
+
+
+class StreamingPersistenceTests(StorageTestCase):
+    """Tests for DocumentPersistence with streaming enabled."""
+
+    def test_streaming_save_writes_same_text_as_dumps(self):
+        value = {"foo": [1, 2, {"bar": None}], "froz": "bot"}
+        doc = Document(value)
+        doc["foo"][2]["bar"] = "baz"
+        persistence = DocumentPersistence(
+            doc, FileStorage(self.pathname), JSON, streaming=True)
+        persistence.save()
+        self.assertEqual(self.read_file(), JSON.dumps(doc.value))
+        self.assertFalse(persistence.is_dirty)
+
+    def test_failed_streaming_save_keeps_old_content(self):
+        FileStorage(self.pathname).write(u'{"old": 1}')
+        doc = Document({"a": list(range(10000)), "b": object()})
+        persistence = DocumentPersistence(
+            doc, FileStorage(self.pathname), JSON, streaming=True)
+        self.assertRaises(TypeError, persistence.save)
+        self.assertEqual(self.read_file(), u'{"old": 1}')
+        self.assertTrue(persistence.is_dirty)
+
+    def test_streaming_save_uses_open_write(self):
+        storage = MemoryStorage()
+        doc = Document({"foo": "bar"})
+        doc["foo"] = "baz"
+        persistence = DocumentPersistence(doc, storage, JSON, streaming=True)
+        persistence.save()
+        self.assertEqual(storage.data, JSON.dumps({"foo": "baz"}))
+        self.assertEqual(storage.writes, 1)
+
+
+class BinaryPersistenceTests(StorageTestCase):
+    """Tests for DocumentPersistence with binary serializers."""
+
+    def test_save_and_load(self):
+        doc = Document({})
+        doc["foo"] = [1, {"bar": u"\u017c"}]
+        persistence = DocumentPersistence(
+            doc, FileStorage(self.pathname), MessagePack)
+        persistence.save()
+        with open(self.pathname, 'rb') as stream:
+            self.assertEqual(stream.read(), MessagePack.dumps(doc.value))
+        other = Document({})
+        DocumentPersistence(
+            other, FileStorage(self.pathname), MessagePack).load()
+        self.assertEqual(other.value, doc.value)
+
+    def test_text_storage_refuses_binary_data(self):
+        persistence = DocumentPersistence(
+            Document({}), MemoryStorage(), MessagePack)
+        self.assertRaises(NotImplementedError, persistence.load)
+
+    def test_binary_capability(self):
+        self.assertTrue(FileStorage(self.pathname).binary)
+        self.assertTrue(JournalStorage(self.pathname).binary)
+        self.assertFalse(MemoryStorage().binary)
+        storage = SQLiteStorage(":memory:")
+        self.addCleanup(storage.close)
+        self.assertFalse(storage.binary)
+
+
+class PartialPersistenceTests(TestCase):
+    """Tests for partial loading in DocumentPersistence."""
+
+    def setUp(self):
+        super(PartialPersistenceTests, self).setUp()
+        self.storage = MemoryStorage(JSON.dumps({
+            "format": "1.0",
+            "runs": {"first": {"id": 1}, "second": {"id": 2}},
+            "attachments": ["a" * 100]}))
+        self.doc = Document({})
+        self.persistence = DocumentPersistence(self.doc, self.storage, JSON)
+
+    def test_load_only_marks_document_as_partial(self):
+        self.persistence.load(only=["/runs/first"])
+        self.assertTrue(self.doc.is_partial)
+        self.assertEqual(self.doc.projection, ["/runs/first"])
+        self.assertEqual(self.doc.value, {"runs": {"first": {"id": 1}}})
+
+    def test_full_load_is_not_partial(self):
+        self.persistence.load(only=["/runs"])
+        self.persistence.load()
+        self.assertFalse(self.doc.is_partial)
+        self.assertIsNone(self.doc.projection)
+
+    def test_partial_document_refuses_save(self):
+        self.persistence.load(only=["/format"])
+        self.doc["format"] = "2.0"
+        self.assertRaises(PartialDocumentError, self.persistence.save)
+        self.assertEqual(self.storage.writes, 0)
+
+    def test_partial_document_merge_save(self):
+        self.persistence.load(only=["/format", "/runs/second"])
+        self.doc["format"] = "2.0"
+        del self.doc["runs"]["second"]
+        self.persistence.save(merge=True)
+        self.assertEqual(JSON.loads(self.storage.data), {
+            "format": "2.0",
+            "runs": {"first": {"id": 1}},
+            "attachments": ["a" * 100]})
+        self.assertFalse(self.persistence.is_dirty)
+        self.assertTrue(self.doc.is_partial)
+
+    def test_merge_save_inside_array(self):
+        self.storage.write(JSON.dumps(
+            {"format": "1.0", "list": [{"id": 1}, {"id": 2}]}))
+        self.persistence.load(only=["/list/0/id"])
+        # The whole array was loaded
+        self.assertEqual(self.doc["list"].value, [{"id": 1}, {"id": 2}])
+        self.doc["list"][1]["id"] = 3
+        self.doc["list"][0]["id"] = 4
+        self.persistence.save(merge=True)
+        self.assertEqual(JSON.loads(self.storage.data), {
+            "format": "1.0", "list": [{"id": 4}, {"id": 3}]})
+
+
+class JournalStorageTests(StorageTestCase):
+    """Tests for JournalStorage."""
+
+    def test_write_resets_journal(self):
+        storage = JournalStorage(self.pathname)
+        storage.write(u"foo")
+        storage.append_journal(u"bar\n")
+        self.assertEqual(storage.read_journal(), [u"bar\n"])
+        storage.write(u"froz")
+        self.assertEqual(storage.read(), u"froz")
+        self.assertEqual(storage.read_journal(), [])
+
+    def test_missing_journal(self):
+        storage = JournalStorage(self.pathname)
+        with open(self.pathname, 'wb') as stream:
+            stream.write(b"foo")
+        self.assertIsNone(storage.read_journal())
+        self.assertEqual(storage.journal_size(), 0)
+
+    def test_journal_of_other_snapshot_is_ignored(self):
+        storage = JournalStorage(self.pathname)
+        storage.write(u"foo")
+        storage.append_journal(u"bar\n")
+        # As if the journal was not reset after the snapshot was replaced
+        FileStorage(self.pathname).write(u"froz")
+        self.assertIsNone(storage.read_journal())
+
+
+class JournalPersistenceTests(StorageTestCase):
+    """Tests for JournalPersistence."""
+
+    class TestDocument(Document):
+        document_schema = {
+            "type": "object",
+            "properties": {
+                "settings": {"type": "object", "default": {"a": 1}}}}
+
+    def setUp(self):
+        super(JournalPersistenceTests, self).setUp()
+        self.doc = self.TestDocument({"foo": {"bar": [1, 2, 3]}, "froz": 1})
+        self.persistence = self.make_persistence(self.doc)
+        self.persistence.save()
+
+    def make_persistence(self, doc, compact_ratio=100):
+        return JournalPersistence(
+            doc, JournalStorage(self.pathname), JSON, compact_ratio)
+
+    def reload(self):
+        doc = self.TestDocument({})
+        self.make_persistence(doc).load()
+        return doc
+
+    def test_first_save_writes_snapshot(self):
+        self.assertEqual(JSON.loads(self.read_file()), self.doc.value)
+        self.assertEqual(self.persistence.storage.read_journal(), [])
+
+    def test_save_appends_modified_values(self):
+        snapshot = self.read_file()
+        self.doc["foo"]["bar"][1] = 5
+        self.doc["foo"]["baz"] = "x"
+        del self.doc["froz"]
+        self.persistence.save()
+        self.assertEqual(self.read_file(), snapshot)
+        lines = self.persistence.storage.read_journal()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(JSON.loads(lines[0]), {"ops": [
+            {"op": "set", "path": "/foo/bar/1", "value": 5},
+            {"op": "remove", "path": "/foo/baz"},
+            {"op": "set", "path": "/foo/baz", "value": "x"},
+            {"op": "remove", "path": "/froz"}]})
+        self.assertEqual(self.reload().value, self.doc.value)
+
+    def test_nested_changes_are_collapsed(self):
+        self.doc["foo"]["bar"][0] = 7
+        self.doc["foo"] = {"new": True}
+        self.doc["foo"]["new"] = False
+        self.persistence.save()
+        lines = self.persistence.storage.read_journal()
+        self.assertEqual(JSON.loads(lines[0]), {"ops": [
+            {"op": "set", "path": "/foo", "value": {"new": False}}]})
+
+    def test_list_item_removal(self):
+        del self.doc["foo"]["bar"][0]
+        self.doc["foo"]["bar"][0] = 9
+        self.persistence.save()
+        self.assertEqual(self.reload().value, self.doc.value)
+
+    def test_key_order_is_preserved(self):
+        del self.doc["foo"]
+        self.doc["foo"] = 1
+        self.persistence.save()
+        self.assertEqual(
+            list(self.reload().value.keys()), list(self.doc.value.keys()))
+
+    def test_default_values(self):
+        self.doc["settings"]["b"] = 2
+        self.persistence.save()
+        self.assertEqual(
+            self.reload().value["settings"], {"a": 1, "b": 2})
+        self.doc["settings"].revert_to_default()
+        self.persistence.save()
+        self.assertNotIn("settings", self.reload().value)
+
+    def test_compaction(self):
+        persistence = self.make_persistence(self.doc, compact_ratio=0.1)
+        persistence.load()
+        persistence.document["froz"] = 2
+        persistence.save()
+        self.assertEqual(persistence.storage.read_journal(), [])
+        self.assertEqual(JSON.loads(self.read_file())["froz"], 2)
+
+    def test_torn_line_is_ignored(self):
+        self.doc["froz"] = 2
+        self.persistence.save()
+        self.persistence.storage.append_journal(u'{"ops": [{"op": "se')
+        doc = self.reload()
+        self.assertEqual(doc.value, self.doc.value)
+        persistence = self.make_persistence(doc)
+        persistence.load()
+        doc["froz"] = 3
+        persistence.save()
+        # The journal is reset instead of appending to the torn line
+        self.assertEqual(persistence.storage.read_journal(), [])
+        self.assertEqual(self.reload().value["froz"], 3)
+
+    def test_close(self):
+        doc = Document({})
+        with self.make_persistence(doc) as persistence:
+            self.assertEqual(doc._observers, [persistence._changes])
+        self.assertEqual(doc._observers, [])
+        persistence.close()
+
+
+class SQLiteStorageTests(TestCase):
+    """Tests for SQLiteStorage and SQLitePersistence."""
+
+    value = {
+        "format": "1.0",
+        "runs": [{"id": 1, "results": {"a": 1}}, {"id": 2}],
+        "attachments": {"log": "x" * 100, "a/b": None}}
+
+    def setUp(self):
+        super(SQLiteStorageTests, self).setUp()
+        self.connection = sqlite3.connect(":memory:")
+        self.addCleanup(self.connection.close)
+        self.storage = SQLiteStorage(self.connection, depth=2)
+        self.storage.store(self.value)
+
+    def rows(self):
+        return dict(self.connection.execute(
+            "SELECT pointer, data FROM json_document"))
+
+    def test_rows(self):
+        self.assertEqual(self.rows(), {
+            "": None,
+            "/format": '"1.0"',
+            "/runs": None,
+            "/runs/0": '{"id":1,"results":{"a":1}}',
+            "/runs/1": '{"id":2}',
+            "/attachments": None,
+            "/attachments/log": '"' + "x" * 100 + '"',
+            "/attachments/a~1b": "null"})
+
+    def test_load_retains_order(self):
+        obj = self.storage.load()
+        self.assertEqual(obj, self.value)
+        self.assertEqual(list(obj.keys()), ["format", "runs", "attachments"])
+
+    def test_read_and_write(self):
+        self.storage.write(u'{"foo": [1, 2.5]}')
+        self.assertEqual(JSON.loads(self.storage.read()), {"foo": [1, 2.5]})
+
+    def test_missing_document(self):
+        storage = SQLiteStorage(self.connection, name="other")
+        self.assertRaises(KeyError, storage.load)
+
+    def test_load_only(self):
+        self.assertEqual(
+            self.storage.load(["/runs/0/results", "/attachments/a~1b"]),
+            {"runs": self.value["runs"], "attachments": {"a/b": None}})
+        self.assertEqual(self.storage.load(["/attachments/missing"]),
+                         {"attachments": {}})
+
+    def test_load_only_inside_row(self):
+        storage = SQLiteStorage(self.connection, depth=1)
+        storage.store(self.value)
+        self.assertEqual(storage.load(["/attachments/log"]),
+                         {"attachments": {"log": "x" * 100}})
+
+    def test_apply_updates_only_modified_rows(self):
+        self.storage.apply([
+            {"op": "set", "path": "/runs/0/id", "value": 3},
+            {"op": "remove", "path": "/attachments/log"},
+            {"op": "set", "path": "/attachments/new", "value": [1]}])
+        rows = self.rows()
+        self.assertEqual(rows["/runs/0"], '{"id":3,"results":{"a":1}}')
+        self.assertNotIn("/attachments/log", rows)
+        self.assertEqual(
+            list(self.storage.load()["attachments"].items()),
+            [("a/b", None), ("new", [1])])
+
+    def test_persistence_saves_modified_values(self):
+        doc = Document({})
+        persistence = SQLitePersistence(doc, self.storage)
+        persistence.load()
+        doc["runs"][1]["id"] = 5
+        doc["format"] = "2.0"
+        persistence.save()
+        self.assertFalse(persistence.is_dirty)
+        other = Document({})
+        SQLitePersistence(other, self.storage).load()
+        self.assertEqual(other.value, doc.value)
+
+    def test_persistence_saves_partial_document(self):
+        doc = Document({})
+        persistence = SQLitePersistence(doc, self.storage)
+        persistence.load(only=["/format"])
+        self.assertTrue(doc.is_partial)
+        doc["format"] = "2.0"
+        persistence.save()
+        value = self.storage.load()
+        self.assertEqual(value["format"], "2.0")
+        self.assertEqual(value["runs"], self.value["runs"])
+
+    def test_partial_document_value_cannot_be_replaced(self):
+        doc = Document({})
+        persistence = SQLitePersistence(doc, self.storage)
+        persistence.load(only=["/format"])
+        doc.value = {}
+        self.assertRaises(PartialDocumentError, persistence.save)
+
+    def test_new_document_is_stored(self):
+        doc = Document({"foo": 1})
+        storage = SQLiteStorage(self.connection, name="new")
+        SQLitePersistence(doc, storage).save()
+        self.assertEqual(storage.load(), {"foo": 1})
+
+    def test_persistence_close(self):
+        doc = Document({})
+        storage = SQLiteStorage(":memory:")
+        with SQLitePersistence(doc, storage) as persistence:
+            self.assertEqual(doc._observers, [persistence._changes])
+        self.assertEqual(doc._observers, [])
+        self.assertRaises(sqlite3.ProgrammingError, storage.load)
+
+    def test_persistence_load_only_if_modified(self):
+        doc = Document({})
+        persistence = SQLitePersistence(doc, self.storage)
+        self.assertTrue(persistence.load())
+        fragment = doc["runs"]
+        self.assertFalse(persistence.load())
+        self.assertIs(doc["runs"], fragment)
+        self.assertTrue(persistence.load(force=True))
+        self.assertTrue(persistence.load(only=["/format"]))
+        self.assertFalse(persistence.load(only=["/format"]))
+        # Modified behind the back of the persistence
+        self.storage.apply([{"op": "set", "path": "/format", "value": "3"}])
+        self.assertTrue(persistence.load(only=["/format"]))
+        self.assertEqual(doc["format"].value, "3")
+        doc["format"] = "4"
+        persistence.save()
+        self.assertFalse(persistence.load(only=["/format"]))
+
+    def test_fingerprint_includes_other_connections(self):
+        dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirname)
+        database = os.path.join(dirname, "db.sqlite")
+        storage = SQLiteStorage(database)
+        self.addCleanup(storage.close)
+        storage.store(self.value)
+        fingerprint = storage.fingerprint(content=True)
+        self.assertEqual(storage.fingerprint(content=True), fingerprint)
+        other = SQLiteStorage(database)
+        self.addCleanup(other.close)
+        other.apply([{"op": "set", "path": "/format", "value": "2.0"}])
+        self.assertNotEqual(storage.fingerprint(), fingerprint[:2])
+
+
+class DirectoryStorageTests(StorageTestCase):
+    """Tests for DirectoryStorage and DirectoryPersistence."""
+
+    def setUp(self):
+        super(DirectoryStorageTests, self).setUp()
+        self.pathname = os.path.join(self.dirname, "document")
+        self.doc = Document(
+            {"runs": [1, 2], "meta": {"a": 1}, ".x/y": None})
+        self.persistence = self.make_persistence(self.doc)
+        self.persistence.save()
+
+    def make_persistence(self, doc, lazy=True):
+        return DirectoryPersistence(
+            doc, DirectoryStorage(self.pathname), JSON, lazy)
+
+    def section_mtimes(self):
+        return dict(
+            (name, os.stat(os.path.join(self.pathname, name)).st_mtime)
+            for name in os.listdir(self.pathname))
+
+    def test_one_file_per_section(self):
+        self.assertEqual(
+            sorted(os.listdir(self.pathname)),
+            ["%2Ex%2Fy.json", ".index", "meta.json", "runs.json"])
+        storage = DirectoryStorage(self.pathname)
+        self.assertEqual(storage.keys(), ["runs", "meta", ".x/y"])
+        self.assertEqual(JSON.loads(storage.read()), self.doc.value)
+
+    def test_storage_write(self):
+        storage = DirectoryStorage(self.pathname)
+        storage.write(u'{"meta": 5}')
+        self.assertEqual(sorted(os.listdir(self.pathname)),
+                         [".index", "meta.json"])
+        self.assertEqual(JSON.loads(storage.read()), {"meta": 5})
+
+    def test_missing_directory(self):
+        storage = DirectoryStorage(
+            os.path.join(self.dirname, "missing"), ignore_missing=True)
+        self.assertEqual(storage.keys(), [])
+
+    def test_lazy_load(self):
+        doc = Document({})
+        persistence = self.make_persistence(doc)
+        persistence.load()
+        os.unlink(os.path.join(self.pathname, "runs.json"))
+        # Only the accessed section is read
+        self.assertEqual(doc["meta"]["a"].value, 1)
+        self.assertEqual(len(doc), 3)
+        self.assertIn("runs", doc)
+
+    def test_eager_load(self):
+        doc = Document({})
+        self.make_persistence(doc, lazy=False).load()
+        self.assertEqual(doc.value, self.doc.value)
+        self.assertEqual(doc._lazy_items, 0)
+
+    def test_save_writes_only_modified_sections(self):
+        doc = Document({})
+        persistence = self.make_persistence(doc)
+        persistence.load()
+        # Make any rewrite visible in modification times
+        for name in os.listdir(self.pathname):
+            os.utime(os.path.join(self.pathname, name), (0, 0))
+        doc["meta"]["b"] = 2
+        persistence.save()
+        mtimes = self.section_mtimes()
+        self.assertNotEqual(mtimes.pop("meta.json"), 0)
+        self.assertEqual(set(mtimes.values()), set([0]))
+        other = Document({})
+        self.make_persistence(other).load()
+        self.assertEqual(other.value["meta"], {"a": 1, "b": 2})
+
+    def test_load_only_if_modified(self):
+        doc = Document({})
+        persistence = DirectoryPersistence(
+            doc, DirectoryStorage(self.pathname), JSON, check_content=True)
+        self.assertTrue(persistence.load())
+        self.assertFalse(persistence.load())
+        self.assertTrue(persistence.load(force=True))
+        self.persistence.storage.section("meta").write(u'{"a": 2}')
+        self.assertTrue(persistence.load())
+        self.assertEqual(doc["meta"]["a"].value, 2)
+        doc["runs"] = []
+        persistence.save()
+        self.assertFalse(persistence.load())
+
+    def test_close(self):
+        doc = Document({})
+        with self.make_persistence(doc) as persistence:
+            persistence.load()
+            self.assertEqual(doc._observers, [persistence._changes])
+        self.assertEqual(doc._observers, [])
+        self.assertEqual(doc["meta"]["a"].value, 1)
+
+    def test_removed_sections(self):
+        del self.doc["runs"]
+        self.persistence.save()
+        self.assertNotIn("runs.json", os.listdir(self.pathname))
+        other = Document({})
+        self.make_persistence(other).load()
+        self.assertEqual(other.value, {"meta": {"a": 1}, ".x/y": None})
+
+
+class CollectionPersistenceTests(StorageTestCase):
+    """Tests for CollectionPersistence."""
+
+    class Record(Document):
+        document_schema = {
+            "type": "object",
+            "properties": {"id": {"type": "integer"}}}
+
+    def setUp(self):
+        super(CollectionPersistenceTests, self).setUp()
+        self.collection = CollectionPersistence(
+            FileStorage(self.pathname, ignore_missing=True), JSONLines,
+            self.Record)
+
+    def test_empty_collection(self):
+        self.assertEqual(list(self.collection), [])
+
+    def test_append_and_iterate(self):
+        self.collection.append({"id": 1}, self.Record({"id": 2}))
+        self.collection.append({"id": 3})
+        records = list(self.collection)
+        self.assertEqual([record.value for record in records],
+                         [{"id": 1}, {"id": 2}, {"id": 3}])
+        for record in records:
+            self.assertIsInstance(record, self.Record)
+            record.validate()
+
+    def test_append_after_unterminated_line(self):
+        with open(self.pathname, 'wb') as stream:
+            stream.write(b'{"id": 1}')
+        self.collection.append({"id": 2})
+        self.assertEqual([record.value for record in self.collection],
+                         [{"id": 1}, {"id": 2}])
+
+    def test_load_many_shares_schema(self):
+        self.collection.append(*[{"id": i} for i in range(5)])
+        batches = list(self.collection.load_many(batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertIs(batches[0][0]._schema, batches[2][0]._schema)
@@ -0,0 +1,158 @@
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests for the document watcher."""
+
+import os
+import shutil
+import tempfile
+import time
+
+from unittest2 import TestCase
+
+from json_document.document import (
+    Document,
+    DocumentPersistence,
+    JournalPersistence)
+from json_document.serializers import JSON
+from json_document.storage import FileStorage, JournalStorage
+from json_document.watcher import Watcher
+
+
+class WatcherTestsMixIn(object):
+
+    use_inotify = None
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.changes = []
+        self.errors = []
+        self.watcher = Watcher(
+            callback=lambda persistence, revision: self.changes.append(
+                (persistence, revision)),
+            on_error=lambda persistence, exc: self.errors.append(exc),
+            delay=0.05, max_delay=0.5, interval=0,
+            use_inotify=self.use_inotify)
+        if self.use_inotify and not self.watcher.uses_inotify:
+            self.skipTest("inotify is not available")
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.dirname)
+
+    def _make(self, name, value):
+        pathname = os.path.join(self.dirname, name)
+        FileStorage(pathname).write(JSON.dumps(value))
+        persistence = DocumentPersistence(
+            Document({}), FileStorage(pathname), JSON)
+        persistence.load()
+        self.watcher.watch(persistence)
+        return persistence
+
+    def _write(self, persistence, value):
+        FileStorage(persistence.storage.pathname, atomic=True).write(
+            JSON.dumps(value))
+        # Make sure stat() sees a different modification time
+        os.utime(persistence.storage.pathname, None)
+
+    def _settle(self, duration=0.2):
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            self.watcher.run_once(0.01)
+
+    def test_reload(self):
+        persistence = self._make("a.json", {"a": 1})
+        self._write(persistence, {"a": 2})
+        self._settle()
+        self.assertEqual(persistence.document.value, {"a": 2})
+        self.assertEqual(
+            self.changes, [(persistence, persistence.document.revision)])
+
+    def test_burst_is_coalesced(self):
+        persistence = self._make("a.json", {"a": 0})
+        for i in range(1, 5):
+            self._write(persistence, {"a": i})
+            self.watcher.run_once(0)
+        self._settle()
+        self.assertEqual(persistence.document.value, {"a": 4})
+        self.assertEqual(len(self.changes), 1)
+
+    def test_only_changed_documents_are_reloaded(self):
+        first = self._make("a.json", {"a": 1})
+        second = self._make("b.json", {"b": 1})
+        self._write(second, {"b": 2})
+        self._settle()
+        self.assertEqual([p for p, revision in self.changes], [second])
+        self.assertEqual(first.document.value, {"a": 1})
+
+    def test_unwatch(self):
+        persistence = self._make("a.json", {"a": 1})
+        self.watcher.unwatch(persistence)
+        self._write(persistence, {"a": 2})
+        self._settle()
+        self.assertEqual(persistence.document.value, {"a": 1})
+        self.assertEqual(self.changes, [])
+
+    def test_own_save_is_not_reported(self):
+        persistence = self._make("a.json", {"a": 1})
+        persistence.document["a"] = 2
+        persistence.save()
+        self._settle()
+        self.assertEqual(self.changes, [])
+
+    def test_errors(self):
+        persistence = self._make("a.json", {"a": 1})
+        FileStorage(persistence.storage.pathname).write(u"{")
+        os.utime(persistence.storage.pathname, None)
+        self._settle()
+        self.assertEqual(len(self.errors), 1)
+        self.assertEqual(self.changes, [])
+        self._write(persistence, {"a": 2})
+        self._settle()
+        self.assertEqual(persistence.document.value, {"a": 2})
+
+    def test_journal(self):
+        pathname = os.path.join(self.dirname, "a.json")
+        writer = JournalPersistence(
+            Document({}), JournalStorage(pathname), JSON)
+        writer.save()
+        reader = JournalPersistence(
+            Document({}), JournalStorage(pathname), JSON)
+        reader.load()
+        self.watcher.watch(reader)
+        writer.document["a"] = 1
+        writer.save()
+        self._settle()
+        self.assertEqual(reader.document.value, {"a": 1})
+        self.assertEqual(len(self.changes), 1)
+
+    def test_background_thread(self):
+        persistence = self._make("a.json", {"a": 1})
+        self.watcher.interval = 0.01
+        with self.watcher:
+            self._write(persistence, {"a": 2})
+            deadline = time.time() + 5
+            while not self.changes and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(persistence.document.value, {"a": 2})
+
+
+class PollingWatcherTests(WatcherTestsMixIn, TestCase):
+
+    use_inotify = False
+
+
+class InotifyWatcherTests(WatcherTestsMixIn, TestCase):
+
+    use_inotify = True
@@ -0,0 +1,374 @@
+# Copyright (C) 2010, 2011 Linaro Limited
+#
+# Author: Zygmunt Krynicki <zygmunt.krynicki@linaro.org>
+#
+# This file is part of json-document
+#
+# json-document is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# as published by the Free Software Foundation
+#
+# json-document is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with json-document.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+json_document.watcher
+---------------------
+
+Automatic reloading of documents when their files change
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+
+class _Inotify(object):
+    """
+    Minimal ctypes wrapper around the Linux inotify API
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+            | IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+    _event = struct.Struct("iIII")
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self._libc = ctypes.CDLL(
+            ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            self._raise()
+
+    def _raise(self):
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, pathname):
+        if not isinstance(pathname, bytes):
+            pathname = pathname.encode(sys.getfilesystemencoding())
+        wd = self._libc.inotify_add_watch(self._fd, pathname, self.MASK)
+        if wd < 0:
+            self._raise()
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read_events(self):
+        """
+        Read pending events as a list of (wd, mask, name) tuples
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as exc:
+                if exc.errno in (errno.EAGAIN, errno.EINTR):
+                    return events
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self._event.unpack_from(
+                    data, offset)
+                offset += self._event.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        os.close(self._fd)
+
+
+class Watcher(object):
+    """
+    Reload documents when their files change.
+
+    Documents are watched through their persistence objects (see
+    :meth:`watch()`), typically
+    :class:`~json_document.document.DocumentPersistence` with
+    :class:`~json_document.storage.FileStorage`. All of them are handled by
+    one background thread, started with :meth:`start()`.
+
+    On Linux changes are detected with inotify, each directory that holds
+    watched files is watched once. Elsewhere (or if use_inotify is False)
+    the files are checked with os.stat() every interval seconds.
+
+    Bursts of changes are coalesced: a document is reloaded delay seconds
+    after the last change of its file, but no later than max_delay seconds
+    after the first one. Reloading calls the load() method of the
+    persistence which (since it is conditional) does nothing if the file
+    is back to the state that was last loaded or saved. Each time a reload
+    changes the document callback is called with the persistence and the
+    new document revision.
+
+    Callbacks are called from the watcher thread. Documents are not
+    thread-safe, the application is responsible for coordinating access to
+    documents that are reloaded in the background. Exceptions raised while
+    reloading (for example when a writer that does not replace files
+    atomically has not finished writing yet) are passed to on_error,
+    together with the persistence, or ignored if it is None. The document
+    is reloaded again on the next change of its file.
+
+    Files written by such writers must not be memory-mapped: a file that is
+    truncated while it is mapped kills the reader with SIGBUS instead of
+    raising an exception. :class:`~json_document.storage.FileStorage` only
+    maps files in atomic mode (or with use_mmap=True), use it that way only
+    if all writers replace the file atomically.
+    """
+
+    def __init__(self, callback=None, delay=0.05, max_delay=1.0,
+                 interval=1.0, use_inotify=True, on_error=None):
+        self.callback = callback
+        self.delay = delay
+        self.max_delay = max_delay
+        self.interval = interval
+        self.on_error = on_error
+        self._lock = threading.Lock()
+        # Maps watched pathnames to lists of persistence objects
+        self._paths = {}
+        # Maps persistence objects to (first change, reload time) pairs
+        self._pending = {}
+        # Maps pathnames to stat results (for polling)
+        self._stats = {}
+        self._thread = None
+        self._stopping = threading.Event()
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = _Inotify()
+            except (OSError, AttributeError):
+                # No inotify (or no inotify symbols in libc)
+                pass
+        # Maps directories to inotify watch descriptors and back
+        self._dirs = {}
+        self._wds = {}
+        self._wakeup = os.pipe() if self._inotify is not None else None
+
+    @property
+    def uses_inotify(self):
+        return self._inotify is not None
+
+    @staticmethod
+    def _get_pathnames(persistence):
+        storage = persistence.storage
+        pathnames = [storage.pathname]
+        journal_pathname = getattr(storage, "journal_pathname", None)
+        if journal_pathname is not None:
+            pathnames.append(journal_pathname)
+        return [os.path.abspath(pathname) for pathname in pathnames]
+
+    @staticmethod
+    def _stat(pathname):
+        try:
+            info = os.stat(pathname)
+        except OSError:
+            return None
+        return (getattr(info, 'st_mtime_ns', info.st_mtime), info.st_size,
+                info.st_ino, info.st_dev)
+
+    def watch(self, persistence):
+        """
+        Start watching the file(s) of persistence.storage
+        """
+        pathnames = self._get_pathnames(persistence)
+        with self._lock:
+            for pathname in pathnames:
+                self._paths.setdefault(pathname, []).append(persistence)
+                self._stats[pathname] = self._stat(pathname)
+                dirname = os.path.dirname(pathname)
+                if self._inotify is not None and dirname not in self._dirs:
+                    wd = self._inotify.add_watch(dirname)
+                    self._dirs[dirname] = wd
+                    self._wds[wd] = dirname
+
+    def unwatch(self, persistence):
+        """
+        Stop watching the file(s) of persistence.storage
+        """
+        with self._lock:
+            self._pending.pop(persistence, None)
+            for pathname in self._get_pathnames(persistence):
+                watchers = self._paths.get(pathname, [])
+                if persistence in watchers:
+                    watchers.remove(persistence)
+                if watchers:
+                    continue
+                self._paths.pop(pathname, None)
+                self._stats.pop(pathname, None)
+                dirname = os.path.dirname(pathname)
+                if (self._inotify is not None and dirname in self._dirs
+                        and not any(os.path.dirname(other) == dirname
+                                    for other in self._paths)):
+                    wd = self._dirs.pop(dirname)
+                    del self._wds[wd]
+                    self._inotify.rm_watch(wd)
+
+    def _changed(self, pathname, now):
+        """
+        Schedule reloading of documents stored in pathname
+        """
+        for persistence in self._paths.get(pathname, ()):
+            first = self._pending.get(persistence, (now, None))[0]
+            self._pending[persistence] = (
+                first, min(now + self.delay, first + self.max_delay))
+
+    def _read_events(self, now):
+        events = self._inotify.read_events()
+        with self._lock:
+            for wd, mask, name in events:
+                if mask & _Inotify.IN_Q_OVERFLOW:
+                    # Some events were lost, check everything
+                    for pathname in self._paths:
+                        self._changed(pathname, now)
+                    continue
+                dirname = self._wds.get(wd)
+                if dirname is None or not name:
+                    continue
+                pathname = os.path.join(
+                    dirname, name.decode(sys.getfilesystemencoding()))
+                self._changed(pathname, now)
+
+    def _poll(self, now):
+        with self._lock:
+            for pathname, old_stat in list(self._stats.items()):
+                new_stat = self._stat(pathname)
+                if new_stat != old_stat:
+                    self._stats[pathname] = new_stat
+                    self._changed(pathname, now)
+
+    def _reload(self, persistence):
+        revision = persistence.document.revision
+        try:
+            persistence.load()
+        except Exception as exc:
+            if self.on_error is not None:
+                self.on_error(persistence, exc)
+            return
+        if (persistence.document.revision != revision
+                and self.callback is not None):
+            self.callback(persistence, persistence.document.revision)
+
+    def _reload_due(self, now):
+        """
+        Reload documents whose time has come
+
+        Returns the time of the next scheduled reload (or None).
+        """
+        with self._lock:
+            due = [persistence
+                   for persistence, (first, deadline) in self._pending.items()
+                   if deadline <= now]
+            for persistence in due:
+                del self._pending[persistence]
+        for persistence in due:
+            self._reload(persistence)
+        with self._lock:
+            if self._pending:
+                return min(deadline for first, deadline
+                           in self._pending.values())
+
+    def run_once(self, timeout=0):
+        """
+        Wait (at most timeout seconds) for changes and process them.
+
+        This is what the background thread does in a loop. It can be called
+        directly by applications that have their own main loop instead.
+        """
+        now = time.time()
+        if self._inotify is not None:
+            readable = select.select(
+                [self._inotify, self._wakeup[0]], [], [], timeout)[0]
+            now = time.time()
+            if self._inotify in readable:
+                self._read_events(now)
+            if self._wakeup[0] in readable:
+                os.read(self._wakeup[0], 4096)
+        else:
+            self._stopping.wait(timeout)
+            now = time.time()
+            self._poll(now)
+        return self._reload_due(now)
+
+    def _run(self):
+        next_reload = None
+        while not self._stopping.is_set():
+            now = time.time()
+            if next_reload is not None:
+                timeout = max(0, next_reload - now)
+                if self._inotify is None:
+                    timeout = min(timeout, self.interval)
+            elif self._inotify is not None:
+                timeout = None
+            else:
+                timeout = self.interval
+            next_reload = self.run_once(timeout)
+
+    def start(self):
+        """
+        Start the background thread
+        """
+        if self._thread is not None:
+            raise ValueError("The watcher is already running")
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread and wait for it to finish
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        if self._wakeup is not None:
+            os.write(self._wakeup[1], b"x")
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        """
+        Stop the watcher and release its resources
+        """
+        self.stop()
+        if self._inotify is not None:
+            self._inotify.close()
+            os.close(self._wakeup[0])
+            os.close(self._wakeup[1])
+            self._inotify = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()